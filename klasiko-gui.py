@@ -15,25 +15,162 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
 import os
 import sys
+import io
+import json
+import time
+import base64
+import queue
+import contextlib
 import subprocess
 import threading
+import traceback
 from pathlib import Path
 
+# Share of the progress bar covered by each conversion stage (start %, end %)
+PROGRESS_STAGE_RANGES = {
+    'read': (0, 5),
+    'process': (5, 10),
+    'build': (10, 15),
+    'render': (15, 95),
+    'finalize': (95, 100),
+}
+
 # Import klasiko if available (for embedded version)
+# klasiko exits on missing dependencies, so SystemExit means "not usable in-process"
 try:
     import klasiko
     KLASIKO_EMBEDDED = True
-except ImportError:
+except (ImportError, SystemExit):
     KLASIKO_EMBEDDED = False
 
 
+class LineWriter(io.TextIOBase):
+    """File-like object that hands each completed line of output to a callback"""
+
+    def __init__(self, callback, partial_callback=None):
+        super().__init__()
+        self.callback = callback
+        self.partial_callback = partial_callback
+        self.pending = ''
+
+    def write(self, text):
+        self.pending += text
+        while '\n' in self.pending:
+            line, self.pending = self.pending.split('\n', 1)
+            self.callback(line)
+        return len(text)
+
+    def flush(self):
+        # Progress steps print "[4/5] Generating PDF..." without a newline
+        if self.partial_callback and self.pending.strip():
+            self.partial_callback(self.pending.strip())
+
+    def finish(self):
+        """Emit any trailing text that never got a newline"""
+        if self.pending:
+            self.callback(self.pending)
+        self.pending = ''
+
+
+class ConversionWorker:
+    """
+    Background threads that run conversions and previews in-process.
+
+    The conversion engine is imported once and WeasyPrint, fonts and theme CSS
+    stay loaded between jobs, so only the first conversion pays the cold start.
+    Previews have their own thread (with their own font configuration, as
+    Pango font maps must not be shared between threads), so switching themes
+    stays quick while a conversion runs. Callbacks run on the worker threads;
+    callers marshal to Tk with root.after.
+    """
+
+    def __init__(self, warm_theme='warm'):
+        self.jobs = queue.Queue()
+        self.preview_lock = threading.Lock()
+        self.preview_wanted = threading.Condition(self.preview_lock)
+        self.pending_preview = None
+        # Bumped by every request and cancel; a running preview stops once it is stale
+        self.preview_generation = 0
+        self.thread = threading.Thread(target=self._run, args=(warm_theme,), daemon=True)
+        self.thread.start()
+        self.preview_thread = threading.Thread(target=self._run_previews, daemon=True)
+        self.preview_thread.start()
+
+    def submit(self, options, on_output, on_done, on_status=None):
+        """Queue a conversion; options are keyword arguments for convert_md_to_pdf()"""
+        self.jobs.put((options, on_output, on_done, on_status))
+
+    def request_preview(self, options, on_done):
+        """
+        Queue a preview; options are keyword arguments for render_preview().
+        A newer request replaces one that hasn't started yet and cancels a
+        running one. on_done receives (png_images, error_message).
+        """
+        with self.preview_lock:
+            self.preview_generation += 1
+            self.pending_preview = (self.preview_generation, options, on_done)
+            self.preview_wanted.notify()
+
+    def cancel_preview(self):
+        """Drop a queued preview and stop a running one at its next step"""
+        with self.preview_lock:
+            self.preview_generation += 1
+            self.pending_preview = None
+
+    def _preview_cancelled(self, generation):
+        return generation != self.preview_generation
+
+    def _run_previews(self):
+        font_config = None
+        while True:
+            with self.preview_lock:
+                while self.pending_preview is None:
+                    self.preview_wanted.wait()
+                (generation, options, on_done), self.pending_preview = self.pending_preview, None
+
+            # No stdout redirect here: it is process-wide and would swallow a running conversion's log
+            try:
+                if font_config is None:
+                    font_config = klasiko.FontConfiguration()
+                images = klasiko.render_preview(
+                    cancelled=lambda: self._preview_cancelled(generation), font_config=font_config, **options
+                )
+            except klasiko.PreviewCancelled:
+                continue
+            except Exception as e:
+                on_done([], str(e))
+            else:
+                on_done(images, None)
+
+    def _run(self, warm_theme):
+        # Warm up while the user is still filling in the form
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                klasiko.warm_up(warm_theme)
+        except Exception:
+            pass  # A failed warm-up only costs speed; the real error surfaces on convert
+
+        while True:
+            options, on_output, on_done, on_status = self.jobs.get()
+            writer = LineWriter(on_output, on_status)
+            try:
+                with contextlib.redirect_stdout(writer), contextlib.redirect_stderr(writer):
+                    success = klasiko.convert_md_to_pdf(**options)
+            except Exception:
+                for line in traceback.format_exc().splitlines():
+                    on_output(line)
+                success = False
+            writer.finish()
+            on_done(success)
+
+
 class KlasikoGUI:
     """Main GUI application for Klasiko PDF Converter"""
 
     def __init__(self, root):
         self.root = root
         self.root.title("Klasiko PDF Converter")
-        self.root.geometry("800x900")
+        self.root.geometry("1150x900")
 
         # Set icon if available
         self.set_icon()
@@ -52,8 +189,23 @@ class KlasikoGUI:
         self.logo_placements = []
         self.placement_vars = {}
 
+        # In-process conversion worker (falls back to the klasiko executable)
+        self.worker = ConversionWorker(self.theme.get()) if KLASIKO_EMBEDDED else None
+        self.logo_cache = {}
+
+        # Progress bar state (fed by klasiko progress events)
+        self.progress_started = None
+        self.render_started = None
+        self.estimated_pages = None
+
+        # Live preview state
+        self.preview_after_id = None
+        self.preview_generation = 0
+        self.preview_images = []
+
         # Create UI
         self.create_widgets()
+        self.watch_preview_options()
 
     def set_icon(self):
         """Set window icon if available"""
@@ -79,6 +231,16 @@ class KlasikoGUI:
         self.root.rowconfigure(0, weight=1)
         main_frame.columnconfigure(1, weight=1)
 
+        # Preview pane (right-hand side)
+        preview_frame = ttk.LabelFrame(self.root, text="Preview", padding="10")
+        preview_frame.grid(row=0, column=1, sticky=(tk.N, tk.S), padx=(0, 10), pady=10)
+
+        self.preview_status = tk.StringVar(value="Select a Markdown file to preview")
+        ttk.Label(preview_frame, textvariable=self.preview_status, wraplength=300).pack(anchor=tk.W)
+
+        self.preview_pages = ttk.Frame(preview_frame)
+        self.preview_pages.pack(fill=tk.BOTH, expand=True, pady=(10, 0))
+
         row = 0
 
         # Title
@@ -120,7 +282,8 @@ class KlasikoGUI:
         themes = [
             ("Default (Clean & Professional)", "default"),
             ("Warm (Vintage Amber - Default)", "warm"),
-            ("Rustic (Earth Tones)", "rustic")
+            ("Rustic (Earth Tones)", "rustic"),
+            ("Clean (Modern Sans-Serif)", "clean")
         ]
 
         for text, value in themes:
@@ -221,6 +384,14 @@ class KlasikoGUI:
                              sticky=(tk.W, tk.E))
         row += 1
 
+        # Progress bar with ETA
+        self.progress_bar = ttk.Progressbar(main_frame, mode='determinate', maximum=100)
+        self.progress_bar.grid(row=row, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(0, 5))
+        self.progress_text = tk.StringVar()
+        ttk.Label(main_frame, textvariable=self.progress_text, width=36).grid(
+            row=row, column=2, sticky=tk.W, padx=(10, 0), pady=(0, 5))
+        row += 1
+
         # Progress/Output section
         ttk.Label(main_frame, text="Output:", font=('Helvetica', 10, 'bold')).grid(
             row=row, column=0, sticky=tk.W, pady=(10, 5))
@@ -239,6 +410,68 @@ class KlasikoGUI:
                               relief=tk.SUNKEN, anchor=tk.W)
         status_bar.grid(row=row, column=0, columnspan=3, sticky=(tk.W, tk.E))
 
+    def watch_preview_options(self):
+        """Refresh the preview whenever an option that affects it changes"""
+        variables = [self.input_file, self.theme, self.toc_enabled, self.logo_file]
+        variables += list(self.placement_vars.values())
+        for variable in variables:
+            variable.trace_add('write', lambda *args: self.schedule_preview())
+
+    def schedule_preview(self, delay_ms=300):
+        """Debounce preview requests so rapid changes trigger a single render"""
+        if self.preview_after_id is not None:
+            self.root.after_cancel(self.preview_after_id)
+        self.preview_after_id = self.root.after(delay_ms, self.request_preview)
+
+    def request_preview(self):
+        """Send the current options to the worker for a thumbnail render"""
+        self.preview_after_id = None
+        self.preview_generation += 1
+        generation = self.preview_generation
+
+        if not self.worker:
+            self.preview_status.set("Preview requires klasiko to be importable")
+            return
+
+        try:
+            options = self.build_options()
+        except ValueError as e:
+            self.worker.cancel_preview()
+            self.preview_status.set(str(e))
+            return
+
+        preview_options = {
+            'input_file': options['input_file'],
+            'theme': options['theme'],
+            'enable_toc': options['enable_toc'],
+            'logo_data_uri': options['logo_data_uri'],
+            'logo_placements': options['logo_placements'],
+            'pages': 3 if options['enable_toc'] else 2,
+        }
+        self.preview_status.set(f"Rendering preview ({options['theme']} theme)...")
+        self.worker.request_preview(
+            preview_options,
+            lambda images, error: self.root.after(0, self.show_preview, generation, images, error)
+        )
+
+    def show_preview(self, generation, images, error):
+        """Display preview thumbnails, ignoring results superseded by newer options"""
+        if generation != self.preview_generation:
+            return
+
+        for child in self.preview_pages.winfo_children():
+            child.destroy()
+
+        if error:
+            self.preview_images = []
+            self.preview_status.set(f"Preview unavailable: {error}")
+            return
+
+        self.preview_images = [tk.PhotoImage(data=base64.b64encode(image)) for image in images]
+        for photo in self.preview_images:
+            ttk.Label(self.preview_pages, image=photo, relief=tk.SOLID).pack(pady=(0, 8))
+        self.preview_status.set(f"{self.theme.get().capitalize()} theme - first {len(images)} pages")
+
     def browse_input(self):
         """Browse for input Markdown file"""
         filename = filedialog.askopenfilename(
@@ -278,7 +511,7 @@ class KlasikoGUI:
             self.logo_file.set(filename)
 
     def log_output(self, message):
-        """Add message to output text area"""
+        """Add message to output text area (call from the Tk thread only)"""
         self.output_text.configure(state='normal')
         self.output_text.insert(tk.END, message + '\n')
         self.output_text.see(tk.END)
@@ -290,20 +523,69 @@ class KlasikoGUI:
         self.output_text.delete('1.0', tk.END)
         self.output_text.configure(state='disabled')
 
-    def build_command(self):
-        """Build the klasiko command line"""
-        # Validate input file
+    def validate_input(self):
+        """Validate the input file selection"""
         if not self.input_file.get():
             raise ValueError("Please select an input Markdown file")
 
         if not os.path.exists(self.input_file.get()):
             raise ValueError(f"Input file not found: {self.input_file.get()}")
 
+    def selected_placements(self):
+        """Return the chosen logo placements as 'position:size' strings"""
+        return [f'{position}:{size_var.get()}'
+                for position, size_var in self.placement_vars.items() if size_var.get()]
+
+    def load_logo(self, logo_path):
+        """Return the logo data URI, re-encoding only when the file changes"""
+        try:
+            validated_path = klasiko.validate_logo_file(logo_path)
+        except (FileNotFoundError, ValueError) as e:
+            raise ValueError(str(e))
+
+        stat = validated_path.stat()
+        key = (str(validated_path.resolve()), stat.st_mtime_ns, stat.st_size)
+        if key not in self.logo_cache:
+            self.logo_cache = {key: klasiko.encode_logo_to_base64(validated_path)}
+        return self.logo_cache[key]
+
+    def build_options(self):
+        """Build keyword arguments for klasiko.convert_md_to_pdf()"""
+        self.validate_input()
+
+        logo_data_uri = None
+        logo_placements = []
+        if self.logo_file.get() and os.path.exists(self.logo_file.get()):
+            logo_data_uri = self.load_logo(self.logo_file.get())
+            logo_placements = klasiko.parse_logo_placements(self.selected_placements())
+
+        metadata = {}
+        if self.author.get():
+            metadata['author'] = self.author.get()
+        if self.subject.get():
+            metadata['subject'] = self.subject.get()
+        if self.keywords.get():
+            metadata['keywords'] = self.keywords.get()
+
+        return {
+            'input_file': self.input_file.get(),
+            'output_file': self.output_file.get() or None,
+            'enable_toc': self.toc_enabled.get(),
+            'metadata': metadata or None,
+            'theme': self.theme.get() or 'warm',
+            'logo_data_uri': logo_data_uri,
+            'logo_placements': logo_placements,
+        }
+
+    def build_command(self):
+        """Build the klasiko command line (used when klasiko can't be imported)"""
+        self.validate_input()
+
         # Find klasiko executable
         klasiko_cmd = self.find_klasiko()
 
-        # Build command
-        cmd = [klasiko_cmd, self.input_file.get()]
+        # Build command; JSON progress events drive the progress bar
+        cmd = klasiko_cmd + [self.input_file.get(), '--progress', 'jsonl']
 
         # Output file
         if self.output_file.get():
@@ -322,10 +604,8 @@ class KlasikoGUI:
             cmd.extend(['--logo', self.logo_file.get()])
 
             # Logo placements
-            for position, size_var in self.placement_vars.items():
-                size = size_var.get()
-                if size:  # Only add if a size is selected
-                    cmd.extend(['--logo-placement', f'{position}:{size}'])
+            for placement in self.selected_placements():
+                cmd.extend(['--logo-placement', placement])
 
         # Metadata
         if self.author.get():
@@ -338,7 +618,7 @@ class KlasikoGUI:
         return cmd
 
     def find_klasiko(self):
-        """Find klasiko executable"""
+        """Find klasiko executable, returned as an argument list"""
         # Check if running from bundled executable
         if getattr(sys, 'frozen', False):
             # Running in PyInstaller bundle
@@ -347,29 +627,32 @@ class KlasikoGUI:
             if sys.platform == 'win32':
                 klasiko_exe = bundle_dir / 'klasiko.exe'
             if klasiko_exe.exists():
-                return str(klasiko_exe)
+                return [str(klasiko_exe)]
 
         # Check for klasiko in current directory
         if sys.platform == 'win32':
             local_exe = Path('klasiko.exe')
             if local_exe.exists():
-                return str(local_exe)
+                return [str(local_exe)]
 
         # Check for klasiko.py in current directory
         local_py = Path('klasiko.py')
         if local_py.exists():
-            return sys.executable + ' ' + str(local_py)
+            return [sys.executable, str(local_py)]
 
         # Try system PATH
         if sys.platform == 'win32':
-            return 'klasiko.exe'
+            return ['klasiko.exe']
         else:
-            return 'klasiko'
+            return ['klasiko']
 
     def convert(self):
-        """Run the conversion in a background thread"""
+        """Run the conversion in the background worker"""
         try:
-            cmd = self.build_command()
+            if self.worker:
+                options = self.build_options()
+            else:
+                cmd = self.build_command()
         except ValueError as e:
             messagebox.showerror("Validation Error", str(e))
             return
@@ -378,16 +661,81 @@ class KlasikoGUI:
         self.convert_btn.configure(state='disabled')
         self.status_var.set("Converting...")
         self.clear_output()
+        self.progress_bar['value'] = 0
+        self.progress_text.set("")
+
+        if self.worker:
+            options['progress'] = lambda event: self.root.after(0, self.show_progress, event)
+            self.worker.submit(
+                options,
+                on_output=lambda line: self.root.after(0, self.log_output, line),
+                on_done=lambda success: self.root.after(0, self.conversion_finished, success),
+                on_status=lambda step: self.root.after(0, self.status_var.set, step)
+            )
+            return
 
         # Run in thread to avoid freezing GUI
         thread = threading.Thread(target=self.run_conversion, args=(cmd,))
         thread.daemon = True
         thread.start()
 
+    def show_progress(self, event):
+        """Move the progress bar for one klasiko progress event (runs on the Tk thread)"""
+        now = time.time()
+        kind = event.get('event')
+        stage_range = PROGRESS_STAGE_RANGES.get(event.get('stage'), (0, 0))
+
+        if kind == 'start':
+            self.progress_started = now
+            self.progress_bar['value'] = 0
+        elif kind == 'stage_start':
+            self.progress_bar['value'] = stage_range[0]
+            if event['stage'] == 'render':
+                self.render_started = now
+                self.estimated_pages = event.get('estimated_pages')
+                self.progress_text.set("Laying out pages...")
+        elif kind == 'stage_end':
+            self.progress_bar['value'] = stage_range[1]
+            if event['stage'] == 'render':
+                self.progress_text.set(f"Laid out {event.get('pages', '?')} pages, writing...")
+        elif kind == 'page' and self.render_started:
+            # The page estimate is rough; cap the fraction until layout really ends
+            estimated = max(event.get('estimated_pages') or self.estimated_pages or 1, event['page'])
+            fraction = min(event['page'] / estimated, 0.95)
+            start, end = PROGRESS_STAGE_RANGES['render']
+            self.progress_bar['value'] = max(self.progress_bar['value'], start + (end - start) * fraction)
+            elapsed = now - self.render_started
+            remaining = elapsed * (1 - fraction) / fraction
+            self.progress_text.set(f"Page {event['page']} of ~{estimated} (about {remaining:.0f}s left)")
+        elif kind == 'repaginate':
+            # Another layout pass over the same pages: keep the bar where it is
+            self.progress_text.set(f"Repaginating {event.get('pages', '?')} pages (pass {event['pass'] + 1})...")
+        elif kind == 'result':
+            if event.get('success'):
+                self.progress_bar['value'] = 100
+                self.progress_text.set(f"Done in {event.get('seconds', 0):.1f}s")
+            else:
+                self.progress_text.set(f"Failed: {event.get('error_type', 'error')}")
+
+    def conversion_finished(self, success):
+        """Report an in-process conversion result (runs on the Tk thread)"""
+        self.convert_btn.configure(state='normal')
+        if success:
+            self.status_var.set("Conversion completed successfully!")
+            self.log_output("\n✓ Conversion completed successfully!")
+
+            output = self.output_file.get() or Path(self.input_file.get()).with_suffix('.pdf')
+            if os.path.exists(output):
+                self.ask_open_pdf(output)
+        else:
+            self.status_var.set("Conversion failed")
+            self.log_output("\n✗ Conversion failed")
+
     def run_conversion(self, cmd):
-        """Run the actual conversion command"""
+        """Run the klasiko executable in a subprocess (fallback when not embedded)"""
+        log = lambda message: self.root.after(0, self.log_output, message)
         try:
-            self.log_output(f"Running: {' '.join(cmd)}\n")
+            log(f"Running: {' '.join(cmd)}\n")
 
             # Run the command
             process = subprocess.Popen(
@@ -398,16 +746,25 @@ class KlasikoGUI:
                 bufsize=1
             )
 
-            # Stream output
+            # Stream output: JSON lines are progress events, the rest is the log
             for line in process.stdout:
-                self.log_output(line.rstrip())
+                line = line.rstrip()
+                if line.startswith('{"event"'):
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        log(line)
+                    else:
+                        self.root.after(0, self.show_progress, event)
+                    continue
+                log(line)
 
             process.wait()
 
             # Check result
             if process.returncode == 0:
                 self.root.after(0, lambda: self.status_var.set("Conversion completed successfully!"))
-                self.log_output("\n✓ Conversion completed successfully!")
+                log("\n✓ Conversion completed successfully!")
 
                 # Ask if user wants to open the PDF
                 output = self.output_file.get() or Path(self.input_file.get()).with_suffix('.pdf')
@@ -415,10 +772,10 @@ class KlasikoGUI:
                     self.root.after(0, lambda: self.ask_open_pdf(output))
             else:
                 self.root.after(0, lambda: self.status_var.set("Conversion failed"))
-                self.log_output(f"\n✗ Conversion failed with exit code {process.returncode}")
+                log(f"\n✗ Conversion failed with exit code {process.returncode}")
 
         except Exception as e:
-            self.log_output(f"\n✗ Error: {str(e)}")
+            log(f"\n✗ Error: {str(e)}")
             self.root.after(0, lambda: self.status_var.set("Error occurred"))
         finally:
             self.root.after(0, lambda: self.convert_btn.configure(state='normal'))
@@ -23,6 +23,11 @@ all_datas += pyphen_datas
 all_datas += tinycss2_datas
 all_datas += cairocffi_datas
 
+# Theme stylesheets (precompiled by `python klasiko.py themes --compile`)
+all_datas += [
+    ('themes/*.css', 'themes'),
+]
+
 # Add our shell script libraries
 all_datas += [
     ('lib/terminal-ui.sh', 'lib'),
@@ -4,13 +4,36 @@ Markdown to PDF Converter
 Converts Markdown files to styled PDF documents with traditional white paper formatting.
 """
 
+__version__ = '2.1.1'
+
 import argparse
 import os
 import sys
 import re
 import base64
 import time
+import json
+import csv
+import html
+import hashlib
+import io
+import logging
+import contextlib
+import functools
+import asyncio
+import multiprocessing
+import queue
+import socket
+import sqlite3
+import struct
+import threading
+import unicodedata
+import zlib
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from html.parser import HTMLParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
 
 try:
     import markdown
@@ -18,22 +41,82 @@ except ImportError:
     print("Error: markdown library not found. Please install it with: pip install markdown")
     sys.exit(1)
 
+# Heading id and attribute helpers used below arrived in Markdown 3.6
+try:
+    from markdown.blockprocessors import ReferenceProcessor
+    from markdown.extensions import toc as markdown_toc
+    from markdown.extensions.attr_list import AttrListExtension, get_attrs_and_remainder
+    from markdown.extensions.codehilite import CodeHilite, CodeHiliteExtension, HiliteTreeprocessor, parse_hl_lines
+    from markdown.extensions.fenced_code import FencedBlockPreprocessor
+    from markdown.treeprocessors import Treeprocessor
+except ImportError:
+    print(f"Error: markdown {markdown.__version__} is too old; klasiko needs 3.6 or later. "
+          "Upgrade it with: pip install --upgrade markdown")
+    sys.exit(1)
+
 try:
-    from weasyprint import HTML, CSS
+    from weasyprint import HTML, CSS, __version__ as WEASYPRINT_VERSION
     from weasyprint.text.fonts import FontConfiguration
 except ImportError:
     print("Error: WeasyPrint not found. Please install it with: pip install weasyprint")
     sys.exit(1)
 
+# TOML manifests for `klasiko build` (tomllib is built in from Python 3.11)
+try:
+    import tomllib
+except ImportError:
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+# resource (POSIX only) caps worker memory and reads peak RSS
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Optional pypdfium2 rasterizes pages for PNG previews
+try:
+    import pypdfium2 as pdfium
+    PDFIUM_AVAILABLE = True
+except ImportError:
+    PDFIUM_AVAILABLE = False
+
 # Check for optional Pygments (for code highlighting)
 try:
     import pygments
+    from pygments import highlight
+    from pygments.formatters import get_formatter_by_name
+    from pygments.lexers import find_lexer_class, get_all_lexers, guess_lexer
+    from pygments.util import ClassNotFound
     PYGMENTS_AVAILABLE = True
 except ImportError:
     PYGMENTS_AVAILABLE = False
     print("Warning: Pygments not found. Code syntax highlighting will be disabled.")
     print("Install with: pip install Pygments")
 
+# Optional pikepdf stamps page decorations (--stamp) and linearizes PDFs (--linearize)
+try:
+    import pikepdf
+    PIKEPDF_AVAILABLE = True
+except ImportError:
+    PIKEPDF_AVAILABLE = False
+
+# Optional markdown-it-py, a faster CommonMark parser (--parser markdown-it)
+try:
+    from markdown_it import MarkdownIt
+    from mdit_py_plugins.deflist import deflist_plugin
+    from mdit_py_plugins.footnote import footnote_plugin
+    MARKDOWN_IT_AVAILABLE = True
+except ImportError:
+    MARKDOWN_IT_AVAILABLE = False
+
+
+# Built-in theme stylesheets ship next to klasiko.py (or inside the PyInstaller bundle)
+BUILTIN_THEME_DIR = Path(getattr(sys, '_MEIPASS', Path(__file__).resolve().parent)) / 'themes'
+_COMPILED_THEMES = {}
+
 
 def extract_title_from_markdown(markdown_content):
     """
@@ -249,17 +332,54 @@ def process_logo_argument(logo_path):
         sys.exit(1)
 
 
-def convert_markdown_to_html(markdown_file, enable_toc=False):
+def parse_logo_placements(placement_strings):
+    """
+    Parse "position:size" logo placement strings into placement dicts.
+
+    Args:
+        placement_strings (list): Strings such as "title:large" or "header:small"
+
+    Returns:
+        list: List of dicts with 'position' and 'size' keys
+    """
+    logo_placements = []
+    for placement_str in placement_strings or []:
+        if ':' in placement_str:
+            position, size = placement_str.split(':', 1)
+            logo_placements.append({'position': position.strip(), 'size': size.strip()})
+        else:
+            print(f"Warning: Invalid logo placement format: {placement_str}. Use 'position:size'")
+    return logo_placements
+
+
+def convert_markdown_to_html(markdown_file, enable_toc=False, fast_parse=False, parser_backend=None):
     """
     Convert Markdown file to HTML with proper extensions.
 
     Args:
         markdown_file (str): Path to the Markdown file
         enable_toc (bool): Whether to generate table of contents
+        fast_parse (bool): Load only the extensions the document uses
+        parser_backend (str): Markdown parser from MARKDOWN_BACKENDS (default: python-markdown)
 
     Returns:
         tuple: (html_content, markdown_content, md_instance)
     """
+    markdown_content = read_markdown_file(markdown_file)
+    html_content, md = markdown_to_html(markdown_content, enable_toc, fast_parse=fast_parse, parser_backend=parser_backend)
+    return html_content, markdown_content, md
+
+
+def read_markdown_file(markdown_file):
+    """
+    Read a Markdown file, falling back to Latin-1 if it isn't valid UTF-8.
+
+    Args:
+        markdown_file (str): Path to the Markdown file
+
+    Returns:
+        str: Markdown content
+    """
     try:
         with open(markdown_file, 'r', encoding='utf-8') as file:
             markdown_content = file.read()
@@ -276,1150 +396,1108 @@ def convert_markdown_to_html(markdown_file, enable_toc=False):
     except Exception as e:
         raise Exception(f"Error reading Markdown file: {e}")
 
-    # Build extensions list
-    extensions = [
-        'extra',           # Includes tables, fenced_code, and more
-        'footnotes',       # Support for [^1] footnote references
-        'toc',             # Table of contents support
-    ]
-
-    # Add codehilite only if Pygments is available
-    if PYGMENTS_AVAILABLE:
-        extensions.append('codehilite')
-
-    # Configure TOC
-    extension_configs = {}
-    if enable_toc:
-        extension_configs['toc'] = {
-            'title': 'Table of Contents',
-            'toc_depth': '2-3',
-        }
+    return markdown_content
+
+
+MARKDOWN_EXTENSIONS = (
+    'extra',           # Includes tables, fenced_code, and more
+    'footnotes',       # Support for [^1] footnote references
+    'toc',             # Table of contents support
+)
+TOC_DEPTH = '2-3'
+
+
+# Documents set code options with comments such as <!-- klasiko: code-language=sql -->.
+# Code blocks that name no language are plain text unless code-language sets a
+# default; 'auto' lets Pygments guess, which tries every lexer against the code
+# and is slow on long blocks.
+CODE_OPTION_PATTERN = re.compile(
+    r'^<!--\s*klasiko:\s*(code-language|code-max-lines|code-max-bytes|large-code)\s*=\s*([\w#.+-]+)\s*-->[ \t]*$',
+    re.MULTILINE
+)
+CODE_LANGUAGE_GUESS = 'auto'
+# Blocks over either limit skip Pygments: its tens of thousands of spans become
+# as many inline boxes for WeasyPrint to lay out (0 = no limit)
+CODE_HIGHLIGHT_MAX_LINES = 1000
+CODE_HIGHLIGHT_MAX_BYTES = 64 * 1024
+LARGE_CODE_HIGHLIGHTERS = ('plain', 'lines')
+DEFAULT_CODE_OPTIONS = (None, CODE_HIGHLIGHT_MAX_LINES, CODE_HIGHLIGHT_MAX_BYTES, 'plain')
+PLAIN_CODE_PATTERN = re.compile(r'<pre class="plain-code" data-lines="(\d+)"><code(?: class="language-([^"]*)")?>')
+LINE_COMMENT_PREFIXES = {
+    'sql': ('--',), 'mysql': ('--', '#'), 'postgresql': ('--',), 'plpgsql': ('--',),
+    'python': ('#',), 'py': ('#',), 'bash': ('#',), 'sh': ('#',), 'shell': ('#',), 'console': ('#',),
+    'yaml': ('#',), 'toml': ('#',), 'ini': (';', '#'), 'r': ('#',), 'ruby': ('#',), 'perl': ('#',),
+    'javascript': ('//',), 'js': ('//',), 'typescript': ('//',), 'ts': ('//',), 'java': ('//',),
+    'c': ('//',), 'cpp': ('//',), 'csharp': ('//',), 'go': ('//',), 'rust': ('//',), 'kotlin': ('//',),
+}
+LOG_ERROR_PATTERN = re.compile(r'\b(?:ERROR|FATAL|CRITICAL|SEVERE|Traceback)\b')
+LOG_WARNING_PATTERN = re.compile(r'\b(?:WARN|WARNING)\b')
+
+
+def document_code_options(markdown_content):
+    """
+    Read a document's code highlighting options from its klasiko comments.
 
-    # Convert Markdown to HTML with extensions
-    md = markdown.Markdown(extensions=extensions, extension_configs=extension_configs)
-    html_content = md.convert(markdown_content)
+    Recognised: code-language (lexer alias, or 'auto' to guess),
+    code-max-lines and code-max-bytes (largest block still highlighted by
+    Pygments, 0 for no limit) and large-code ('plain', or 'lines' for the
+    line-based highlighter). Each comment takes a line of its own; comments
+    inside fenced code blocks are examples, not options.
 
-    return html_content, markdown_content, md
+    Args:
+        markdown_content (str): Raw Markdown content
 
+    Returns:
+        tuple: (language, max_lines, max_bytes, large_code)
 
-def get_default_theme_css():
+    Raises:
+        ValueError: If an option has an invalid value
     """
-    Return CSS for the default clean, professional theme.
-    Original white paper styling with neutral colors.
+    language, max_lines, max_bytes, large_code = DEFAULT_CODE_OPTIONS
+    for name, value in CODE_OPTION_PATTERN.findall(FENCED_REGION_PATTERN.sub('', markdown_content)):
+        if name == 'code-language':
+            language = value.lower()
+        elif name == 'large-code':
+            if value not in LARGE_CODE_HIGHLIGHTERS:
+                raise ValueError(f"large-code must be one of: {', '.join(LARGE_CODE_HIGHLIGHTERS)}")
+            large_code = value
+        elif not value.isdigit():
+            raise ValueError(f"{name} must be a whole number, got '{value}'")
+        elif name == 'code-max-lines':
+            max_lines = int(value)
+        else:
+            max_bytes = int(value)
+    return (language, max_lines, max_bytes, large_code)
+
+
+def highlight_code_lines(code, language=None):
     """
-    return """
-        @page {
-            size: A4;
-            margin: 2.5cm 2cm;
+    Cheap highlighting for large code blocks: whole lines, not tokens.
 
-            @top-left {
-                content: "•";
-                font-size: 8pt;
-                color: #666;
-            }
-
-            @top-center {
-                content: "";
-                font-size: 8pt;
-                color: #666;
-            }
+    Full-line comments and log lines with an error or warning level get one
+    span each, so even a huge listing adds few inline boxes to the layout.
 
-            @top-right {
-                content: "•";
-                font-size: 8pt;
-                color: #666;
-            }
+    Args:
+        code (str): Source code
+        language (str): Language alias, used to pick comment prefixes
 
-            @bottom-left {
-                content: "•";
-                font-size: 8pt;
-                color: #666;
-            }
+    Returns:
+        str: HTML for the inside of a <code> element
+    """
+    prefixes = LINE_COMMENT_PREFIXES.get((language or '').lower(), ('#', '//', '--'))
+    lines = []
+    for line in code.split('\n'):
+        escaped = html.escape(line, quote=False)
+        if line.lstrip().startswith(prefixes):
+            escaped = f'<span class="comment">{escaped}</span>'
+        elif LOG_ERROR_PATTERN.search(line):
+            escaped = f'<span class="error">{escaped}</span>'
+        elif LOG_WARNING_PATTERN.search(line):
+            escaped = f'<span class="warning">{escaped}</span>'
+        lines.append(escaped)
+    return '\n'.join(lines)
+
+
+def downgraded_code_blocks(html_content):
+    """
+    List the code blocks that were too large for Pygments.
 
-            @bottom-center {
-                content: "Page " counter(page);
-                font-size: 8pt;
-                color: #666;
-                font-family: 'Times New Roman', 'DejaVu Serif', serif;
-            }
+    Args:
+        html_content (str): HTML from markdown_to_html()
 
-            @bottom-right {
-                content: "•";
-                font-size: 8pt;
-                color: #666;
-            }
-        }
+    Returns:
+        list: (line count, language or None) per downgraded block
+    """
+    return [(int(lines), language or None) for lines, language in PLAIN_CODE_PATTERN.findall(html_content)]
 
-        body {
-            font-family: 'Times New Roman', 'DejaVu Serif', 'Noto Serif', Times, serif;
-            font-size: 12pt;
-            line-height: 1.6;
-            color: #333;
-            text-align: justify;
-            margin: 0;
-            padding: 0;
-        }
 
-        h1, h2, h3, h4, h5, h6 {
-            font-family: Georgia, 'Times New Roman', Times, serif;
-            font-weight: normal;
-            color: #222;
-            margin-top: 1.5em;
-            margin-bottom: 0.5em;
-            page-break-after: avoid;
-            break-after: avoid;
-            page-break-inside: avoid;
-            break-inside: avoid;
-        }
+@functools.lru_cache(maxsize=None)
+def lexer_alias_table():
+    """Map every Pygments lexer alias (lower case) to its lexer name, once per process."""
+    table = {}
+    for name, aliases, _, _ in get_all_lexers():
+        for alias in aliases:
+            table.setdefault(alias.lower(), name)
+    return table
 
-        h1 {
-            font-size: 18pt;
-            text-align: center;
-            margin-top: 2em;
-            margin-bottom: 1.5em;
-            border-bottom: 1px solid #ccc;
-            padding-bottom: 0.5em;
-        }
 
-        h2 {
-            font-size: 16pt;
-            border-bottom: 1px solid #eee;
-            padding-bottom: 0.3em;
-            page-break-before: always;
-            break-before: page;
-        }
+@functools.lru_cache(maxsize=1024)
+def resolve_lexer_class(alias):
+    """
+    Look up the Pygments lexer class for a language alias.
 
-        /* First h2 after title should not force page break */
-        .content > h2:first-child,
-        h1 + h2,
-        hr + h2 {
-            page-break-before: avoid;
-            break-before: avoid;
-        }
+    pygments.lexers.get_lexer_by_name() scans every lexer on each call and,
+    for an unknown alias, every installed plugin too; here a lookup is a
+    dict access.
 
-        h3 {
-            font-size: 14pt;
-            font-style: italic;
-        }
+    Args:
+        alias (str): Language from a code fence (e.g. 'py', 'sql')
 
-        h4, h5, h6 {
-            font-size: 12pt;
-            font-style: italic;
-        }
+    Returns:
+        type or None: Lexer class, or None if no lexer has that alias
+    """
+    name = lexer_alias_table().get(alias.lower()) if alias else None
+    return find_lexer_class(name) if name else None
 
-        p {
-            margin: 0 0 1em 0;
-            orphans: 2;
-            widows: 2;
-        }
 
-        blockquote {
-            margin: 1em 2em;
-            padding: 0.5em 1em;
-            border-left: 3px solid #ccc;
-            background-color: #f9f9f9;
-            font-style: italic;
-            color: #555;
-        }
+class CodeHighlighter(CodeHilite):
+    """
+    CodeHilite with klasiko's lexer resolution: aliases go through
+    resolve_lexer_class(), blocks without a language use default_language,
+    and Pygments only guesses a language when guess_lang is set. Blocks over
+    max_lines or max_bytes skip Pygments and become a plain <pre> (or one
+    highlighted by highlight_code_lines() when large_code is 'lines').
+    """
 
-        code {
-            font-family: 'Courier New', 'DejaVu Mono', 'Liberation Mono', Courier, monospace;
-            font-size: 10pt;
-            background-color: #f5f5f5;
-            padding: 0.1em 0.3em;
-            border-radius: 3px;
-        }
+    def __init__(self, src, default_language=None, max_lines=0, max_bytes=0, large_code='plain', **options):
+        super().__init__(src, **options)
+        self.default_language = default_language
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.large_code = large_code
+
+    def hilite(self, shebang=True):
+        """Highlight the code, returning the same markup as CodeHilite.hilite()."""
+        self.src = self.src.strip('\n')
+        if self.lang is None and shebang:
+            self._parseHeader()
+        if self.lang is None:
+            self.lang = self.default_language
+        if not self.use_pygments:
+            return super().hilite(shebang=False)
+
+        line_count = self.src.count('\n') + 1
+        if (self.max_lines and line_count > self.max_lines) or \
+                (self.max_bytes and len(self.src.encode('utf-8')) > self.max_bytes):
+            if self.large_code == 'lines':
+                code = highlight_code_lines(self.src, self.lang)
+            else:
+                code = html.escape(self.src, quote=False)
+            lang_attr = f' class="{self.lang_prefix}{html.escape(self.lang)}"' if self.lang else ''
+            return f'<pre class="plain-code" data-lines="{line_count}"><code{lang_attr}>{code}\n</code></pre>\n'
 
-        pre {
-            font-family: 'Courier New', 'DejaVu Mono', 'Liberation Mono', Courier, monospace;
-            font-size: 10pt;
-            background-color: #f8f8f8;
-            border: 1px solid #ddd;
-            border-radius: 3px;
-            padding: 1em;
-            overflow: auto;
-            margin: 1em 0;
-            page-break-inside: avoid;
-        }
+        lexer_class = resolve_lexer_class(self.lang)
+        if lexer_class is None and self.guess_lang:
+            try:
+                lexer = guess_lexer(self.src, **self.options)
+            except ClassNotFound:
+                lexer = resolve_lexer_class('text')(**self.options)
+        else:
+            lexer = (lexer_class or resolve_lexer_class('text'))(**self.options)
+        if not self.lang:
+            self.lang = lexer.aliases[0]
+
+        if isinstance(self.pygments_formatter, str):
+            try:
+                formatter = get_formatter_by_name(self.pygments_formatter, **self.options)
+            except ClassNotFound:
+                formatter = get_formatter_by_name('html', **self.options)
+        else:
+            formatter = self.pygments_formatter(lang_str=f'{self.lang_prefix}{self.lang}', **self.options)
+        return highlight(self.src, lexer, formatter)
+
+
+class _HighlightedFencePreprocessor(FencedBlockPreprocessor):
+    """fenced_code's preprocessor, highlighting through CodeHighlighter."""
+
+    def run(self, lines):
+        if not self.checked_for_deps:
+            for ext in self.md.registeredExtensions:
+                if isinstance(ext, CodeHiliteExtension):
+                    self.codehilite_conf = ext.getConfigs()
+                if isinstance(ext, AttrListExtension):
+                    self.use_attr_list = True
+            self.checked_for_deps = True
+        if not (self.codehilite_conf and self.codehilite_conf['use_pygments']):
+            return super().run(lines)
+
+        # Highlight the fences bound for Pygments; the stock processor then
+        # renders the rest (use_pygments=false blocks) as before
+        text = '\n'.join(lines)
+        index = 0
+        while True:
+            m = self.FENCED_BLOCK_RE.search(text, index)
+            if not m:
+                break
+            lang, classes, config = None, [], {}
+            if m.group('attrs'):
+                attrs, remainder = get_attrs_and_remainder(m.group('attrs'))
+                if remainder:
+                    index = m.end('attrs')
+                    continue
+                _, classes, config = self.handle_attrs(attrs)
+                if classes:
+                    lang = classes.pop(0)
+            else:
+                lang = m.group('lang') or None
+                if m.group('hl_lines'):
+                    config['hl_lines'] = parse_hl_lines(m.group('hl_lines'))
+            if not config.get('use_pygments', True):
+                index = m.end()
+                continue
+
+            local_config = self.codehilite_conf.copy()
+            local_config.update(config)
+            if classes:
+                local_config['css_class'] = f"{' '.join(classes)} {local_config['css_class']}"
+            highlighter = CodeHighlighter(
+                m.group('code'),
+                lang=lang,
+                style=local_config.pop('pygments_style', 'default'),
+                **local_config
+            )
+            placeholder = self.md.htmlStash.store(highlighter.hilite(shebang=False))
+            text = f'{text[:m.start()]}\n{placeholder}\n{text[m.end():]}'
+            index = m.start() + 1 + len(placeholder)
+        return super().run(text.split('\n'))
+
+
+class _HighlightedCodeTreeprocessor(HiliteTreeprocessor):
+    """codehilite's indented code block highlighter, through CodeHighlighter."""
+
+    def run(self, root):
+        for block in root.iter('pre'):
+            if len(block) == 1 and block[0].tag == 'code' and block[0].text is not None:
+                local_config = self.config.copy()
+                code = CodeHighlighter(
+                    self.code_unescape(block[0].text),
+                    tab_length=self.md.tab_length,
+                    style=local_config.pop('pygments_style', 'default'),
+                    **local_config
+                )
+                placeholder = self.md.htmlStash.store(code.hilite())
+                # Becomes a raw HTML placeholder paragraph, as in codehilite
+                block.clear()
+                block.tag = 'p'
+                block.text = placeholder
+
+
+class CodeHighlightExtension(CodeHiliteExtension):
+    """
+    codehilite, with fenced and indented code highlighted by CodeHighlighter.
 
-        pre code {
-            background: none;
-            padding: 0;
-        }
+    Takes codehilite's options plus default_language, max_lines, max_bytes
+    and large_code. Load it after 'extra' (fenced_code), whose preprocessor
+    it replaces.
+    """
 
-        table {
-            width: 100%;
-            border-collapse: collapse;
-            margin: 1em 0;
-            font-size: 11pt;
-            page-break-inside: auto;
-            break-inside: auto;
-        }
+    def __init__(self, default_language=None, max_lines=0, max_bytes=0, large_code='plain', **kwargs):
+        super().__init__(**kwargs)
+        self.config['default_language'] = [default_language, 'Language for code blocks that name none']
+        self.config['max_lines'] = [max_lines, 'Largest block highlighted by Pygments, in lines (0 = no limit)']
+        self.config['max_bytes'] = [max_bytes, 'Largest block highlighted by Pygments, in bytes (0 = no limit)']
+        self.config['large_code'] = [large_code, "Larger blocks: 'plain' or 'lines' (line-based highlighting)"]
 
-        tr {
-            page-break-inside: avoid;
-            break-inside: avoid;
-        }
+    def extendMarkdown(self, md):
+        hiliter = _HighlightedCodeTreeprocessor(md)
+        hiliter.config = self.getConfigs()
+        md.treeprocessors.register(hiliter, 'hilite', 30)
+        if 'fenced_code_block' in md.preprocessors:
+            fenced_config = md.preprocessors['fenced_code_block'].config
+            md.preprocessors.register(_HighlightedFencePreprocessor(md, fenced_config), 'fenced_code_block', 25)
+        md.registerExtension(self)
 
-        thead {
-            display: table-header-group;
-        }
 
-        thead tr {
-            page-break-after: avoid;
-            break-after: avoid;
-        }
+# The extensions 'extra' bundles, in the order it loads them
+EXTRA_EXTENSIONS = ('fenced_code', 'footnotes', 'attr_list', 'def_list', 'tables', 'abbr', 'md_in_html')
+DEFINITION_LINE_PATTERN = re.compile(r'^[ \t>*+\-\d.)]*:[ \t]', re.MULTILINE)
+HEADING_SYNTAX_PATTERN = re.compile(r'#|^[ ]{0,3}(?:=+|-+)[ ]*$|<h[1-6]|\[TOC\]', re.MULTILINE | re.IGNORECASE)
+# Indented code may sit inside blockquotes and list items ('>     code')
+INDENTED_CODE_PATTERN = re.compile(r'^[ \t>*+\-\d.)]*(?: {4}|\t)', re.MULTILINE)
 
-        table.long-table {
-            page-break-inside: auto;
-        }
 
-        table.long-table tr {
-            page-break-inside: avoid;
-            page-break-after: auto;
-        }
+def detect_markdown_extensions(markdown_content, enable_toc=False):
+    """
+    Pick the extensions a document needs, by a cheap scan of its source.
 
-        table.long-table thead {
-            display: table-header-group;
-        }
+    Each test over-approximates the syntax its extension handles, so a
+    document never loses a construct: a false positive only costs time, and
+    the HTML is the same as with the full extension set.
 
-        table.long-table tfoot {
-            display: table-footer-group;
-        }
+    Args:
+        markdown_content (str): Raw Markdown content
+        enable_toc (bool): Whether to generate table of contents
 
-        th, td {
-            border: 1px solid #ddd;
-            padding: 0.5em;
-            text-align: left;
-            word-wrap: break-word;
-        }
+    Returns:
+        tuple: Extension names for markdown_parser_key()
+    """
+    text = markdown_content
+    fences = '```' in text or '~~~' in text
+    present = {
+        'fenced_code': fences,
+        'footnotes': '[^' in text,
+        'attr_list': '{' in text,
+        'def_list': bool(DEFINITION_LINE_PATTERN.search(text)),
+        'tables': '|' in text,
+        'abbr': '*[' in text,
+        'md_in_html': '<' in text,
+    }
+    extensions = tuple(name for name in EXTRA_EXTENSIONS if present[name])
 
-        th {
-            background-color: #f5f5f5;
-            font-weight: bold;
-        }
+    # toc gives every heading an id, so it stays whenever there may be a heading
+    if enable_toc or HEADING_SYNTAX_PATTERN.search(text):
+        extensions += ('toc',)
+    if fences or INDENTED_CODE_PATTERN.search(text):
+        extensions += ('codehilite',)
+    return extensions
 
-        ul, ol {
-            margin: 1em 0;
-            padding-left: 2em;
-        }
 
-        li {
-            margin: 0.3em 0;
-        }
+def markdown_parser_key(enable_toc=False, toc_depth=TOC_DEPTH, code_options=DEFAULT_CODE_OPTIONS, extensions=None):
+    """
+    Key identifying one parser configuration.
 
-        a {
-            color: #0066cc;
-            text-decoration: none;
-        }
+    Args:
+        enable_toc (bool): Whether the table of contents is configured
+        toc_depth (str): Heading levels included in the table of contents
+        code_options (tuple): Code highlighting options from document_code_options()
+        extensions (tuple): Extension names from detect_markdown_extensions()
+            (default: MARKDOWN_EXTENSIONS plus codehilite)
 
-        a:hover {
-            text-decoration: underline;
-        }
+    Returns:
+        tuple: (enable_toc, toc_depth, pygments_available, extensions, code_options)
+    """
+    if extensions is None:
+        extensions = MARKDOWN_EXTENSIONS + ('codehilite',)
+    # Keep codehilite only if Pygments is available
+    if not PYGMENTS_AVAILABLE:
+        extensions = tuple(name for name in extensions if name != 'codehilite')
+    return (bool(enable_toc), toc_depth if enable_toc else None, PYGMENTS_AVAILABLE, tuple(extensions),
+            code_options if 'codehilite' in extensions else None)
 
-        img {
-            max-width: 100%;
-            height: auto;
-            display: block;
-            margin: 1em auto;
-            page-break-inside: avoid;
-        }
 
-        .toc {
-            background-color: #f9f9f9;
-            border: 1px solid #ddd;
-            padding: 1.5em;
-            margin: 2em 0 3em 0;
-            page-break-after: always;
-        }
+def build_markdown_parser(key):
+    """
+    Construct a Markdown parser for a markdown_parser_key().
 
-        .toc-title {
-            font-size: 16pt;
-            font-weight: bold;
-            margin-bottom: 1em;
-            text-align: center;
-        }
+    Args:
+        key (tuple): Parser configuration key
 
-        .toc ul {
-            list-style-type: none;
-            padding-left: 0;
-        }
+    Returns:
+        markdown.Markdown: Freshly configured parser
+    """
+    enable_toc, toc_depth, _, extensions, code_options = key
 
-        .toc li {
-            margin: 0.5em 0;
-            padding-left: 1em;
-        }
+    # Configure TOC
+    extension_configs = {}
+    if enable_toc:
+        extension_configs['toc'] = {
+            'title': 'Table of Contents',
+            'toc_depth': toc_depth,
+        }
+
+    # codehilite is loaded as CodeHighlightExtension, guessing only when the document asks
+    if 'codehilite' in extensions:
+        language, max_lines, max_bytes, large_code = code_options
+        guess = language == CODE_LANGUAGE_GUESS
+        highlighter = CodeHighlightExtension(
+            guess_lang=guess,
+            default_language=None if guess else language,
+            max_lines=max_lines,
+            max_bytes=max_bytes,
+            large_code=large_code
+        )
+        extensions = [highlighter if extension == 'codehilite' else extension for extension in extensions]
+    return markdown.Markdown(extensions=extensions, extension_configs=extension_configs)
 
-        .toc a {
-            color: #0066cc;
-            text-decoration: none;
-        }
 
-        .footnote {
-            font-size: 10pt;
-            line-height: 1.4;
-        }
+class MarkdownParserPool:
+    """
+    Idle Markdown parsers kept per configuration and reset() between documents.
 
-        .footnote-ref {
-            vertical-align: super;
-            font-size: 0.8em;
-            text-decoration: none;
-        }
+    Building a parser loads every extension and rebuilds the processor
+    registries; reset() only clears per-document state (footnotes, reference
+    links, heading ids, toc). A parser is lent to one caller at a time, so
+    batch, watch and service threads can share the pool; worker processes
+    each get their own.
+    """
 
-        .footnote-backref {
-            text-decoration: none;
-        }
+    def __init__(self, max_idle=4, build=build_markdown_parser):
+        self.max_idle = max_idle
+        self.build = build
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.built = 0
+        self.reused = 0
 
-        hr {
-            border: none;
-            border-top: 1px solid #ccc;
-            margin: 2em 0;
-        }
+    @contextlib.contextmanager
+    def parser(self, enable_toc=False, toc_depth=TOC_DEPTH, code_options=DEFAULT_CODE_OPTIONS, extensions=None):
+        """
+        Borrow a parser, returning it to the pool afterwards.
 
-        h1, h2, h3 {
-            page-break-after: avoid;
-        }
+        Args:
+            enable_toc (bool): Whether to generate table of contents
+            toc_depth (str): Heading levels included in the table of contents
+            code_options (tuple): Code highlighting options from document_code_options()
+            extensions (tuple): Extension names (default: the full set)
 
-        pre, img {
-            page-break-inside: avoid;
-        }
+        Yields:
+            markdown.Markdown: Parser with no state from earlier documents
+        """
+        key = markdown_parser_key(enable_toc, toc_depth, code_options, extensions)
+        with self.lock:
+            idle = self.idle.get(key)
+            md = idle.pop() if idle else None
+            if md is None:
+                self.built += 1
+            else:
+                self.reused += 1
+        if md is None:
+            md = self.build(key)
 
-        .title-page {
-            text-align: center;
-            margin-top: 8cm;
-            page-break-after: always;
-        }
+        try:
+            yield md
+        finally:
+            md.reset()
+            with self.lock:
+                idle = self.idle.setdefault(key, [])
+                if len(idle) < self.max_idle:
+                    idle.append(md)
 
-        .title-page h1 {
-            border: none;
-            margin-bottom: 0.5em;
-            font-size: 22pt;
-            font-weight: bold;
-        }
+    def clear(self):
+        """Drop every idle parser."""
+        with self.lock:
+            self.idle.clear()
 
-        .title-page h2 {
-            border: none;
-            margin-top: 0.5em;
-            margin-bottom: 0.5em;
-            font-size: 16pt;
-            font-weight: normal;
-            color: #333;
-        }
 
-        .title-page h3 {
-            border: none;
-            margin-top: 0.3em;
-            margin-bottom: 2em;
-            font-size: 14pt;
-            font-weight: normal;
-            font-style: italic;
-            color: #555;
-        }
+MARKDOWN_PARSERS = MarkdownParserPool()
 
-        .meta-info {
-            color: #444;
-            margin-top: 3em;
-            font-size: 11pt;
-            line-height: 1.8;
-        }
 
-        .meta-info p {
-            margin: 0.3em 0;
-        }
+class ParsedMarkdown:
+    """Per-document results copied off a pooled parser before it is reset."""
 
-        .meta-info .meta-key {
-            font-weight: bold;
-        }
-    """
+    def __init__(self, toc='', toc_tokens=None):
+        self.toc = toc
+        self.toc_tokens = toc_tokens or []
 
 
-def get_warm_theme_css():
+class MarkdownBackend:
     """
-    Return CSS for the warm neutral theme with vintage typography.
-    Warm tones, double borders, small-caps headings, generous spacing.
+    A Markdown parser klasiko can convert documents with.
+
+    Backends produce the HTML the themes style: Python-Markdown's heading ids,
+    footnote and code block markup, and a ParsedMarkdown with the toc div and
+    toc_tokens. Constructs a backend renders differently are listed in
+    unsupported, by their name in the test corpus (tests/markdown_checks.py).
     """
-    return """
-        @page {
-            size: A4;
-            margin: 3cm 2.5cm;
-            background-color: #FAF8F5;
 
-            @top-left {
-                content: "❦";
-                font-size: 9pt;
-                color: #9B8579;
-            }
+    name = None
+    requirement = None
+    unsupported = ()
 
-            @top-center {
-                content: "";
-            }
+    def available(self):
+        """Whether the backend's libraries are installed."""
+        return True
 
-            @top-right {
-                content: "❦";
-                font-size: 9pt;
-                color: #9B8579;
-            }
+    def convert(self, markdown_content, enable_toc=False, toc_depth=TOC_DEPTH, fast_parse=False):
+        """
+        Convert Markdown text to HTML.
 
-            @bottom-left {
-                content: "❦";
-                font-size: 9pt;
-                color: #9B8579;
-            }
+        Args:
+            markdown_content (str): Raw Markdown content
+            enable_toc (bool): Whether to generate table of contents
+            toc_depth (str): Heading levels included in the table of contents
+            fast_parse (bool): Skip parser features the document doesn't use, if the backend can
 
-            @bottom-center {
-                content: "– " counter(page) " –";
-                font-size: 10pt;
-                color: #3A3229;
-                font-family: 'Palatino Linotype', 'Book Antiqua', Palatino, 'Garamond', Georgia, serif;
-            }
+        Returns:
+            tuple: (html_content, md_instance)
+        """
+        raise NotImplementedError
 
-            @bottom-right {
-                content: "❦";
-                font-size: 9pt;
-                color: #9B8579;
-            }
-        }
 
-        body {
-            font-family: 'Palatino Linotype', 'Book Antiqua', Palatino, 'Garamond', Georgia, 'Times New Roman', serif;
-            font-size: 11.5pt;
-            line-height: 1.7;
-            color: #3A3229;
-            text-align: justify;
-            margin: 0;
-            padding: 0;
-            background-color: #FAF8F5;
-        }
+class PythonMarkdownBackend(MarkdownBackend):
+    """Python-Markdown with klasiko's extensions, the reference backend."""
 
-        h1, h2, h3, h4, h5, h6 {
-            font-family: 'Garamond', 'Palatino Linotype', 'Book Antiqua', Georgia, serif;
-            font-weight: bold;
-            color: #2D2520;
-            margin-top: 1.8em;
-            margin-bottom: 0.7em;
-            page-break-after: avoid;
-            break-after: avoid;
-            page-break-inside: avoid;
-            break-inside: avoid;
-        }
+    name = 'python-markdown'
+    requirement = 'pip install markdown'
 
-        h1 {
-            font-size: 22pt;
-            text-align: center;
-            margin-top: 2em;
-            margin-bottom: 1.5em;
-            border-top: 3px double #9B8579;
-            border-bottom: 3px double #9B8579;
-            padding-top: 0.6em;
-            padding-bottom: 0.6em;
-            font-variant: small-caps;
-            letter-spacing: 1pt;
-        }
+    def convert(self, markdown_content, enable_toc=False, toc_depth=TOC_DEPTH, fast_parse=False):
+        extensions = detect_markdown_extensions(markdown_content, enable_toc) if fast_parse else None
+        with MARKDOWN_PARSERS.parser(enable_toc, toc_depth, document_code_options(markdown_content), extensions) as md:
+            html_content = md.convert(markdown_content)
+            # Without toc (fast parse, no headings) the parser has no toc attributes
+            return html_content, ParsedMarkdown(getattr(md, 'toc', ''), getattr(md, 'toc_tokens', None))
 
-        h2 {
-            font-size: 17pt;
-            border-bottom: 2px solid #D4C4B5;
-            padding-bottom: 0.4em;
-            font-variant: small-caps;
-            page-break-before: always;
-            break-before: page;
-        }
 
-        /* First h2 after title should not force page break */
-        .content > h2:first-child,
-        h1 + h2,
-        hr + h2 {
-            page-break-before: avoid;
-            break-before: avoid;
-        }
+FENCE_INFO_PATTERN = re.compile(r'^\{?\s*\.?([\w#.+-]+)')
 
-        h3 {
-            font-size: 14pt;
-            font-weight: bold;
-            font-style: normal;
-        }
 
-        h4, h5, h6 {
-            font-size: 12pt;
-            font-weight: bold;
-            font-style: normal;
-        }
+def _render_footnote_ref(renderer, tokens, idx, options, env):
+    """markdown-it footnote reference, as Python-Markdown's footnotes marks it up."""
+    meta = tokens[idx].meta
+    label = html.escape(meta['label'])
+    ref_id = f"fnref{meta['subId'] + 1 if meta['subId'] else ''}:{label}"
+    return f'<sup id="{ref_id}"><a class="footnote-ref" href="#fn:{label}">{meta["id"] + 1}</a></sup>'
 
-        p {
-            margin: 0 0 1.2em 0;
-            orphans: 2;
-            widows: 2;
-        }
 
-        blockquote {
-            margin: 1.5em 2.5em;
-            padding: 0.8em 1.2em;
-            border-left: 4px solid #9B8579;
-            background-color: #F3EDE6;
-            font-style: italic;
-            color: #4A3F36;
-            font-size: 11pt;
-        }
+def _render_footnote_block_open(renderer, tokens, idx, options, env):
+    return '<div class="footnote">\n<hr />\n<ol>\n'
 
-        code {
-            font-family: 'Courier New', 'DejaVu Mono', 'Liberation Mono', Courier, monospace;
-            font-size: 10pt;
-            background-color: #F3EDE6;
-            color: #4A3F36;
-            padding: 0.15em 0.4em;
-            border-radius: 2px;
-        }
 
-        pre {
-            font-family: 'Courier New', 'DejaVu Mono', 'Liberation Mono', Courier, monospace;
-            font-size: 10pt;
-            background-color: #F3EDE6;
-            border: 1px solid #D4C4B5;
-            border-radius: 2px;
-            padding: 1em;
-            overflow: auto;
-            margin: 1.5em 0;
-            page-break-inside: avoid;
-        }
+def _render_footnote_block_close(renderer, tokens, idx, options, env):
+    return '</ol>\n</div>\n'
 
-        pre code {
-            background: none;
-            padding: 0;
-        }
 
-        table {
-            width: 100%;
-            border-collapse: collapse;
-            margin: 1.5em 0;
-            font-size: 10.5pt;
-            border: 2px solid #9B8579;
-            page-break-inside: auto;
-            break-inside: auto;
-        }
+def _render_footnote_open(renderer, tokens, idx, options, env):
+    return f'<li id="fn:{html.escape(tokens[idx].meta["label"])}">\n'
 
-        tr {
-            page-break-inside: avoid;
-            break-inside: avoid;
-        }
 
-        thead {
-            display: table-header-group;
-        }
+def _render_footnote_anchor(renderer, tokens, idx, options, env):
+    meta = tokens[idx].meta
+    ref_id = f"fnref{meta['subId'] + 1 if meta['subId'] else ''}:{html.escape(meta['label'])}"
+    space = '' if meta['subId'] else '&#160;'
+    return (f'{space}<a class="footnote-backref" href="#{ref_id}" '
+            f'title="Jump back to footnote {meta["id"] + 1} in the text">&#8617;</a>')
 
-        thead tr {
-            page-break-after: avoid;
-            break-after: avoid;
-        }
 
-        table.long-table {
-            page-break-inside: auto;
-        }
+class MarkdownItBackend(MarkdownBackend):
+    """
+    markdown-it-py, a faster CommonMark parser, with tables, footnotes and
+    definition lists.
+
+    Headings get Python-Markdown's toc ids, and footnotes and code blocks its
+    markup (highlighted by CodeHighlighter), so theme CSS and the table of
+    contents work unchanged. Footnotes are numbered in reference order.
+    CommonMark's rules for lists, HTML blocks and headings differ a little
+    from Python-Markdown's, and abbreviations, attribute lists, Markdown
+    inside HTML and the [TOC] marker are not supported.
+    """
 
-        table.long-table tr {
-            page-break-inside: avoid;
-            page-break-after: auto;
-        }
+    name = 'markdown-it'
+    requirement = 'pip install markdown-it-py mdit-py-plugins'
+    unsupported = ('abbr', 'attr_list', 'md_in_html', 'toc_marker', 'python_markdown_syntax')
 
-        table.long-table thead {
-            display: table-header-group;
-        }
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.engines = {}
 
-        table.long-table tfoot {
-            display: table-footer-group;
-        }
+    def available(self):
+        return MARKDOWN_IT_AVAILABLE
 
-        th, td {
-            border: 1px solid #D4C4B5;
-            padding: 0.6em;
-            text-align: left;
-            word-wrap: break-word;
-        }
+    def engine(self, code_options):
+        """
+        The parser for one set of code options, built on first use.
 
-        th {
-            background-color: #E8DECE;
-            color: #2D2520;
-            font-weight: bold;
-            font-variant: small-caps;
-        }
+        MarkdownIt keeps no per-document state, so threads share it.
 
-        tr:nth-child(even) {
-            background-color: #F3EDE6;
-        }
+        Args:
+            code_options (tuple): Code highlighting options from document_code_options()
 
-        tr:nth-child(odd) {
-            background-color: #FAF8F5;
-        }
+        Returns:
+            MarkdownIt: Configured parser
+        """
+        with self.lock:
+            md = self.engines.get(code_options)
+            if md is None:
+                md = self.engines[code_options] = self.build(code_options)
+            return md
+
+    def build(self, code_options):
+        """Construct a MarkdownIt parser rendering klasiko's markup."""
+        md = MarkdownIt('commonmark', {'html': True, 'xhtmlOut': True}).enable('table')
+        md.use(footnote_plugin, inline=False).use(deflist_plugin)
+        md.add_render_rule('footnote_ref', _render_footnote_ref)
+        md.add_render_rule('footnote_block_open', _render_footnote_block_open)
+        md.add_render_rule('footnote_block_close', _render_footnote_block_close)
+        md.add_render_rule('footnote_open', _render_footnote_open)
+        md.add_render_rule('footnote_anchor', _render_footnote_anchor)
+
+        config = None
+        if PYGMENTS_AVAILABLE:
+            language, max_lines, max_bytes, large_code = code_options
+            guess = language == CODE_LANGUAGE_GUESS
+            config = CodeHighlightExtension(
+                guess_lang=guess,
+                default_language=None if guess else language,
+                max_lines=max_lines,
+                max_bytes=max_bytes,
+                large_code=large_code
+            ).getConfigs()
+
+        def render_code(code, lang=None, fenced=True):
+            if config is None:
+                lang_attr = f' class="language-{html.escape(lang)}"' if lang else ''
+                return f'<pre><code{lang_attr}>{html.escape(code, quote=False)}</code></pre>\n'
+            local_config = config.copy()
+            highlighter = CodeHighlighter(
+                code,
+                lang=lang,
+                tab_length=4,
+                style=local_config.pop('pygments_style', 'default'),
+                **local_config
+            )
+            return highlighter.hilite(shebang=not fenced)
+
+        def render_fence(renderer, tokens, idx, options, env):
+            match = FENCE_INFO_PATTERN.match(tokens[idx].info.strip())
+            return render_code(tokens[idx].content, match.group(1) if match else None)
+
+        def render_code_block(renderer, tokens, idx, options, env):
+            return render_code(tokens[idx].content, fenced=False)
+
+        md.add_render_rule('fence', render_fence)
+        md.add_render_rule('code_block', render_code_block)
+        return md
+
+    def convert(self, markdown_content, enable_toc=False, toc_depth=TOC_DEPTH, fast_parse=False):
+        md = self.engine(document_code_options(markdown_content))
+        env = {}
+        tokens = md.parse(markdown_content, env)
+
+        # Heading ids and toc tokens as Python-Markdown's toc extension makes them
+        headings = []
+        used_ids = set()
+        for index, token in enumerate(tokens):
+            if token.type != 'heading_open':
+                continue
+            children = [child for child in tokens[index + 1].children or [] if child.type != 'footnote_ref']
+            inner_html = md.renderer.renderInline(children, md.options, env)
+            name = markdown_toc.strip_tags(inner_html)
+            heading_id = markdown_toc.unique(markdown_toc.slugify(html.unescape(name), '-'), used_ids)
+            token.attrSet('id', heading_id)
+            headings.append({
+                'level': int(token.tag[1]),
+                'id': heading_id,
+                'name': name,
+                'html': inner_html,
+                'data-toc-label': ''
+            })
+        html_content = md.renderer.render(tokens, md.options, env)
+
+        # The toc div comes from Python-Markdown's own builder
+        with MARKDOWN_PARSERS.parser(enable_toc, toc_depth, extensions=('toc',)) as toc_md:
+            toc_processor = toc_md.treeprocessors['toc']
+            toc_tokens = markdown_toc.nest_toc_tokens([
+                heading for heading in headings
+                if toc_processor.toc_top <= heading['level'] <= toc_processor.toc_bottom
+            ])
+            toc = toc_md.serializer(toc_processor.build_toc_div(toc_tokens))
+            for postprocessor in toc_md.postprocessors:
+                toc = postprocessor.run(toc)
+        return html_content.strip(), ParsedMarkdown(toc, toc_tokens)
+
+
+MARKDOWN_BACKENDS = {backend.name: backend for backend in (PythonMarkdownBackend(), MarkdownItBackend())}
+DEFAULT_MARKDOWN_BACKEND = 'python-markdown'
+
+
+def get_markdown_backend(name=None):
+    """
+    Look up a Markdown parser backend.
 
-        ul, ol {
-            margin: 1em 0;
-            padding-left: 2.2em;
-        }
+    Args:
+        name (str): Backend name from MARKDOWN_BACKENDS (default: python-markdown)
 
-        li {
-            margin: 0.4em 0;
-        }
+    Returns:
+        MarkdownBackend: The backend
 
-        a {
-            color: #8B6F47;
-            text-decoration: none;
-        }
+    Raises:
+        ValueError: If the backend is unknown or its libraries aren't installed
+    """
+    name = name or DEFAULT_MARKDOWN_BACKEND
+    backend = MARKDOWN_BACKENDS.get(name)
+    if backend is None:
+        raise ValueError(f"Unknown Markdown parser '{name}'. Choose from: {', '.join(MARKDOWN_BACKENDS)}")
+    if not backend.available():
+        raise ValueError(f"The {name} parser is not installed. Install with: {backend.requirement}")
+    return backend
 
-        a:hover {
-            text-decoration: underline;
-        }
 
-        img {
-            max-width: 100%;
-            height: auto;
-            display: block;
-            margin: 1.5em auto;
-            page-break-inside: avoid;
-        }
+def markdown_to_html(markdown_content, enable_toc=False, toc_depth=TOC_DEPTH, fast_parse=False, parser_backend=None):
+    """
+    Convert Markdown text to HTML with klasiko's extensions.
 
-        .toc {
-            background-color: #F3EDE6;
-            border: 2px solid #9B8579;
-            padding: 1.8em;
-            margin: 2.5em 0 3.5em 0;
-            page-break-after: always;
-        }
+    Parsers are pooled or shared by the backend, so the returned md_instance
+    is a ParsedMarkdown snapshot (toc, toc_tokens) rather than the parser itself.
 
-        .toc-title {
-            font-size: 18pt;
-            font-weight: bold;
-            font-variant: small-caps;
-            margin-bottom: 1.2em;
-            text-align: center;
-            color: #2D2520;
-            letter-spacing: 0.5pt;
-        }
+    Args:
+        markdown_content (str): Raw Markdown content
+        enable_toc (bool): Whether to generate table of contents
+        toc_depth (str): Heading levels included in the table of contents
+        fast_parse (bool): Load only the extensions detect_markdown_extensions() finds a use for
+        parser_backend (str): Markdown parser from MARKDOWN_BACKENDS (default: python-markdown)
 
-        .toc ul {
-            list-style-type: none;
-            padding-left: 0;
-        }
+    Returns:
+        tuple: (html_content, md_instance)
+    """
+    backend = get_markdown_backend(parser_backend)
+    return backend.convert(markdown_content, enable_toc, toc_depth, fast_parse)
+
+
+INCREMENTAL_BLOCK_BREAK = 'klasikoblockbreak'
+INCREMENTAL_FOOTNOTES_BREAK = 'klasikofootnotesbreak'
+FENCE_PATTERN = re.compile(r'^(`{3,}|~{3,})')
+FENCED_REGION_PATTERN = re.compile(r'^(`{3,}|~{3,})[^\n]*\n.*?^\1[ ]*$', re.MULTILINE | re.DOTALL)
+LIST_ITEM_PATTERN = re.compile(r'^(?:[*+-]|\d+\.)(?:\s|$)')
+DEFINITION_PATTERN = re.compile(r'^\[[^\]]*\]:')
+DEFINITION_LIST_PATTERN = re.compile(r'^[ ]{0,3}:[ ]{1,3}')
+FOOTNOTE_SYNTAX_PATTERN = re.compile(r'\[\^[^\]]*\]')
+HEADING_ID_PATTERN = re.compile(r'(<h[1-6]\b[^>]*?\sid=")([^"]*)(")')
+# Document-wide constructs the block cache doesn't model (abbreviations, [TOC]
+# and footnote placement markers); documents using them are converted whole
+WHOLE_DOCUMENT_PATTERN = re.compile(r'^\*\[[^\]]*\]:|\[TOC\]|///Footnotes Go Here///', re.MULTILINE)
+
+
+def _starts_markdown_block(line, current):
+    """Whether an unindented line after a blank line starts a new top-level block."""
+    if line[0] in ' \t>:' or LIST_ITEM_PATTERN.match(line) or DEFINITION_PATTERN.match(line):
+        return False
+    if current[0].startswith('<'):
+        source = '\n'.join(current)
+        if source.startswith('<!--'):
+            return '-->' in source
+        finder = _TopLevelBlockFinder(source)
+        finder.feed(source)
+        return finder.depth == 0
+    return True
 
-        .toc li {
-            margin: 0.6em 0;
-            padding-left: 1.2em;
-        }
 
-        .toc a {
-            color: #8B6F47;
-            text-decoration: none;
-        }
+def split_markdown_blocks(markdown_content):
+    """
+    Split Markdown source into top-level blocks that convert independently.
 
-        .footnote {
-            font-size: 10pt;
-            line-height: 1.5;
-            color: #4A3F36;
-        }
+    A block ends at a blank line followed by an unindented line, except where
+    Markdown would carry on the same element: fenced code, list items, block
+    quotes, definition lists and unclosed raw HTML stay in one block. Link and
+    footnote definitions stay with the block before them, since they leave
+    nothing behind that would separate it from the next one.
 
-        .footnote-ref {
-            vertical-align: super;
-            font-size: 0.8em;
-            text-decoration: none;
-        }
+    Args:
+        markdown_content (str): Raw Markdown content
 
-        .footnote-backref {
-            text-decoration: none;
-        }
+    Returns:
+        list: Block sources, in document order
+    """
+    blocks = []
+    current = []
+    fence = None
+    after_blank = False
+    for line in markdown_content.replace('\r\n', '\n').replace('\r', '\n').split('\n'):
+        if fence:
+            current.append(line)
+            if line.rstrip(' ') == fence:
+                fence = None
+            continue
+        if not line.strip():
+            if current:
+                current.append(line)
+            after_blank = True
+            continue
+        if after_blank and current and _starts_markdown_block(line, current):
+            blocks.append(current)
+            current = []
+        if blocks and DEFINITION_LIST_PATTERN.match(line):
+            # A definition continues a definition list ending the block before
+            blocks[-1].extend([''] + current)
+            current = blocks.pop()
+        after_blank = False
+        match = FENCE_PATTERN.match(line)
+        if match:
+            fence = match.group(1)
+        current.append(line)
+    if current:
+        blocks.append(current)
+
+    for lines in blocks:
+        while not lines[-1].strip():
+            lines.pop()
+    return ['\n'.join(lines) for lines in blocks]
+
+
+def block_reference_definitions(block):
+    """
+    Find the link reference definitions ([id]: url "title") in one block.
 
-        hr {
-            border: none;
-            height: 2px;
-            background: linear-gradient(to right, transparent, #9B8579 20%, #9B8579 80%, transparent);
-            margin: 2.5em 0;
-        }
+    Args:
+        block (str): Block source from split_markdown_blocks()
 
-        h1, h2, h3 {
-            page-break-after: avoid;
-        }
+    Returns:
+        list: (id, (url, title)) pairs in order, keyed as Python-Markdown stores them
+    """
+    if block.startswith('<'):
+        return []
+    definitions = []
+    for match in ReferenceProcessor.RE.finditer(FENCED_REGION_PATTERN.sub('', block)):
+        reference_id = match.group(1).strip().lower()
+        if not reference_id.startswith('^'):  # footnote definition
+            definitions.append((reference_id, (match.group(2).lstrip('<').rstrip('>'), match.group(5) or match.group(6))))
+    return definitions
 
-        pre, img {
-            page-break-inside: avoid;
-        }
 
-        .title-page {
-            text-align: center;
-            margin-top: 10cm;
-            page-break-after: always;
-        }
-
-        .title-page h1 {
-            border: none;
-            border-top: 4px double #9B8579;
-            border-bottom: 4px double #9B8579;
-            padding: 1.5em 3em;
-            margin-bottom: 1.2em;
-            font-size: 26pt;
-            font-weight: bold;
-            font-variant: small-caps;
-            letter-spacing: 2pt;
-            color: #2D2520;
-        }
-
-        .title-page h2 {
-            border: none;
-            margin-top: 1em;
-            margin-bottom: 0.8em;
-            font-size: 18pt;
-            font-weight: normal;
-            font-style: italic;
-            font-variant: normal;
-            color: #3A3229;
-        }
-
-        .title-page h3 {
-            border: none;
-            margin-top: 0.5em;
-            margin-bottom: 2.5em;
-            font-size: 15pt;
-            font-weight: normal;
-            font-style: italic;
-            color: #6B5F54;
-        }
-
-        .meta-info {
-            color: #4A3F36;
-            margin-top: 3.5em;
-            font-size: 11pt;
-            line-height: 2;
-        }
-
-        .meta-info p {
-            margin: 0.4em 0;
-        }
-
-        .meta-info .meta-key {
-            font-weight: bold;
-            font-variant: small-caps;
-        }
+class _RecordedReferences(dict):
     """
+    Document-wide link references that remember every definition the parser
+    stores without applying it.
 
-
-def get_rustic_theme_css():
-    """
-    Return CSS for the full rustic theme with aged paper aesthetic.
-    Coffee browns, ornamental elements, maximum vintage character.
+    Only some blocks are converted, so a definition met in them may be one a
+    later block overrides (ids are case-insensitive: [a] then [A]). The
+    document-wide values already hold the definition that wins.
     """
-    return """
-        @page {
-            size: A4;
-            margin: 3cm 2.5cm;
-            background-color: #F4ECD8;
-
-            @top-left {
-                content: "❧";
-                font-size: 10pt;
-                color: #8B7355;
-            }
-
-            @top-center {
-                content: "• • •";
-                font-size: 8pt;
-                color: #A0826D;
-                letter-spacing: 0.4em;
-            }
-
-            @top-right {
-                content: "❧";
-                font-size: 10pt;
-                color: #8B7355;
-            }
-
-            @bottom-left {
-                content: "❧";
-                font-size: 10pt;
-                color: #8B7355;
-            }
-
-            @bottom-center {
-                content: "– " counter(page) " –";
-                font-size: 10pt;
-                color: #3D2B1F;
-                font-family: 'Garamond', 'Palatino', Georgia, serif;
-            }
-
-            @bottom-right {
-                content: "❧";
-                font-size: 10pt;
-                color: #8B7355;
-            }
-        }
-
-        body {
-            font-family: 'Palatino Linotype', 'Book Antiqua', Palatino, 'Garamond', Georgia, serif;
-            font-size: 11.5pt;
-            line-height: 1.7;
-            color: #2B1F17;
-            text-align: justify;
-            margin: 0;
-            padding: 0;
-            background-color: #F4ECD8;
-        }
-
-        h1, h2, h3, h4, h5, h6 {
-            font-family: 'Garamond', 'Palatino', Georgia, serif;
-            font-weight: bold;
-            color: #3D2B1F;
-            margin-top: 2em;
-            margin-bottom: 0.8em;
-            page-break-after: avoid;
-            break-after: avoid;
-            page-break-inside: avoid;
-            break-inside: avoid;
-        }
-
-        h1 {
-            font-size: 24pt;
-            text-align: center;
-            margin-top: 2.5em;
-            margin-bottom: 1.8em;
-            border-top: 3px double #8B7355;
-            border-bottom: 3px double #8B7355;
-            padding: 1em 2em;
-            font-variant: small-caps;
-            letter-spacing: 1.5pt;
-            position: relative;
-        }
-
-        h1::after {
-            content: "✦";
-            display: block;
-            text-align: center;
-            font-size: 16pt;
-            color: #8B7355;
-            margin-top: 0.6em;
-        }
-
-        h2 {
-            font-size: 18pt;
-            border-bottom: 2px solid #A0826D;
-            padding-bottom: 0.5em;
-            font-variant: small-caps;
-            page-break-before: always;
-            break-before: page;
-        }
-
-        /* First h2 after title should not force page break */
-        .content > h2:first-child,
-        h1 + h2,
-        hr + h2 {
-            page-break-before: avoid;
-            break-before: avoid;
-        }
-
-        h3 {
-            font-size: 14pt;
-            font-weight: bold;
-            font-style: normal;
-            color: #4A3728;
-        }
-
-        h4, h5, h6 {
-            font-size: 12pt;
-            font-weight: bold;
-            font-style: normal;
-            color: #4A3728;
-        }
-
-        p {
-            margin: 0 0 1.2em 0;
-            orphans: 2;
-            widows: 2;
-        }
-
-        blockquote {
-            margin: 1.5em 3em;
-            padding: 1em 1.5em;
-            border-left: 5px solid #8B7355;
-            border-right: 1px solid #C9B899;
-            background-color: #EDE1CF;
-            font-style: italic;
-            color: #4A3728;
-            font-size: 11pt;
-            position: relative;
-        }
-
-        blockquote::before {
-            content: "\\201C";
-            font-size: 48pt;
-            color: #A0826D;
-            opacity: 0.3;
-            position: absolute;
-            left: 0.2em;
-            top: -0.2em;
-            font-family: Georgia, serif;
-        }
-
-        code {
-            font-family: 'Courier New', 'DejaVu Mono', Courier, monospace;
-            font-size: 10pt;
-            background-color: #EDE1CF;
-            color: #4A3728;
-            padding: 0.15em 0.4em;
-            border-radius: 2px;
-        }
-
-        pre {
-            font-family: 'Courier New', 'DejaVu Mono', Courier, monospace;
-            font-size: 10pt;
-            background-color: #EDE1CF;
-            border: 1px solid #C9B899;
-            border-radius: 2px;
-            padding: 1em;
-            overflow: auto;
-            margin: 1.5em 0;
-            page-break-inside: avoid;
-        }
-
-        pre code {
-            background: none;
-            padding: 0;
-        }
-
-        table {
-            width: 100%;
-            border-collapse: collapse;
-            margin: 1.5em 0;
-            font-size: 10.5pt;
-            border: 2px solid #8B7355;
-            page-break-inside: auto;
-            break-inside: auto;
-        }
-
-        tr {
-            page-break-inside: avoid;
-            break-inside: avoid;
-        }
-
-        thead {
-            display: table-header-group;
-        }
-
-        thead tr {
-            page-break-after: avoid;
-            break-after: avoid;
-        }
-
-        table.long-table {
-            page-break-inside: auto;
-        }
-
-        table.long-table tr {
-            page-break-inside: avoid;
-            page-break-after: auto;
-        }
-
-        table.long-table thead {
-            display: table-header-group;
-        }
-
-        table.long-table tfoot {
-            display: table-footer-group;
-        }
-
-        th, td {
-            border: 1px solid #C9B899;
-            padding: 0.6em;
-            text-align: left;
-            word-wrap: break-word;
-        }
 
-        th {
-            background-color: #DDD0B8;
-            color: #2B1F17;
-            font-weight: bold;
-            font-variant: small-caps;
-        }
-
-        tr:nth-child(even) {
-            background-color: #EDE1CF;
-        }
-
-        tr:nth-child(odd) {
-            background-color: #F4ECD8;
-        }
-
-        ul, ol {
-            margin: 1em 0;
-            padding-left: 2.2em;
-        }
-
-        li {
-            margin: 0.4em 0;
-        }
-
-        a {
-            color: #8B4513;
-            text-decoration: none;
-        }
+    def __init__(self, references):
+        super().__init__(references)
+        self.defined = []
 
-        a:hover {
-            text-decoration: underline;
-        }
+    def __setitem__(self, key, value):
+        self.defined.append((key, value))
 
-        img {
-            max-width: 100%;
-            height: auto;
-            display: block;
-            margin: 1.5em auto;
-            page-break-inside: avoid;
-        }
 
-        .toc {
-            background-color: #EDE1CF;
-            border: 2px solid #8B7355;
-            padding: 2em;
-            margin: 2.5em 0 4em 0;
-            page-break-after: always;
-        }
+class _HeadingIdRecorder(Treeprocessor):
+    """
+    Record heading ids on either side of the toc extension, per block.
 
-        .toc-title {
-            font-size: 18pt;
-            font-weight: bold;
-            font-variant: small-caps;
-            margin-bottom: 1.5em;
-            text-align: center;
-            color: #3D2B1F;
-            letter-spacing: 0.8pt;
-        }
+    Before toc runs, note the slug of every heading without an id; afterwards,
+    note every heading's level, id and slug, and every id in each block. Block
+    breaks split the record, and a break is added before the footnotes.
+    """
 
-        .toc ul {
-            list-style-type: none;
-            padding-left: 0;
-        }
+    def __init__(self, md, after_toc):
+        super().__init__(md)
+        self.after_toc = after_toc
+
+    def run(self, root):
+        toc = self.md.treeprocessors['toc']
+        if not self.after_toc:
+            self.md.klasiko_slugs = {}
+            for element in root.iter():
+                if isinstance(element.tag, str) and toc.header_rgx.match(element.tag) and 'id' not in element.attrib:
+                    inner_html = markdown_toc.render_inner_html(markdown_toc.remove_fnrefs(element), self.md)
+                    name = markdown_toc.strip_tags(inner_html)
+                    self.md.klasiko_slugs[element] = toc.slugify(html.unescape(name), toc.sep)
+            return
+
+        segments = [{'headings': [], 'ids': set()}]
+        for child in list(root):
+            if child.tag == 'p' and child.text == INCREMENTAL_BLOCK_BREAK:
+                segments.append({'headings': [], 'ids': set()})
+                continue
+            if child.tag == 'div' and child.get('class') == 'footnote':
+                marker = root.makeelement('p', {})
+                marker.text = INCREMENTAL_FOOTNOTES_BREAK
+                marker.tail = '\n'
+                root.insert(list(root).index(child), marker)
+                segments.append({'headings': [], 'ids': set()})
+            for element in child.iter():
+                if 'id' in element.attrib:
+                    segments[-1]['ids'].add(element.get('id'))
+                if isinstance(element.tag, str) and toc.header_rgx.match(element.tag):
+                    level = int(element.tag[-1])
+                    in_toc = toc.toc_top <= level <= toc.toc_bottom
+                    segments[-1]['headings'].append([level, element.get('id'), self.md.klasiko_slugs.get(element), in_toc])
+        self.md.klasiko_segments = segments
+
+
+def build_incremental_parser(key):
+    """
+    Construct a parser for IncrementalMarkdownConverter: the regular
+    configuration plus heading id recorders around the toc extension.
 
-        .toc li {
-            margin: 0.6em 0;
-            padding-left: 1.2em;
-        }
+    Args:
+        key (tuple): Parser configuration key
 
-        .toc a {
-            color: #8B4513;
-            text-decoration: none;
-        }
+    Returns:
+        markdown.Markdown: Freshly configured parser
+    """
+    md = build_markdown_parser(key)
+    md.treeprocessors.register(_HeadingIdRecorder(md, after_toc=False), 'klasiko-ids-before-toc', 6)
+    md.treeprocessors.register(_HeadingIdRecorder(md, after_toc=True), 'klasiko-ids-after-toc', 4)
+    return md
 
-        .footnote {
-            font-size: 10pt;
-            line-height: 1.5;
-            color: #4A3728;
-        }
 
-        .footnote-ref {
-            vertical-align: super;
-            font-size: 0.8em;
-            text-decoration: none;
-        }
+INCREMENTAL_PARSERS = MarkdownParserPool(build=build_incremental_parser)
 
-        .footnote-backref {
-            text-decoration: none;
-        }
 
-        hr {
-            border: none;
-            height: 2px;
-            background: linear-gradient(to right, transparent, #8B7355 20%, #8B7355 80%, transparent);
-            margin: 2.5em 0;
-            position: relative;
-        }
+def _flatten_toc_tokens(tokens):
+    """Nested toc tokens in document order, without their children."""
+    flat = []
+    for token in tokens:
+        flat.append({name: value for name, value in token.items() if name != 'children'})
+        flat.extend(_flatten_toc_tokens(token.get('children', [])))
+    return flat
 
-        hr::after {
-            content: "❧";
-            display: block;
-            text-align: center;
-            margin-top: -0.9em;
-            background: #F4ECD8;
-            width: 2em;
-            margin-left: auto;
-            margin-right: auto;
-            color: #8B7355;
-            font-size: 14pt;
-        }
 
-        h1, h2, h3 {
-            page-break-after: avoid;
-        }
+class IncrementalMarkdownConverter:
+    """
+    Markdown-to-HTML conversion that only reconverts blocks that changed.
+
+    The source is split into top-level blocks and each block's HTML is cached
+    by a hash of its text. State shared between blocks is kept outside the
+    block cache:
+
+    - Link references are gathered from the whole document and fed to every
+      conversion. The references are part of each block's cache key.
+    - Blocks with footnotes are converted together, so their numbering,
+      back-references and footnote list match a full conversion.
+    - Heading ids are assigned after conversion, in document order, the way
+      the toc extension would. The table of contents is built from them.
+
+    Documents using abbreviations or [TOC] markers are converted whole. So is
+    any document whose references the block scan misread. The output is the
+    same as markdown_to_html(). One converter serves one document at a time,
+    for example in watch mode. Its cache only keeps the blocks of the latest
+    version of the document.
+    """
 
-        pre, img {
-            page-break-inside: avoid;
-        }
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.blocks = {}
+        self.reused = 0
+        self.converted = 0
+        self.whole = False
 
-        .title-page {
-            text-align: center;
-            margin-top: 10cm;
-            page-break-after: always;
-        }
+    def convert(self, markdown_content, enable_toc=False, toc_depth=TOC_DEPTH):
+        """
+        Convert Markdown text to HTML, reusing cached blocks.
 
-        .title-page h1 {
-            border: none;
-            border-top: 4px double #8B7355;
-            border-bottom: 4px double #8B7355;
-            padding: 1.8em 3em;
-            margin-bottom: 1.5em;
-            font-size: 28pt;
-            font-weight: bold;
-            font-variant: small-caps;
-            letter-spacing: 2.5pt;
-            color: #2B1F17;
-        }
+        Args:
+            markdown_content (str): Raw Markdown content
+            enable_toc (bool): Whether to generate table of contents
+            toc_depth (str): Heading levels included in the table of contents
 
-        .title-page h1::before {
-            content: "✦  ✦  ✦";
-            display: block;
-            font-size: 14pt;
-            color: #8B7355;
-            margin-bottom: 0.8em;
-            letter-spacing: 1em;
-        }
+        Returns:
+            tuple: (html_content, md_instance) as from markdown_to_html()
+        """
+        with self.lock:
+            code_options = document_code_options(markdown_content)
+            key = markdown_parser_key(enable_toc, toc_depth, code_options)
+            blocks = split_markdown_blocks(markdown_content)
+            self.whole = not blocks or bool(WHOLE_DOCUMENT_PATTERN.search(markdown_content))
+            result = None if self.whole else self._convert_blocks(key, blocks, enable_toc, toc_depth, code_options)
+            if result is None:
+                self.whole = True
+                self.reused, self.converted = 0, len(blocks)
+                self.blocks.pop(key, None)
+                return markdown_to_html(markdown_content, enable_toc, toc_depth)
+            return result
+
+    def _convert_blocks(self, key, blocks, enable_toc, toc_depth, code_options):
+        """Convert the blocks missing from the cache and assemble the document; None to convert it whole."""
+        references = dict(definition for block in blocks for definition in block_reference_definitions(block))
+        context = hashlib.sha256(repr((key, sorted(references.items()))).encode('utf-8')).hexdigest()
+        footnote_blocks = [block for block in blocks if FOOTNOTE_SYNTAX_PATTERN.search(block)]
+        footnote_context = hashlib.sha256('\0'.join([context] + footnote_blocks).encode('utf-8')).hexdigest()
+
+        # Footnote blocks depend on each other, so they are cached by position
+        # under a key covering all of them
+        keys = []
+        footnote_keys = []
+        for block in blocks:
+            if FOOTNOTE_SYNTAX_PATTERN.search(block):
+                footnote_keys.append(f"{footnote_context}:{len(footnote_keys)}")
+                keys.append(footnote_keys[-1])
+            else:
+                keys.append(hashlib.sha256(f"{context}\0{block}".encode('utf-8')).hexdigest())
+        footnotes_key = f"{footnote_context}:footnotes"
+
+        cached = self.blocks.get(key, {})
+        entries = {}
+        plain = {}
+        for block_key, block in zip(keys, blocks):
+            if block_key in cached:
+                entries[block_key] = cached[block_key]
+            elif not FOOTNOTE_SYNTAX_PATTERN.search(block):
+                plain[block_key] = block
+        if footnote_blocks and footnotes_key in cached:
+            entries[footnotes_key] = cached[footnotes_key]
+        self.converted = len(plain) + (len(footnote_blocks) if footnote_blocks and footnotes_key not in entries else 0)
+        self.reused = len(blocks) - self.converted
+
+        with INCREMENTAL_PARSERS.parser(enable_toc, toc_depth, code_options) as md:
+            groups = [(list(plain), list(plain.values()))]
+            if footnote_blocks and footnotes_key not in entries:
+                groups.append((footnote_keys + [footnotes_key], footnote_blocks))
+            for group_keys, group in groups:
+                if not group:
+                    continue
+                segments = self._convert_group(md, group, references)
+                if segments is None:
+                    return None
+                entries.update(zip(group_keys, segments))
+
+            if footnote_blocks:
+                keys.append(footnotes_key)
+            self.blocks[key] = {block_key: entries[block_key] for block_key in keys}
+            return self._assemble(md, [entries[block_key] for block_key in keys])
+
+    def _convert_group(self, md, group, references):
+        """Convert blocks in one pass, split per block plus the footnotes; None if the references were misread."""
+        md.reset()
+        md.references = _RecordedReferences(references)
+        output = md.convert(''.join(f"{block}\n\n{INCREMENTAL_BLOCK_BREAK}\n\n" for block in group))
+        if md.references.defined != [definition for block in group for definition in block_reference_definitions(block)]:
+            return None
+
+        # Every block is followed by a break; raw HTML blocks keep the extra
+        # newline Python-Markdown leaves after them
+        output, _, footnote_html = output.partition(f"<p>{INCREMENTAL_FOOTNOTES_BREAK}</p>")
+        pieces = output.split(f"<p>{INCREMENTAL_BLOCK_BREAK}</p>")[:-1] + [footnote_html]
+        pieces = [piece[piece.startswith('\n'):len(piece) - piece.endswith('\n')] for piece in pieces]
+        tokens = iter(_flatten_toc_tokens(md.toc_tokens))
+        segments = []
+        for piece, recorded in zip(pieces, md.klasiko_segments + [{'headings': [], 'ids': set()}]):
+            headings = []
+            for level, heading_id, slug, in_toc in recorded['headings']:
+                headings.append((level, heading_id, slug, next(tokens) if in_toc else None))
+            explicit_ids = recorded['ids'] - {heading[1] for heading in headings if heading[2] is not None}
+            segments.append({'html': piece, 'headings': headings, 'ids': explicit_ids})
+        return segments
+
+    def _assemble(self, md, segments):
+        """Join cached block HTML, assigning heading ids in document order."""
+        used_ids = set()
+        for segment in segments:
+            used_ids.update(segment['ids'])
+
+        parts = []
+        toc_tokens = []
+        for segment in segments:
+            final_ids = []
+            for level, heading_id, slug, token in segment['headings']:
+                final_id = heading_id if slug is None else markdown_toc.unique(slug, used_ids)
+                final_ids.append((heading_id, final_id))
+                if token is not None:
+                    toc_tokens.append(dict(token, id=final_id))
+
+            def rename(match):
+                if final_ids and final_ids[0][0] == match.group(2):
+                    return match.group(1) + final_ids.pop(0)[1] + match.group(3)
+                return match.group(0)
+
+            segment_html = HEADING_ID_PATTERN.sub(rename, segment['html'])
+            if segment_html:
+                parts.append(segment_html)
+
+        toc_tokens = markdown_toc.nest_toc_tokens(toc_tokens)
+        toc = md.serializer(md.treeprocessors['toc'].build_toc_div(toc_tokens))
+        for postprocessor in md.postprocessors:
+            toc = postprocessor.run(toc)
+        return '\n'.join(parts).strip(), ParsedMarkdown(toc, toc_tokens)
 
-        .title-page h1::after {
-            content: "✦  ✦  ✦";
-            display: block;
-            font-size: 14pt;
-            color: #8B7355;
-            margin-top: 0.8em;
-            letter-spacing: 1em;
-        }
 
-        .title-page h2 {
-            border: none;
-            margin-top: 1em;
-            margin-bottom: 0.8em;
-            font-size: 18pt;
-            font-weight: normal;
-            font-style: italic;
-            font-variant: normal;
-            color: #3D2B1F;
-        }
+def get_default_theme_css():
+    """
+    Return CSS for the default clean, professional theme.
+    Original white paper styling with neutral colors.
+    Loaded from themes/default.css.
+    """
+    return get_theme_css('default')
 
-        .title-page h3 {
-            border: none;
-            margin-top: 0.5em;
-            margin-bottom: 3em;
-            font-size: 15pt;
-            font-weight: normal;
-            font-style: italic;
-            color: #6B5344;
-        }
 
-        .meta-info {
-            color: #4A3728;
-            margin-top: 4em;
-            font-size: 11pt;
-            line-height: 2;
-        }
+def get_warm_theme_css():
+    """
+    Return CSS for the warm neutral theme with vintage typography.
+    Warm tones, double borders, small-caps headings, generous spacing.
+    Loaded from themes/warm.css.
+    """
+    return get_theme_css('warm')
 
-        .meta-info p {
-            margin: 0.4em 0;
-        }
 
-        .meta-info .meta-key {
-            font-weight: bold;
-            font-variant: small-caps;
-        }
+def get_rustic_theme_css():
+    """
+    Return CSS for the full rustic theme with aged paper aesthetic.
+    Coffee browns, ornamental elements, maximum vintage character.
+    Loaded from themes/rustic.css.
     """
+    return get_theme_css('rustic')
 
 
 def generate_logo_css(logo_data_uri, logo_position='header', logo_size='medium'):
@@ -1520,320 +1598,536 @@ def generate_logo_css(logo_data_uri, logo_position='header', logo_size='medium')
     return logo_css
 
 
+def generate_placements_css(logo_data_uri, logo_placements):
+    """
+    Generate the logo CSS for every placement.
+
+    Args:
+        logo_data_uri (str): Base64 data URI of the logo
+        logo_placements (list): List of dicts with 'position' and 'size' keys
+
+    Returns:
+        str: CSS string for all placements
+    """
+    if not logo_data_uri or not logo_placements:
+        return ""
+    return ''.join(
+        generate_logo_css(logo_data_uri, placement.get('position', 'header'), placement.get('size', 'medium'))
+        for placement in logo_placements
+    )
+
+
 def get_clean_theme_css():
     """
     Return CSS for the clean modern theme.
     Sans-serif typography, minimal decoration, maximum readability.
+    Loaded from themes/clean.css.
     """
-    return """
-        @page {
-            size: A4;
-            margin: 2.5cm 2cm;
+    return get_theme_css('clean')
 
-            @top-left {
-                content: "";
-            }
 
-            @top-center {
-                content: "";
-            }
+def get_cache_dir():
+    """
+    Return klasiko's on-disk cache directory, creating it if needed.
 
-            @top-right {
-                content: "";
-            }
+    Set KLASIKO_CACHE_DIR to override the default (~/.cache/klasiko).
 
-            @bottom-left {
-                content: "";
-            }
+    Returns:
+        Path: Cache directory
+    """
+    cache_dir = Path(os.environ.get('KLASIKO_CACHE_DIR') or Path.home() / '.cache' / 'klasiko')
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
 
-            @bottom-center {
-                content: counter(page);
-                font-size: 9pt;
-                color: #666;
-                font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', 'Helvetica Neue', Arial, sans-serif;
-            }
 
-            @bottom-right {
-                content: "";
-            }
-        }
+def get_user_theme_dir():
+    """
+    Return the directory searched for user themes.
 
-        body {
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', 'Helvetica Neue', Arial, sans-serif;
-            font-size: 11pt;
-            line-height: 1.7;
-            color: #1a1a1a;
-            text-align: left;
-            margin: 0;
-            padding: 0;
-            background: #fff;
-        }
+    Set KLASIKO_THEME_DIR to override the default (~/.klasiko/themes).
 
-        h1, h2, h3, h4, h5, h6 {
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', 'Helvetica Neue', Arial, sans-serif;
-            font-weight: 600;
-            color: #111;
-            margin-top: 1.8em;
-            margin-bottom: 0.6em;
-            line-height: 1.3;
-            page-break-after: avoid;
-            break-after: avoid;
-            page-break-inside: avoid;
-            break-inside: avoid;
-        }
+    Returns:
+        Path: User theme directory (may not exist)
+    """
+    return Path(os.environ.get('KLASIKO_THEME_DIR') or Path.home() / '.klasiko' / 'themes')
 
-        h1 {
-            font-size: 24pt;
-            font-weight: 700;
-            text-align: left;
-            margin-top: 0;
-            margin-bottom: 1em;
-            padding-bottom: 0.5em;
-            border-bottom: 3px solid #111;
-        }
 
-        h2 {
-            font-size: 18pt;
-            font-weight: 600;
-            padding-bottom: 0.3em;
-            border-bottom: 1px solid #e0e0e0;
-            page-break-before: always;
-            break-before: page;
-        }
+def available_themes():
+    """
+    Discover built-in and user themes.
 
-        /* First h2 after title should not force page break */
-        .content > h2:first-child,
-        h1 + h2,
-        hr + h2 {
-            page-break-before: avoid;
-            break-before: avoid;
-        }
+    Every <name>.css file in the built-in themes folder or the user theme
+    directory is a theme. User themes override built-ins of the same name.
 
-        h3 {
-            font-size: 14pt;
-            font-weight: 600;
-            color: #333;
-        }
+    Returns:
+        dict: Theme name -> Path of its source stylesheet
+    """
+    themes = {}
+    for theme_dir in (BUILTIN_THEME_DIR, get_user_theme_dir()):
+        if theme_dir.is_dir():
+            for path in sorted(theme_dir.glob('*.css')):
+                if not path.name.endswith('.min.css'):
+                    themes[path.stem] = path
+    return themes
 
-        h4 {
-            font-size: 12pt;
-            font-weight: 600;
-            color: #444;
-        }
 
-        h5, h6 {
-            font-size: 11pt;
-            font-weight: 600;
-            color: #555;
-        }
+def validate_css(css_text):
+    """
+    Check a stylesheet for syntax errors.
 
-        p {
-            margin-top: 0;
-            margin-bottom: 1em;
-        }
+    Args:
+        css_text (str): CSS source
 
-        a {
-            color: #0066cc;
-            text-decoration: none;
-        }
+    Returns:
+        list: Error messages ("line:column message"), empty if the CSS is valid
+    """
+    import tinycss2
+
+    errors = []
+    rules = tinycss2.parse_stylesheet(css_text, skip_comments=True, skip_whitespace=True)
+    pending = list(rules)
+    while pending:
+        node = pending.pop()
+        if node.type == 'error':
+            errors.append(f"{node.source_line}:{node.source_column} {node.message}")
+        elif node.type in ('qualified-rule', 'at-rule') and node.content is not None:
+            # Nested rules (@media, @page margin boxes) and declarations
+            pending.extend(tinycss2.parse_blocks_contents(node.content, skip_comments=True, skip_whitespace=True))
+    return sorted(errors, key=lambda error: [int(n) for n in error.split(' ', 1)[0].split(':')])
+
+
+def minify_css(css_text):
+    """
+    Minify CSS by dropping comments and insignificant whitespace.
 
-        blockquote {
-            margin: 1.5em 0;
-            padding: 0.8em 1.2em;
-            border-left: 4px solid #0066cc;
-            background: #f8f9fa;
-            font-style: normal;
-            color: #333;
-        }
+    Works on tinycss2 tokens, so strings and url() values are never altered.
 
-        blockquote p:last-child {
-            margin-bottom: 0;
-        }
+    Args:
+        css_text (str): CSS source
 
-        pre {
-            font-family: 'SF Mono', 'Monaco', 'Menlo', 'Consolas', 'Liberation Mono', monospace;
-            font-size: 9.5pt;
-            background: #f6f8fa;
-            border: 1px solid #e1e4e8;
-            border-radius: 6px;
-            padding: 1em;
-            margin: 1em 0;
-            overflow-x: auto;
-            line-height: 1.5;
-        }
+    Returns:
+        str: Minified CSS
+    """
+    import tinycss2
+
+    # Whitespace is never needed after these, nor before them (except ':',
+    # where "a :hover" and "a:hover" are different selectors)
+    tight_after = {'{', '}', ';', ',', ':', '>'}
+    tight_before = {'{', '}', ';', ',', '>', '!'}
+
+    def serialize(tokens):
+        pieces = []
+        for token in tokens:
+            if token.type == 'comment':
+                continue
+            if token.type == 'whitespace':
+                pieces.append(None)
+            elif token.type == '{} block':
+                content = serialize(token.content)
+                pieces += ['{', content[:-1] if content.endswith(';') else content, '}']
+            elif token.type == '() block':
+                pieces.append('(' + serialize(token.content) + ')')
+            elif token.type == '[] block':
+                pieces.append('[' + serialize(token.content) + ']')
+            elif token.type == 'function':
+                pieces.append(tinycss2.serialize([token]).split('(', 1)[0] + '(' + serialize(token.arguments) + ')')
+            else:
+                pieces.append(token.serialize())
 
-        code {
-            font-family: 'SF Mono', 'Monaco', 'Menlo', 'Consolas', 'Liberation Mono', monospace;
-            font-size: 9.5pt;
-            background: #f6f8fa;
-            padding: 0.2em 0.4em;
-            border-radius: 3px;
-        }
+        # Keep a single space only where it separates two significant tokens
+        output = []
+        for index, piece in enumerate(pieces):
+            if piece is not None:
+                output.append(piece)
+                continue
+            following = next((p for p in pieces[index + 1:] if p is not None), None)
+            if output and following is not None and output[-1] != ' ' \
+                    and output[-1] not in tight_after and following not in tight_before:
+                output.append(' ')
+        return ''.join(output)
 
-        pre code {
-            background: none;
-            padding: 0;
-            border-radius: 0;
-        }
+    return serialize(tinycss2.parse_component_value_list(css_text, skip_comments=True)).strip()
 
-        table {
-            width: 100%;
-            border-collapse: collapse;
-            margin: 1.5em 0;
-            font-size: 10.5pt;
-            page-break-inside: auto;
-            break-inside: auto;
-        }
 
-        tr {
-            page-break-inside: avoid;
-            break-inside: avoid;
-        }
+def compile_theme(source_path):
+    """
+    Return the minified, validated CSS for a theme stylesheet.
 
-        thead {
-            display: table-header-group;
-        }
+    Built-in themes are compiled into <name>.min.css at package build time
+    (klasiko themes --compile). Any other stylesheet - user themes, or built-ins
+    in a source checkout - is compiled on first use and cached on disk by
+    content hash, so later runs load it as fast as a prebuilt theme.
 
-        thead tr {
-            page-break-after: avoid;
-            break-after: avoid;
-        }
+    Args:
+        source_path (Path): Theme source stylesheet
 
-        th {
-            background: #f6f8fa;
-            font-weight: 600;
-            text-align: left;
-            padding: 0.75em 1em;
-            border-bottom: 2px solid #d0d7de;
-        }
+    Returns:
+        str: Compiled CSS
+    """
+    source_path = Path(source_path)
+    stat = source_path.stat()
+    key = (str(source_path), stat.st_mtime_ns, stat.st_size)
+    if key in _COMPILED_THEMES:
+        return _COMPILED_THEMES[key]
+
+    prebuilt = source_path.with_suffix('.min.css')
+    if prebuilt.exists() and prebuilt.stat().st_mtime_ns >= stat.st_mtime_ns:
+        compiled = prebuilt.read_text(encoding='utf-8')
+    else:
+        source = source_path.read_bytes()
+        cache_path = get_cache_dir() / 'themes' / f"{hashlib.sha256(source).hexdigest()[:16]}.min.css"
+        if cache_path.exists():
+            compiled = cache_path.read_text(encoding='utf-8')
+        else:
+            css_text = source.decode('utf-8')
+            for error in validate_css(css_text):
+                print(f"Warning: {source_path.name}:{error}")
+            compiled = minify_css(css_text)
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = cache_path.with_suffix(f'.{os.getpid()}.tmp')
+            temp_path.write_text(compiled, encoding='utf-8')
+            os.replace(temp_path, cache_path)
+
+    _COMPILED_THEMES[key] = compiled
+    return compiled
 
-        td {
-            padding: 0.75em 1em;
-            border-bottom: 1px solid #e1e4e8;
-            vertical-align: top;
-        }
 
-        tr:last-child td {
-            border-bottom: none;
-        }
+def get_theme_css(theme='warm'):
+    """
+    Get CSS for the specified theme.
 
-        ul, ol {
-            margin: 1em 0;
-            padding-left: 1.8em;
-        }
+    Only the selected theme's stylesheet is read, compiled on first use.
 
-        li {
-            margin-bottom: 0.4em;
-            line-height: 1.6;
-        }
+    Args:
+        theme (str): Theme name - 'default', 'warm', 'rustic', 'clean' or a user theme
 
-        hr {
-            border: none;
-            border-top: 1px solid #e1e4e8;
-            margin: 2em 0;
-        }
+    Returns:
+        str: CSS string for the theme
 
-        img {
-            max-width: 100%;
-            height: auto;
-        }
+    Raises:
+        ValueError: If no theme has this name, or no themes are installed
+    """
+    themes = available_themes()
+    if not themes:
+        raise ValueError(f"No themes found: the theme directory {BUILTIN_THEME_DIR} is missing or empty")
+    if theme not in themes:
+        raise ValueError(f"Unknown theme '{theme}'. Choose from: {', '.join(sorted(themes))}")
+    return compile_theme(themes[theme])
 
-        /* TOC Styling */
-        .toc {
-            background: #f8f9fa;
-            border: 1px solid #e1e4e8;
-            border-radius: 6px;
-            padding: 1.5em 2em;
-            margin-bottom: 2em;
-        }
 
-        .toc-title {
-            font-size: 14pt;
-            font-weight: 600;
-            margin-bottom: 1em;
-            color: #111;
-        }
+def themes_main(argv):
+    """Command line entry point for `klasiko themes`."""
+    parser = argparse.ArgumentParser(
+        prog='klasiko themes',
+        description='List available themes, or precompile the built-in themes for packaging'
+    )
+    parser.add_argument(
+        '--compile',
+        action='store_true',
+        help='Validate the built-in themes and write minified <name>.min.css files next to them'
+    )
+    args = parser.parse_args(argv)
+
+    if not args.compile:
+        user_dir = get_user_theme_dir()
+        for name, path in available_themes().items():
+            origin = 'user' if path.parent == user_dir else 'built-in'
+            print(f"  {name:<12} {origin:<9} {path}")
+        return 0
+
+    failed = False
+    for source_path in sorted(BUILTIN_THEME_DIR.glob('*.css')):
+        if source_path.name.endswith('.min.css'):
+            continue
+        css_text = source_path.read_text(encoding='utf-8')
+        errors = validate_css(css_text)
+        if errors:
+            failed = True
+            print(f"✗ {source_path.name}")
+            for error in errors:
+                print(f"    {error}")
+            continue
+        compiled = minify_css(css_text)
+        source_path.with_suffix('.min.css').write_text(compiled, encoding='utf-8')
+        print(f"✓ {source_path.name}: {len(css_text)} → {len(compiled)} bytes")
+
+    return 1 if failed else 0
+
+
+METRIC_DEFINITIONS = {
+    'klasiko_conversions_total': ('counter', 'Documents converted successfully'),
+    'klasiko_conversion_failures_total': ('counter', 'Failed conversions by exception class'),
+    'klasiko_pages_total': ('counter', 'Pages written'),
+    'klasiko_input_bytes_total': ('counter', 'Markdown bytes read'),
+    'klasiko_output_bytes_total': ('counter', 'Output bytes written'),
+    'klasiko_worker_recycles_total': ('counter', 'Worker processes replaced, by reason (jobs, rss, memory_error, crashed)'),
+    'klasiko_stage_seconds': ('histogram', 'Time spent per conversion stage (parse, assemble, layout, write)'),
+}
+METRIC_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms for conversions, exported in the Prometheus text format.
 
-        .toc ul {
-            list-style: none;
-            padding-left: 0;
-            margin: 0;
-        }
+    Worker processes keep their own registry; they hand a drain() snapshot back
+    with each result and the parent merge()s it, so totals cover every process.
+    """
 
-        .toc li {
-            margin-bottom: 0.3em;
-        }
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        """Add value to a counter."""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Record one histogram observation."""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            buckets, total, count = self.histograms.get(key, ([0] * len(METRIC_BUCKETS), 0.0, 0))
+            buckets = [n + (value <= bound) for n, bound in zip(buckets, METRIC_BUCKETS)]
+            self.histograms[key] = (buckets, total + value, count + 1)
+
+    @contextlib.contextmanager
+    def stage(self, stage, theme):
+        """Time a block as one conversion stage."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe('klasiko_stage_seconds', time.time() - start, stage=stage, theme=theme)
+
+    def snapshot(self):
+        """Return a picklable copy of every metric."""
+        with self.lock:
+            return {'counters': dict(self.counters), 'histograms': dict(self.histograms)}
+
+    def drain(self):
+        """Return a snapshot and reset, for handing a worker's metrics to its parent."""
+        with self.lock:
+            snapshot = {'counters': self.counters, 'histograms': self.histograms}
+            self.counters, self.histograms = {}, {}
+        return snapshot
+
+    def merge(self, snapshot):
+        """Add a snapshot from another process into this registry."""
+        if not snapshot:
+            return
+        with self.lock:
+            for key, value in snapshot['counters'].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, (buckets, total, count) in snapshot['histograms'].items():
+                old_buckets, old_total, old_count = self.histograms.get(key, ([0] * len(METRIC_BUCKETS), 0.0, 0))
+                self.histograms[key] = (
+                    [a + b for a, b in zip(old_buckets, buckets)], old_total + total, old_count + count
+                )
+
+    def render(self):
+        """
+        Format every metric in the Prometheus text exposition format.
 
-        .toc ul ul {
-            padding-left: 1.5em;
-            margin-top: 0.3em;
-        }
+        Returns:
+            str: Exposition text, suitable for /metrics or a textfile collector
+        """
+        def label_text(labels):
+            if not labels:
+                return ''
+            escaped = [(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                       for key, value in labels]
+            return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+        snapshot = self.snapshot()
+        lines = []
+        for name, (kind, help_text) in METRIC_DEFINITIONS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == 'counter':
+                for (metric, labels), value in sorted(snapshot['counters'].items()):
+                    if metric == name:
+                        lines.append(f"{name}{label_text(labels)} {value}")
+            else:
+                for (metric, labels), (buckets, total, count) in sorted(snapshot['histograms'].items()):
+                    if metric != name:
+                        continue
+                    for bound, bucket_count in zip(METRIC_BUCKETS, buckets):
+                        lines.append(f"{name}_bucket{label_text(labels + (('le', bound),))} {bucket_count}")
+                    lines.append(f"{name}_bucket{label_text(labels + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{name}_sum{label_text(labels)} {total:.6f}")
+                    lines.append(f"{name}_count{label_text(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """Write the metrics atomically, for node_exporter's textfile collector."""
+        path = Path(path)
+        temp_path = path.with_name(path.name + '.tmp')
+        temp_path.write_text(self.render(), encoding='utf-8')
+        os.replace(temp_path, path)
+
+
+METRICS = MetricsRegistry()
+
+
+def record_conversion(theme, error=None):
+    """Count a finished conversion, or a failed one by exception class."""
+    if error is None:
+        METRICS.inc('klasiko_conversions_total', theme=theme)
+    else:
+        METRICS.inc('klasiko_conversion_failures_total', theme=theme, exception=type(error).__name__)
+
+
+def write_metrics_file(metrics_file):
+    """Write METRICS to a textfile-collector file, reporting rather than raising on failure."""
+    if not metrics_file:
+        return
+    try:
+        METRICS.write_textfile(metrics_file)
+        print(f"📊 Metrics: {metrics_file}")
+    except OSError as e:
+        print(f"Warning: Could not write metrics file: {e}")
 
-        .toc a {
-            color: #333;
-            text-decoration: none;
-        }
 
-        .toc a:hover {
-            color: #0066cc;
-        }
+PROGRESS_STAGES = ('read', 'process', 'build', 'render', 'finalize')
+# Rough amount of body text on a laid-out page, for page estimates before layout
+PROGRESS_CHARS_PER_PAGE = 2800
 
-        /* Front matter */
-        .front-matter {
-            margin-bottom: 2em;
-            padding-bottom: 1em;
-            border-bottom: 1px solid #e1e4e8;
-        }
 
-        .front-matter p {
-            margin: 0.3em 0;
-            color: #666;
-            font-size: 10pt;
-        }
+class JsonlProgress:
+    """
+    Progress callback that writes each event as one JSON line.
 
-        /* Logo styling */
-        .logo-title, .logo-header, .logo-footer {
-            text-align: center;
-        }
+    Used by --progress=jsonl; every event gets a wall-clock 'time' and the
+    'elapsed' seconds since the first event.
+    """
 
-        .logo-title img {
-            margin-bottom: 1.5em;
-        }
+    def __init__(self, stream):
+        self.stream = stream
+        self.started = None
 
-        /* Footer note */
-        .footer-note {
-            margin-top: 3em;
-            padding-top: 1em;
-            border-top: 1px solid #e1e4e8;
-            font-size: 9pt;
-            color: #666;
-            text-align: center;
-        }
-    """
+    def __call__(self, event):
+        now = time.time()
+        if self.started is None:
+            self.started = now
+        record = dict(event, time=round(now, 3), elapsed=round(now - self.started, 3))
+        self.stream.write(json.dumps(record, default=str) + '\n')
+        self.stream.flush()
 
 
-def get_theme_css(theme='warm'):
+def estimate_page_count(html_content, enable_toc=False):
     """
-    Get CSS for the specified theme.
+    Estimate how many pages a document will lay out to, before layout runs.
+
+    Counts body text, with extra allowance for the title page, the TOC and
+    images, so progress consumers can show a fraction and ETA while pages are
+    laid out. It is an estimate; page events report the real page numbers.
 
     Args:
-        theme (str): Theme name - 'default', 'warm', 'rustic', or 'clean'
+        html_content (str): Converted Markdown body
+        enable_toc (bool): Whether a TOC page is added
 
     Returns:
-        str: CSS string for the theme
+        int: Estimated page count (at least 1)
     """
-    themes = {
-        'default': get_default_theme_css,
-        'warm': get_warm_theme_css,
-        'rustic': get_rustic_theme_css,
-        'clean': get_clean_theme_css
-    }
+    text_length = len(re.sub(r'<[^>]+>', '', html_content))
+    images = len(re.findall(r'<img\b', html_content, re.IGNORECASE))
+    return 1 + int(enable_toc) + max(1, round(text_length / PROGRESS_CHARS_PER_PAGE + images / 2))
 
-    theme_function = themes.get(theme, get_warm_theme_css)
-    return theme_function()
 
+class _LayoutProgressHandler(logging.Handler):
+    """
+    Turn WeasyPrint's progress log into page and repagination events.
+
+    Each repagination pass (for counter(pages), cross-references...) lays the
+    pages out again from page 1 and logs unchanged pages as "(up-to-date)".
+    Only pages beyond the highest one reported so far become page events, so
+    page numbers never go backwards; a pass that adds pages reports just those.
+    """
+
+    def __init__(self, progress, estimated_pages):
+        super().__init__(logging.INFO)
+        self.progress = progress
+        self.estimated_pages = estimated_pages
+        self.layout_pass = 0
+        self.pages = 0
+
+    def emit(self, record):
+        message = record.msg
+        try:
+            if 'Creating layout - Page' in message and 'up-to-date' not in message:
+                if record.args[0] > self.pages:
+                    self.pages = record.args[0]
+                    self.progress({'event': 'page', 'page': self.pages, 'pass': self.layout_pass,
+                                   'estimated_pages': self.estimated_pages})
+            elif 'Repagination' in message:
+                self.layout_pass = record.args[0]
+                self.progress({'event': 'repaginate', 'pass': self.layout_pass, 'pages': self.pages})
+        except Exception:
+            pass  # Progress reporting must never break a render
+
+
+@contextlib.contextmanager
+def layout_progress(progress, estimated_pages=None):
+    """
+    Report every page WeasyPrint lays out to a progress callback.
+
+    Args:
+        progress (callable): Receives event dicts; None disables reporting
+        estimated_pages (int): Estimate included with each page event
+    """
+    if progress is None:
+        yield
+        return
+
+    logger = logging.getLogger('weasyprint.progress')
+    handler = _LayoutProgressHandler(progress, estimated_pages)
+    previous_level = logger.level
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    try:
+        yield
+    finally:
+        logger.removeHandler(handler)
+        logger.setLevel(previous_level)
+
+
+_FONT_CONFIG = None
+
+
+def get_font_configuration():
+    """
+    Return the process-wide WeasyPrint FontConfiguration.
 
-def create_complete_html_document(html_content, title, toc_html=None, custom_css=None, metadata=None, front_matter=None, theme='warm', logo_data_uri=None, logo_placements=None):
+    Created on first use and shared by every conversion in the process, so
+    long-lived callers (GUI, batch builds) only pay the fontconfig setup once.
+
+    Returns:
+        FontConfiguration: Shared font configuration
+    """
+    global _FONT_CONFIG
+    if _FONT_CONFIG is None:
+        _FONT_CONFIG = FontConfiguration()
+    return _FONT_CONFIG
+
+
+def warm_up(theme='warm'):
+    """
+    Prime WeasyPrint, fontconfig and the theme CSS by laying out a tiny document.
+
+    Long-running callers can call this once in the background so their first
+    real conversion doesn't pay the cold-start cost.
+
+    Args:
+        theme (str): Theme to preload
+    """
+    complete_html = create_complete_html_document('<p>Klasiko</p>', 'Klasiko', theme=theme)
+    HTML(string=complete_html).render(font_config=get_font_configuration())
+
+
+def create_complete_html_document(html_content, title, toc_html=None, custom_css=None, metadata=None, front_matter=None, theme='warm', logo_data_uri=None, logo_placements=None, stamped=False, linked_css=False):
     """
     Create a complete HTML document with CSS styling.
 
@@ -1847,33 +2141,36 @@ def create_complete_html_document(html_content, title, toc_html=None, custom_css
         theme (str): Visual theme - 'default', 'warm', 'rustic', or 'clean'
         logo_data_uri (str): Optional base64-encoded logo data URI
         logo_placements (list): List of dicts with 'position' and 'size' keys for each logo placement
+        stamped (bool): Leave the page background, header/footer logos and
+            watermark to a stamp from create_stamp_html(), applied after layout
+        linked_css (bool): Leave the theme, logo and custom CSS out of the
+            document; the caller passes document_stylesheet() to the renderer
 
     Returns:
         str: Complete HTML document
     """
-    # Get theme CSS
-    theme_css = get_theme_css(theme)
+    css_style = ""
+    if not linked_css:
+        # Get theme CSS
+        theme_css = get_theme_css(theme)
 
-    # Generate logo CSS for multiple placements
-    logo_css = ""
-    if logo_data_uri and logo_placements:
-        for placement in logo_placements:
-            logo_css += generate_logo_css(
-                logo_data_uri,
-                placement.get('position', 'header'),
-                placement.get('size', 'medium')
-            )
+        # Generate logo CSS for multiple placements
+        logo_css = generate_placements_css(logo_data_uri, logo_placements)
 
-    css_style = f"""
+        css_style = f"""
     <style>
 {theme_css}
 {logo_css}
     </style>
     """
 
-    # Add custom CSS if provided
-    if custom_css:
-        css_style += f"\n    <style>\n{custom_css}\n    </style>"
+        # Add custom CSS if provided
+        if custom_css:
+            css_style += f"\n    <style>\n{custom_css}\n    </style>"
+
+    # The stamp paints the background and logos under each laid-out page
+    if stamped:
+        css_style += f"\n    <style>\n{stamped_body_css(logo_placements)}\n    </style>"
     
     # Build metadata tags
     meta_tags = ""
@@ -1925,7 +2222,7 @@ def create_complete_html_document(html_content, title, toc_html=None, custom_css
 
     # Add watermark div if requested
     watermark_html = ""
-    if logo_data_uri and logo_placements:
+    if logo_data_uri and logo_placements and not stamped:
         has_watermark = any(p.get('position') in ['watermark', 'all'] for p in logo_placements)
         if has_watermark:
             watermark_html = f'    <div class="watermark"><img src="{logo_data_uri}" alt=""></div>\n'
@@ -1942,254 +2239,4542 @@ def create_complete_html_document(html_content, title, toc_html=None, custom_css
 {watermark_html}    <div class="title-page">
         {title_page_content}
     </div>
-{toc_section}    {html_content}
+{toc_section}    {CONTENT_MARKER}{html_content}
 </body>
 </html>"""
 
     return complete_html
 
 
-def convert_md_to_pdf(input_file, output_file, enable_toc=False, custom_css=None, metadata=None, theme='warm', logo_data_uri=None, logo_placements=None):
+def document_stylesheet(theme='warm', logo_data_uri=None, logo_placements=None, custom_css=None, base_url=None):
     """
-    Convert a Markdown file to a styled PDF document.
+    Compile the theme, logo and custom CSS into one reusable stylesheet.
+
+    For documents built with create_complete_html_document(linked_css=True):
+    WeasyPrint parses the CSS once here instead of once per document.
 
     Args:
-        input_file (str): Path to input Markdown file
-        output_file (str): Path to output PDF file
-        enable_toc (bool): Whether to generate table of contents
-        custom_css (str): Path to custom CSS file or CSS string
-        metadata (dict): PDF metadata (author, subject, keywords)
-        theme (str): Visual theme - 'default', 'warm', 'rustic', or 'clean'
+        theme (str): Visual theme
         logo_data_uri (str): Optional base64-encoded logo data URI
-        logo_placements (list): List of dicts with 'position' and 'size' keys for each logo placement
+        logo_placements (list): List of dicts with 'position' and 'size' keys
+        custom_css (str): Optional custom CSS, applied after the theme
+        base_url (str): Base for relative URLs in the CSS
 
     Returns:
-        bool: True if successful, False otherwise
+        weasyprint.CSS: Compiled stylesheet
     """
-    try:
-        # Start timing
-        start_time = time.time()
+    css_text = '\n'.join(filter(None, (get_theme_css(theme), generate_placements_css(logo_data_uri, logo_placements),
+                                        custom_css)))
+    return CSS(string=css_text, base_url=base_url, font_config=get_font_configuration())
 
-        # Validate input file
-        if not os.path.exists(input_file):
-            raise FileNotFoundError(f"Input file not found: {input_file}")
 
-        # Check file size and warn if very large
-        file_size_mb = os.path.getsize(input_file) / (1024 * 1024)
-        if file_size_mb > 10:
-            print(f"Warning: Large file detected ({file_size_mb:.1f}MB). Conversion may take a while...")
+# Page margin boxes generate_logo_css() draws logos in, by placement
+LOGO_MARGIN_BOXES = {
+    'header': ('top-left',),
+    'footer': ('bottom-right',),
+    'both': ('top-left', 'bottom-right'),
+    'all': ('top-left', 'bottom-right'),
+}
+PAGE_MARGIN_BOXES = ('top-left', 'top-center', 'top-right', 'bottom-left', 'bottom-center', 'bottom-right')
+STAMPED_POSITIONS = ('header', 'footer', 'both', 'watermark', 'all')
 
-        # Generate output filename if not provided
-        if not output_file:
-            output_file = Path(input_file).with_suffix('.pdf')
 
-        print(f"\n{'='*60}")
-        print(f"📄 Converting: {Path(input_file).name}")
-        print(f"{'='*60}")
-        print(f"[1/5] Reading Markdown file...", end=" ", flush=True)
+def stamped_body_css(logo_placements):
+    """
+    CSS that leaves the page background and logo images to the stamp.
 
-        # Convert Markdown to HTML
-        step_start = time.time()
-        html_content, markdown_content, md_instance = convert_markdown_to_html(input_file, enable_toc)
-        print(f"✓ ({time.time() - step_start:.2f}s)")
+    The logo margin boxes keep their (blank) content, so the theme's
+    ornaments stay hidden where a logo goes, exactly as without stamping.
 
-        print(f"[2/5] Processing content...", end=" ", flush=True)
-        step_start = time.time()
+    Args:
+        logo_placements (list): List of dicts with 'position' and 'size' keys
 
-        # Extract title from document H1 or use filename
-        title = extract_title_from_markdown(markdown_content)
-        if not title:
-            title = Path(input_file).stem.replace('_', ' ').replace('-', ' ').title()
+    Returns:
+        str: CSS appended after the theme, logo and custom CSS
+    """
+    boxes = sorted({box for placement in logo_placements or []
+                    for box in LOGO_MARGIN_BOXES.get(placement.get('position'), ())})
+    margin_boxes = ''.join(f"\n            @{box} {{ background: none; }}" for box in boxes)
+    return f"""
+        @page {{
+            background: transparent;{margin_boxes}
+        }}
 
-        # Extract front matter (h2, h3, metadata) for title page
-        front_matter = extract_front_matter(markdown_content)
+        html, body {{
+            background: transparent;
+        }}
+        """
 
-        # Get TOC HTML if enabled
-        toc_html = None
-        if enable_toc and hasattr(md_instance, 'toc'):
-            toc_html = md_instance.toc
 
-        print(f"✓ ({time.time() - step_start:.2f}s)")
+def create_stamp_html(theme='warm', logo_data_uri=None, logo_placements=None, custom_css=None):
+    """
+    Create the two-page stamp for a stamped render: the page background,
+    header/footer logos and watermark of the first page and of every other page.
 
-        # Load custom CSS if provided
-        custom_css_content = None
-        if custom_css:
-            if os.path.exists(custom_css):
-                try:
-                    with open(custom_css, 'r', encoding='utf-8') as f:
-                        custom_css_content = f.read()
-                except Exception as e:
-                    print(f"Warning: Could not load custom CSS file: {e}")
-            else:
-                # Assume it's a CSS string
-                custom_css_content = custom_css
+    The stamp uses the same theme, logo and custom CSS as the document, so
+    each decoration lands exactly where WeasyPrint would have drawn it; only
+    text margin boxes (ornaments, page numbers) are left to the document.
 
-        print(f"[3/5] Building HTML ({theme} theme)...", end=" ", flush=True)
-        step_start = time.time()
+    Args:
+        theme (str): Visual theme
+        logo_data_uri (str): Base64 data URI of the logo
+        logo_placements (list): List of dicts with 'position' and 'size' keys
+        custom_css (str): Optional custom CSS content
 
-        # Create complete HTML document
-        complete_html = create_complete_html_document(
-            html_content,
-            title,
-            toc_html=toc_html,
-            custom_css=custom_css_content,
-            metadata=metadata,
-            front_matter=front_matter,
-            theme=theme,
-            logo_data_uri=logo_data_uri,
-            logo_placements=logo_placements or []
-        )
+    Returns:
+        str: Complete HTML document with two blank pages
+    """
+    boxes = {box for placement in logo_placements or []
+             for box in LOGO_MARGIN_BOXES.get(placement.get('position'), ())}
+    blank_boxes = ''.join(f"\n            @{box} {{ content: none; }}" for box in PAGE_MARGIN_BOXES if box not in boxes)
+    watermark_html = ''
+    if logo_data_uri and any(p.get('position') in ['watermark', 'all'] for p in logo_placements or []):
+        watermark_html = f'<div class="watermark"><img src="{logo_data_uri}" alt=""></div>'
+    return f"""<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <style>
+{get_theme_css(theme)}
+{generate_placements_css(logo_data_uri, logo_placements)}
+{custom_css or ''}
+        @page {{{blank_boxes}
+        }}
+    </style>
+</head>
+<body>
+{watermark_html}<div style="height: 1px"></div><div style="break-before: page"></div>
+</body>
+</html>"""
 
-        print(f"✓ ({time.time() - step_start:.2f}s)")
 
-        print(f"[4/5] Generating PDF...", end=" ", flush=True)
-        step_start = time.time()
+def load_custom_css(custom_css):
+    """
+    Resolve the --css argument to CSS text.
 
-        # Generate PDF with font configuration for Unicode support
-        font_config = FontConfiguration()
-        html_doc = HTML(string=complete_html)
-        html_doc.write_pdf(output_file, font_config=font_config)
+    Args:
+        custom_css (str): Path to a CSS file or an inline CSS string
 
-        print(f"✓ ({time.time() - step_start:.2f}s)")
+    Returns:
+        str or None: CSS content
+    """
+    if not custom_css:
+        return None
 
-        # Get file size and total time
-        output_size_mb = os.path.getsize(output_file) / (1024 * 1024)
-        total_time = time.time() - start_time
+    if os.path.exists(custom_css):
+        try:
+            with open(custom_css, 'r', encoding='utf-8') as f:
+                return f.read()
+        except Exception as e:
+            print(f"Warning: Could not load custom CSS file: {e}")
+            return None
 
-        print(f"[5/5] Finalizing...", end=" ", flush=True)
-        print(f"✓")
-        print(f"{'='*60}")
-        print(f"✅ SUCCESS!")
-        print(f"{'='*60}")
-        print(f"📄 Output: {Path(output_file).name}")
-        print(f"📏 Size: {output_size_mb:.2f} MB")
-        print(f"⏱️  Time: {total_time:.2f}s")
-        if logo_data_uri and logo_placements:
-            placements_str = ", ".join([f"{p['position']} ({p['size']})" for p in logo_placements])
-            print(f"🏷️  Logo: {placements_str}")
-        print(f"🎨 Theme: {theme}")
-        print(f"{'='*60}\n")
+    # Assume it's a CSS string
+    return custom_css
 
-        return True
 
-    except FileNotFoundError as e:
-        print(f"✗ File Error: {e}")
-        return False
-    except UnicodeDecodeError as e:
-        print(f"✗ Encoding Error: Could not read file. Please ensure it's properly encoded.")
-        print(f"   Details: {e}")
-        return False
-    except Exception as e:
-        print(f"✗ Error during conversion: {e}")
-        import traceback
-        traceback.print_exc()
-        return False
+_DOCUMENT_CACHE = {}
+_DOCUMENT_CACHE_SIZE = 8
+_INCREMENTAL_CONVERTERS = {}
 
 
-def main():
-    """Main function to handle command line arguments and execute conversion."""
-    parser = argparse.ArgumentParser(
-        description='Convert Markdown files to styled PDF documents with professional formatting',
-        formatter_class=argparse.RawDescriptionHelpFormatter,
-        epilog="""
-Examples:
-  %(prog)s document.md
-  %(prog)s input.md -o output.pdf
-  %(prog)s document.md --toc --author "John Doe"
-  %(prog)s document.md --theme rustic --toc
+def incremental_converter(input_file):
+    """
+    Get the IncrementalMarkdownConverter that follows a Markdown file's edits.
 
-Logo Branding [NEW v2.1]:
-  # Single position (old format - still works)
-  %(prog)s doc.md --logo logo.png --logo-position header --logo-size medium
+    Args:
+        input_file (str): Path to the Markdown file
 
-  # Multi-position with different sizes
-  %(prog)s doc.md --logo logo.png --logo-placement "title:large" --logo-placement "header:small"
+    Returns:
+        IncrementalMarkdownConverter: Converter holding the file's cached blocks
+    """
+    path = str(Path(input_file).resolve())
+    converter = _INCREMENTAL_CONVERTERS.pop(path, None) or IncrementalMarkdownConverter()
+    if len(_INCREMENTAL_CONVERTERS) >= _DOCUMENT_CACHE_SIZE:
+        _INCREMENTAL_CONVERTERS.pop(next(iter(_INCREMENTAL_CONVERTERS)))
+    _INCREMENTAL_CONVERTERS[path] = converter
+    return converter
 
-  # Professional report: Large cover logo + small header
-  %(prog)s report.md --logo brand.svg --logo-placement "title:large" --logo-placement "header:small" --theme warm
 
-  # Maximum branding: Title + header/footer + watermark
-  %(prog)s proposal.md --logo company.png --logo-placement "title:medium" --logo-placement "both:small" --logo-placement "watermark:medium"
+def parse_markdown_document(input_file, enable_toc=False):
+    """
+    Parse a Markdown file into the pieces needed to assemble its HTML document.
 
-Themes:
-  default - Clean white paper with neutral colors (original style)
-  warm    - Warm neutral tones with vintage typography (new default)
-  rustic  - Aged paper with coffee browns and ornamental elements
+    Results are cached by path, modification time, size and TOC setting, so
+    repeated renders of an unchanged file (previews, theme switching) skip parsing.
+    When the file changes, only its edited blocks are converted again.
 
-Features:
-  - Three visual themes for different aesthetics
-  - Multi-position logo branding with individual sizes [NEW v2.1]
-  - Footnote support with [^1] syntax
-  - Table of contents generation
-  - Unicode support for international characters
-  - Custom CSS styling
-  - PDF metadata (author, subject, keywords)
-  - Professional document formatting
-        """
-    )
+    Args:
+        input_file (str): Path to the Markdown file
+        enable_toc (bool): Whether to generate table of contents
 
-    parser.add_argument(
-        'input_file',
-        help='Path to the input Markdown file (.md)'
-    )
+    Returns:
+        dict: 'html', 'markdown', 'title', 'front_matter' and 'toc_html'
+    """
+    stat = os.stat(input_file)
+    key = (str(Path(input_file).resolve()), stat.st_mtime_ns, stat.st_size, enable_toc)
+    if key in _DOCUMENT_CACHE:
+        return _DOCUMENT_CACHE[key]
+
+    markdown_content = read_markdown_file(input_file)
+    html_content, md_instance = incremental_converter(input_file).convert(markdown_content, enable_toc)
+
+    title = extract_title_from_markdown(markdown_content)
+    if not title:
+        title = Path(input_file).stem.replace('_', ' ').replace('-', ' ').title()
+
+    document = {
+        'html': html_content,
+        'markdown': markdown_content,
+        'title': title,
+        'front_matter': extract_front_matter(markdown_content),
+        'toc_html': md_instance.toc if enable_toc and hasattr(md_instance, 'toc') else None,
+    }
 
-    parser.add_argument(
-        '-o', '--output',
-        dest='output_file',
-        help='Path to the output PDF file (default: same as input with .pdf extension)'
-    )
+    if len(_DOCUMENT_CACHE) >= _DOCUMENT_CACHE_SIZE:
+        _DOCUMENT_CACHE.pop(next(iter(_DOCUMENT_CACHE)))
+    _DOCUMENT_CACHE[key] = document
+    return document
 
-    parser.add_argument(
-        '--toc',
-        action='store_true',
-        help='Generate table of contents'
-    )
 
-    parser.add_argument(
-        '--css',
-        dest='custom_css',
-        help='Path to custom CSS file or inline CSS string'
-    )
+class _TopLevelBlockFinder(HTMLParser):
+    """Record the offsets where top-level HTML elements end."""
 
-    parser.add_argument(
-        '--theme',
-        choices=['default', 'warm', 'rustic', 'clean'],
-        default='warm',
-        help='Visual theme for PDF output (default: warm)'
-    )
+    VOID_ELEMENTS = {
+        'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+        'link', 'meta', 'source', 'track', 'wbr',
+    }
 
-    parser.add_argument(
-        '--author',
-        help='PDF author metadata'
-    )
+    def __init__(self, html_content):
+        super().__init__(convert_charrefs=False)
+        self.html_content = html_content
+        self.line_offsets = [0]
+        for line in html_content.splitlines(keepends=True):
+            self.line_offsets.append(self.line_offsets[-1] + len(line))
+        self.depth = 0
+        self.boundaries = []
+
+    def _tag_end(self):
+        line, column = self.getpos()
+        return self.html_content.find('>', self.line_offsets[line - 1] + column) + 1
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.VOID_ELEMENTS:
+            if self.depth == 0:
+                self.boundaries.append(self._tag_end())
+        else:
+            self.depth += 1
+
+    def handle_startendtag(self, tag, attrs):
+        if self.depth == 0:
+            self.boundaries.append(self._tag_end())
+
+    def handle_endtag(self, tag):
+        if tag in self.VOID_ELEMENTS:
+            return
+        self.depth = max(0, self.depth - 1)
+        if self.depth == 0:
+            self.boundaries.append(self._tag_end())
+
+
+def split_html_blocks(html_content):
+    """
+    Split converted Markdown HTML into its top-level blocks.
 
-    parser.add_argument(
-        '--subject',
-        help='PDF subject metadata'
-    )
+    Args:
+        html_content (str): HTML produced by convert_markdown_to_html()
 
-    parser.add_argument(
-        '--keywords',
-        help='PDF keywords metadata (comma-separated)'
-    )
+    Returns:
+        list: HTML fragments that concatenate back to the input
+    """
+    finder = _TopLevelBlockFinder(html_content)
+    finder.feed(html_content)
+    finder.close()
 
-    parser.add_argument(
-        '--logo',
-        dest='logo_path',
-        help='Path to company logo file (PNG, SVG, JPG/JPEG) for branding'
-    )
+    blocks = []
+    start = 0
+    for end in finder.boundaries:
+        if end > start:
+            blocks.append(html_content[start:end])
+            start = end
+    if start < len(html_content):
+        blocks.append(html_content[start:])
+    return blocks
 
-    parser.add_argument(
-        '--logo-placement',
-        dest='logo_placements',
-        action='append',
-        help='Logo placement in format "position:size" (e.g., "header:small"). Can be used multiple times for different placements.'
-    )
 
-    # Keep old arguments for backward compatibility
-    parser.add_argument(
-        '--logo-position',
-        dest='logo_position',
+class PreviewCancelled(Exception):
+    """Raised by render_preview() when its cancelled() callback returns True."""
+
+
+def render_preview(input_file, theme='warm', enable_toc=False, custom_css=None, logo_data_uri=None,
+                   logo_placements=None, pages=2, resolution=36, max_chars=6000, cancelled=None, font_config=None):
+    """
+    Render PNG thumbnails of the first pages of a document.
+
+    Only the opening blocks of the (cached) parsed Markdown are laid out, so a
+    preview costs a fraction of a full conversion. cancelled() is checked
+    before layout, before the PDF is written and before each page is
+    rasterized, so a superseded preview stops at the next step.
+
+    Args:
+        input_file (str): Path to the Markdown file
+        theme (str): Visual theme - 'default', 'warm', 'rustic', or 'clean'
+        enable_toc (bool): Whether to include the table of contents
+        custom_css (str): Path to custom CSS file or CSS string
+        logo_data_uri (str): Optional base64-encoded logo data URI
+        logo_placements (list): List of dicts with 'position' and 'size' keys
+        pages (int): Number of pages to render (title page plus body pages)
+        resolution (int): Thumbnail resolution in DPI
+        max_chars (int): Approximate amount of body HTML to lay out
+        cancelled (callable): Returns True once the preview is no longer wanted
+        font_config (FontConfiguration): Font configuration for a caller laying
+            out on its own thread (default: the process-wide one)
+
+    Returns:
+        list: PNG image bytes, one per page
+
+    Raises:
+        RuntimeError: If pypdfium2 is not installed
+        PreviewCancelled: If cancelled() returned True
+    """
+    def check_cancelled():
+        if cancelled and cancelled():
+            raise PreviewCancelled()
+
+    if not PDFIUM_AVAILABLE:
+        raise RuntimeError("Page previews require pypdfium2. Install with: pip install pypdfium2")
+
+    document = parse_markdown_document(input_file, enable_toc)
+
+    body = ''
+    for block in split_html_blocks(document['html']):
+        body += block
+        if len(body) >= max_chars:
+            break
+
+    complete_html = create_complete_html_document(
+        body,
+        document['title'],
+        toc_html=document['toc_html'],
+        custom_css=load_custom_css(custom_css),
+        front_matter=document['front_matter'],
+        theme=theme,
+        logo_data_uri=logo_data_uri,
+        logo_placements=logo_placements or []
+    )
+
+    check_cancelled()
+    rendered = HTML(string=complete_html, base_url=str(Path(input_file).resolve().parent)).render(
+        font_config=font_config or get_font_configuration()
+    )
+    check_cancelled()
+    pdf_bytes = rendered.copy(rendered.pages[:pages]).write_pdf()
+    images = []
+    for index in range(min(pages, len(rendered.pages))):
+        check_cancelled()
+        images += rasterize_pdf_pages(pdf_bytes, resolution, [index])
+    return images
+
+
+def rasterize_pdf_pages(pdf_bytes, resolution=96, page_indexes=None):
+    """
+    Rasterize PDF pages to PNG images.
+
+    WeasyPrint no longer writes PNGs itself, so rendering goes through pypdfium2.
+
+    Args:
+        pdf_bytes (bytes): PDF document
+        resolution (int): Output resolution in DPI
+        page_indexes (list): Zero-based pages to rasterize (default: all)
+
+    Returns:
+        list: PNG image bytes, one per page
+    """
+    pdf = pdfium.PdfDocument(pdf_bytes)
+    try:
+        if page_indexes is None:
+            page_indexes = range(len(pdf))
+
+        images = []
+        for index in page_indexes:
+            bitmap = pdf[index].render(scale=resolution / 72)
+            buffer = io.BytesIO()
+            bitmap.to_pil().save(buffer, format='PNG')
+            images.append(buffer.getvalue())
+        return images
+    finally:
+        pdf.close()
+
+
+DRAFT_CSS = """
+        .draft-image {
+            display: inline-block;
+            padding: 0.5em 1em;
+            border: 1px dashed #999;
+            color: #777;
+            font-size: 9pt;
+        }
+"""
+
+
+def parse_page_ranges(page_spec, page_count=None):
+    """
+    Parse a page selection such as "1-5,8,10-" into zero-based page indexes.
+
+    Args:
+        page_spec (str): Comma-separated 1-based pages and ranges; "10-" runs to the end
+        page_count (int): Number of pages in the document (None only validates the syntax)
+
+    Returns:
+        list: Sorted zero-based page indexes that exist in the document
+
+    Raises:
+        ValueError: If the selection is malformed
+    """
+    selected = set()
+    for part in page_spec.split(','):
+        part = part.strip()
+        match = re.fullmatch(r'(\d+)(?:\s*-\s*(\d*))?', part)
+        if not match or int(match.group(1)) < 1:
+            raise ValueError(f"Invalid page range: '{part}'. Use e.g. 1-5,8,10-")
+
+        start = int(match.group(1))
+        if match.group(2) is None:
+            end = start
+        elif match.group(2) == '':
+            end = page_count or start
+        else:
+            end = int(match.group(2))
+            if end < start:
+                raise ValueError(f"Invalid page range: '{part}' (end before start)")
+
+        if page_count is not None:
+            selected.update(range(start - 1, min(end, page_count)))
+
+    return sorted(selected)
+
+
+def draft_placeholder_images(html_content):
+    """
+    Replace <img> tags with lightweight text placeholders for draft output.
+
+    Args:
+        html_content (str): HTML content
+
+    Returns:
+        str: HTML with images replaced by labelled placeholders
+    """
+    def placeholder(match):
+        alt = re.search(r'\balt\s*=\s*"([^"]*)"', match.group(0))
+        label = alt.group(1) if alt and alt.group(1) else 'image'
+        return f'<span class="draft-image">[Image: {label}]</span>'
+
+    return re.sub(r'<img\b[^>]*>', placeholder, html_content, flags=re.IGNORECASE)
+
+
+OUTPUT_FORMATS = ['pdf', 'png', 'cover', 'txt']
+COVER_RESOLUTION = 48
+
+
+def extract_pdf_text(pdf_bytes, page_indexes=None):
+    """
+    Extract the text of PDF pages with pypdfium2, as pdftotext would.
+
+    Reads the written PDF rather than WeasyPrint's private box tree, so it
+    doesn't depend on WeasyPrint internals. Running headers and page numbers
+    are part of the page text.
+
+    Args:
+        pdf_bytes (bytes): PDF document
+        page_indexes (list): Zero-based pages to extract (default: all)
+
+    Returns:
+        list: Text of each page
+    """
+    pdf = pdfium.PdfDocument(pdf_bytes)
+    try:
+        if page_indexes is None:
+            page_indexes = range(len(pdf))
+
+        texts = []
+        for index in page_indexes:
+            textpage = pdf[index].get_textpage()
+            text = textpage.get_text_range().replace('\r\n', '\n').replace('\r', '\n')
+            textpage.close()
+            # Collapse runs of blank lines and trailing spaces
+            text = re.sub(r'[ \t]+\n', '\n', text)
+            texts.append(re.sub(r'\n{3,}', '\n\n', text).strip())
+        return texts
+    finally:
+        pdf.close()
+
+
+def format_output_path(output_file, output_format, page_number=None):
+    """
+    Derive the output path for a format from the main output path.
+
+    report.pdf -> report.pdf, report-page-001.png, report-cover.png, report.txt
+
+    Args:
+        output_file (str or Path): Main output path
+        output_format (str): One of OUTPUT_FORMATS
+        page_number (int): 1-based page number for per-page PNGs
+
+    Returns:
+        Path: Output path
+    """
+    output_file = Path(output_file)
+    if output_format == 'pdf':
+        return output_file
+    if output_format == 'png':
+        return output_file.with_name(f"{output_file.stem}-page-{page_number:03d}.png")
+    if output_format == 'cover':
+        return output_file.with_name(f"{output_file.stem}-cover.png")
+    return output_file.with_suffix('.txt')
+
+
+_STAMP_CACHE = {}
+
+
+def render_stamp_pdf(stamp_html, base_url=None):
+    """
+    Lay out a stamp from create_stamp_html() once, reusing it for every
+    document with the same theme, logo, custom CSS and base URL.
+
+    Args:
+        stamp_html (str): Stamp document
+        base_url (str): Base for relative URLs
+
+    Returns:
+        bytes: Two-page PDF (first page, other pages)
+    """
+    # Relative url() references in custom CSS resolve against base_url
+    key = hashlib.sha256(f"{base_url}\0{stamp_html}".encode('utf-8')).hexdigest()
+    if key not in _STAMP_CACHE:
+        if len(_STAMP_CACHE) >= _DOCUMENT_CACHE_SIZE:
+            _STAMP_CACHE.pop(next(iter(_STAMP_CACHE)))
+        document = HTML(string=stamp_html, base_url=base_url).render(font_config=get_font_configuration())
+        _STAMP_CACHE[key] = document.write_pdf()
+    return _STAMP_CACHE[key]
+
+
+def stamp_pdf_pages(pdf_bytes, stamp_pdf, stamp_indexes):
+    """
+    Underlay stamp pages beneath the pages of a PDF.
+
+    Each stamp page becomes one form XObject that every page it applies to
+    draws, so the decoration is stored and laid out once.
+
+    Args:
+        pdf_bytes (bytes): Laid-out document, rendered with stamped=True
+        stamp_pdf (bytes): Stamp from render_stamp_pdf()
+        stamp_indexes (list): Stamp page for each document page
+
+    Returns:
+        bytes: Stamped PDF
+    """
+    if not PIKEPDF_AVAILABLE:
+        raise RuntimeError("Stamping requires pikepdf. Install with: pip install pikepdf")
+    with pikepdf.open(io.BytesIO(pdf_bytes)) as pdf, pikepdf.open(io.BytesIO(stamp_pdf)) as stamp:
+        forms = [pdf.copy_foreign(page.as_form_xobject()) for page in stamp.pages]
+        for page, index in zip(pdf.pages, stamp_indexes):
+            page.add_underlay(forms[min(index, len(forms) - 1)])
+        output = io.BytesIO()
+        pdf.save(output)
+    return output.getvalue()
+
+
+def linearize_pdf(pdf_path):
+    """
+    Rewrite a PDF in place as a linearized ("fast web view") file.
+
+    The first page's objects and the hint tables move to the front, so a
+    viewer can show page one before the download finishes and fetch other
+    pages with byte-range requests. The result is checked with qpdf's
+    linearization check before it replaces the original.
+
+    Args:
+        pdf_path (str or Path): PDF written by write_pdf()
+
+    Returns:
+        float: Seconds spent linearizing and checking
+
+    Raises:
+        RuntimeError: If pikepdf is missing or the linearized file fails the check
+    """
+    if not PIKEPDF_AVAILABLE:
+        raise RuntimeError("Linearizing requires pikepdf. Install with: pip install pikepdf")
+    started = time.perf_counter()
+    pdf_path = Path(pdf_path)
+    linearized_path = pdf_path.with_name(pdf_path.name + '.linearized')
+    try:
+        with pikepdf.open(pdf_path) as pdf:
+            pdf.save(linearized_path, linearize=True)
+        report = io.StringIO()
+        with pikepdf.open(linearized_path) as pdf:
+            valid = pdf.is_linearized and pdf.check_linearization(report)
+        if not valid:
+            raise RuntimeError(f"Linearized PDF failed the check: {report.getvalue().strip() or 'not linearized'}")
+        os.replace(linearized_path, pdf_path)
+    finally:
+        if linearized_path.exists():
+            linearized_path.unlink()
+    return time.perf_counter() - started
+
+
+def write_output_formats(document, output_file, formats, resolution=96, full_fonts=False, stamp=None,
+                         page_numbers=None):
+    """
+    Write every requested output format from a single laid-out document.
+
+    The PDF is serialised once and shared by every format; txt is read back
+    from it too (see extract_pdf_text()).
+
+    Args:
+        document: weasyprint.Document returned by HTML.render()
+        output_file (str or Path): Main output path (other formats derive from it)
+        formats (list): Any of 'pdf', 'png', 'cover', 'txt'
+        resolution (int): DPI for per-page PNGs
+        full_fonts (bool): Embed whole fonts instead of subsets
+        stamp (tuple): Optional (stamp_pdf, stamp_indexes) for stamp_pdf_pages()
+        page_numbers (list): 1-based source page number of each page in the
+            document, used to name per-page PNGs (default: 1, 2, 3...)
+
+    Returns:
+        list: Paths written
+    """
+    if any(output_format in formats for output_format in ('png', 'cover', 'txt')) and not PDFIUM_AVAILABLE:
+        raise RuntimeError("PNG and text output require pypdfium2. Install with: pip install pypdfium2")
+
+    written = []
+    pdf_bytes = document.write_pdf(full_fonts=full_fonts)
+    if stamp:
+        pdf_bytes = stamp_pdf_pages(pdf_bytes, *stamp)
+
+    if 'pdf' in formats:
+        path = format_output_path(output_file, 'pdf')
+        with open(path, 'wb') as f:
+            f.write(pdf_bytes)
+        written.append(path)
+
+    if 'png' in formats:
+        images = rasterize_pdf_pages(pdf_bytes, resolution)
+        for page_number, image in zip(page_numbers or range(1, len(images) + 1), images):
+            path = format_output_path(output_file, 'png', page_number)
+            with open(path, 'wb') as f:
+                f.write(image)
+            written.append(path)
+    if 'cover' in formats:
+        path = format_output_path(output_file, 'cover')
+        with open(path, 'wb') as f:
+            f.write(rasterize_pdf_pages(pdf_bytes, COVER_RESOLUTION, page_indexes=[0])[0])
+        written.append(path)
+
+    if 'txt' in formats:
+        # Pages are separated by form feeds, like pdftotext
+        path = format_output_path(output_file, 'txt')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('\n\f'.join(extract_pdf_text(pdf_bytes)) + '\n')
+        written.append(path)
+
+    return written
+
+
+CONTENT_MARKER = '<!-- klasiko:content -->'
+SECTION_SPACER = '<div style="break-after: page">&nbsp;</div>\n'
+# CSS that needs every page of the document at once; sections can't be laid out apart
+WHOLE_DOCUMENT_CSS_PATTERN = re.compile(r'\bcounters?\(\s*pages\b|:nth\(', re.IGNORECASE)
+
+
+def split_document_sections(html_content):
+    """
+    Split body HTML into the sections the themes start on a new page.
+
+    A section starts at each top-level h2, except one straight after an h1 or
+    an hr (the themes don't break there either).
+
+    Args:
+        html_content (str): Body HTML from markdown_to_html()
+
+    Returns:
+        list: Section HTML strings that concatenate back to the input
+    """
+    sections = ['']
+    previous = ''
+    for block in split_html_blocks(html_content):
+        start = block.lstrip()
+        if start.startswith('<h2') and previous and not previous.startswith(('<h1', '<hr')):
+            sections.append('')
+        sections[-1] += block
+        if start:
+            previous = start
+    return sections
+
+
+class SectionLayoutCache:
+    """
+    Laid-out pages of a document's sections, reused while their inputs are unchanged.
+
+    The title page (with the table of contents) and every section from
+    split_document_sections() are laid out as separate documents. Each
+    fragment is keyed by its complete HTML, so its content, theme and custom
+    CSS, logo and metadata are all part of the key. The key also covers the
+    base URL, the font configuration and the fragment's first page number.
+    Unchanged fragments are reused. The pages are joined into one document,
+    so bookmarks and links between sections come out as in a single layout.
+
+    WeasyPrint pages only live in memory, so the cache pays off in
+    long-running processes: watch mode, the GUI or the Python API. Each
+    section starts on a new page, as the built-in themes already do. Page
+    numbers carry on across fragments. A stylesheet that uses counter(pages)
+    or :nth() page selectors needs the whole document, so it is laid out in
+    one piece (whole_document is set) and nothing is cached.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.fragments = {}
+        self.reused = 0
+        self.rendered = 0
+        self.whole_document = False
+
+    def render(self, complete_html, base_url=None):
+        """
+        Lay out a complete HTML document, reusing unchanged sections.
+
+        Args:
+            complete_html (str): Document from create_complete_html_document()
+            base_url (str): Base for relative URLs
+
+        Returns:
+            weasyprint.Document: All pages of the document
+        """
+        font_config = get_font_configuration()
+        head, _, body = complete_html.partition('<body>')
+        self.whole_document = bool(WHOLE_DOCUMENT_CSS_PATTERN.search(head))
+        if self.whole_document:
+            with self.lock:
+                self.fragments = {}
+                self.reused, self.rendered = 0, 1
+            return HTML(string=complete_html, base_url=base_url).render(font_config=font_config)
+
+        body, _, tail = body.rpartition('</body>')
+        front, _, content = body.partition(CONTENT_MARKER)
+        title_start = front.find('<div class="title-page">')
+        watermark = front[:title_start] if title_start > 0 else ''
+
+        bodies = [front] + [section for section in split_document_sections(content) if section.strip()]
+        with self.lock:
+            fragments = {}
+            documents = []
+            page_number = 1
+            self.reused = self.rendered = 0
+            for index, section in enumerate(bodies):
+                if index == 0:
+                    spacers = 0
+                    fragment_html = head + '<body>' + front + CONTENT_MARKER + '</body>' + tail
+                else:
+                    # Spacer pages absorb :first rules and keep :left/:right
+                    # parity; the page counter is set so the section starts at page_number
+                    spacers = 1 if page_number % 2 == 0 else 2
+                    counter_css = f"<style>@page :first {{ counter-reset: page {page_number - spacers}; }}</style>\n"
+                    fragment_html = (head.replace('</head>', counter_css + '</head>') + '<body>\n' + watermark
+                                     + SECTION_SPACER * spacers + section + '</body>' + tail)
+
+                key = hashlib.sha256(f"{base_url}\0{id(font_config)}\0{fragment_html}".encode('utf-8')).hexdigest()
+                fragment = self.fragments.get(key)
+                if fragment is None:
+                    document = HTML(string=fragment_html, base_url=base_url).render(font_config=font_config)
+                    fragment = (document, document.pages[spacers:])
+                    self.rendered += 1
+                else:
+                    self.reused += 1
+                fragments[key] = fragment
+                documents.append(fragment)
+                page_number += len(fragment[1])
+
+            # Only the latest version of the document stays cached
+            self.fragments = fragments
+
+        first_document = documents[0][0]
+        return first_document.copy([page for _, fragment_pages in documents for page in fragment_pages])
+
+
+_SECTION_CACHES = {}
+
+
+def section_layout_cache(input_file):
+    """
+    Get the SectionLayoutCache that follows a Markdown file's rebuilds.
+
+    Args:
+        input_file (str): Path to the Markdown file
+
+    Returns:
+        SectionLayoutCache: Cache holding the file's laid-out sections
+    """
+    path = str(Path(input_file).resolve())
+    cache = _SECTION_CACHES.pop(path, None) or SectionLayoutCache()
+    if len(_SECTION_CACHES) >= _DOCUMENT_CACHE_SIZE:
+        _SECTION_CACHES.pop(next(iter(_SECTION_CACHES)))
+    _SECTION_CACHES[path] = cache
+    return cache
+
+
+class PdfRenderer:
+    """
+    Turns a complete HTML document into the requested output files.
+
+    Renderers take the document create_complete_html_document() builds and
+    list the OUTPUT_FORMATS they can write in formats.
+    """
+
+    name = None
+    formats = ()
+
+    def render(self, complete_html, base_url, output_file, pages=None, formats=None, resolution=96, full_fonts=False,
+               theme=None, section_cache=None, stamp_html=None, stylesheets=None):
+        """
+        Lay out a complete HTML document once and write the requested outputs.
+
+        Args:
+            complete_html (str): Document from create_complete_html_document()
+            base_url (str): Base for relative URLs (the Markdown file's folder)
+            output_file (str or Path): Main output path
+            pages (str): Optional page selection (e.g. "1-5,8")
+            formats (list): Any of the renderer's formats (default: ['pdf'])
+            resolution (int): DPI for per-page PNG output
+            full_fonts (bool): Embed whole fonts instead of subsets
+            theme (str): Theme name, used to label metrics
+            section_cache (SectionLayoutCache): Lay out section by section, reusing
+                sections unchanged since the cache's last render
+            stamp_html (str): Stamp from create_stamp_html() to underlay on every
+                page, for a document built with stamped=True
+            stylesheets (list): Compiled weasyprint.CSS from document_stylesheet(),
+                for a document built with linked_css=True
+
+        Returns:
+            tuple: (paths_written, pages_written, total_pages)
+        """
+        raise NotImplementedError
+
+
+class WeasyPrintRenderer(PdfRenderer):
+    """Full-fidelity layout with WeasyPrint: theme CSS, fonts, images and logos."""
+
+    name = 'weasyprint'
+    formats = tuple(OUTPUT_FORMATS)
+
+    def render(self, complete_html, base_url, output_file, pages=None, formats=None, resolution=96, full_fonts=False,
+               theme=None, section_cache=None, stamp_html=None, stylesheets=None):
+        theme = theme or 'unknown'
+
+        # Generate PDF with font configuration for Unicode support
+        with METRICS.stage('layout', theme):
+            if section_cache:
+                document = section_cache.render(complete_html, base_url)
+            else:
+                document = HTML(string=complete_html, base_url=base_url).render(
+                    font_config=get_font_configuration(), stylesheets=stylesheets
+                )
+        total_pages = len(document.pages)
+
+        # Lay out once, then write only the requested pages
+        page_indexes = list(range(total_pages))
+        if pages:
+            page_indexes = parse_page_ranges(pages, total_pages)
+            if not page_indexes:
+                raise ValueError(f"Page selection '{pages}' is outside the document ({total_pages} pages)")
+            document = document.copy([document.pages[i] for i in page_indexes])
+
+        # The first page has its own stamp (no header logo); the rest share one
+        stamp = None
+        if stamp_html:
+            with METRICS.stage('stamp', theme):
+                stamp = (render_stamp_pdf(stamp_html, base_url), [min(index, 1) for index in page_indexes])
+
+        # Every format comes from the same layout
+        with METRICS.stage('write', theme):
+            written = write_output_formats(document, output_file, formats or ['pdf'], resolution, full_fonts=full_fonts,
+                                           stamp=stamp, page_numbers=[index + 1 for index in page_indexes])
+        METRICS.inc('klasiko_pages_total', len(document.pages), theme=theme)
+        METRICS.inc('klasiko_output_bytes_total', sum(os.path.getsize(path) for path in written), theme=theme)
+        return written, len(document.pages), total_pages
+
+
+# Draft renderer page geometry, in points: A4 with the themes' 3cm x 2.5cm margins
+DRAFT_PAGE_SIZE = (595.28, 841.89)
+DRAFT_MARGINS = (85.04, 70.87)
+DRAFT_TITLE_TOP = 283.46
+DRAFT_INDENT = 18
+
+# Standard 14 fonts need no embedding; glyph widths (1/1000 em) for ASCII 32-126
+DRAFT_FONTS = {'Helvetica': 'F1', 'Helvetica-Bold': 'F2', 'Courier': 'F3'}
+HELVETICA_WIDTHS = (
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+)
+HELVETICA_BOLD_WIDTHS = (
+    278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611,
+    975, 722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556,
+    333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,
+    611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584,
+)
+
+# Block style: (font, size, leading, space before, space after)
+DRAFT_STYLES = {
+    'body': ('Helvetica', 10, 14, 0, 6),
+    'strong': ('Helvetica-Bold', 10, 14, 0, 6),
+    'h1': ('Helvetica-Bold', 20, 26, 12, 10),
+    'h2': ('Helvetica-Bold', 16, 21, 12, 8),
+    'h3': ('Helvetica-Bold', 13, 17, 10, 6),
+    'h4': ('Helvetica-Bold', 11, 15, 8, 4),
+    'h5': ('Helvetica-Bold', 10, 14, 8, 4),
+    'h6': ('Helvetica-Bold', 10, 14, 8, 4),
+    'code': ('Courier', 8.5, 10.5, 2, 8),
+}
+
+
+class _DraftBlockParser(HTMLParser):
+    """
+    Flatten a complete HTML document into the blocks the draft renderer lays
+    out. Only the element types matter: style sheets, classes and images are
+    ignored, apart from the page breaks after the title page and TOC.
+    """
+
+    BLOCK_STYLES = {
+        'p': 'body', 'li': 'body', 'dd': 'body', 'caption': 'body', 'dt': 'strong', 'pre': 'code',
+        'h1': 'h1', 'h2': 'h2', 'h3': 'h3', 'h4': 'h4', 'h5': 'h5', 'h6': 'h6',
+    }
+    BLOCK_TAGS = set(BLOCK_STYLES) | {'div', 'blockquote', 'table', 'tr', 'ul', 'ol', 'dl', 'hr', 'br'}
+    VOID_ELEMENTS = _TopLevelBlockFinder.VOID_ELEMENTS
+    SKIPPED = {'head', 'style', 'script', 'title'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.blocks = []
+        self.info = {}
+        self.stack = []
+        self.lists = []
+        self.text = []
+        self.prefix = None
+        self.style = 'body'
+        self.row_cells = 0
+        self.row_header = False
+        self.skipped = 0
+
+    def skipping(self):
+        return self.skipped > 0
+
+    def indent(self):
+        depth = len(self.lists) + sum(1 for tag, _, _ in self.stack if tag in ('blockquote', 'dd'))
+        return depth * DRAFT_INDENT
+
+    def centred(self):
+        return any(classes and 'title-page' in classes for _, _, classes in self.stack)
+
+    def flush(self, style=None):
+        text = ''.join(self.text)
+        self.text = []
+        if style != 'code':
+            text = '\n'.join(' '.join(line.split()) for line in text.split('\n')).strip()
+        else:
+            text = text.strip('\n')
+        if text:
+            self.blocks.append((style or self.style, text, self.indent(), self.prefix, self.centred()))
+            self.prefix = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        classes = (attrs.get('class') or '').split()
+        if tag == 'meta' and attrs.get('name') in ('author', 'subject', 'keywords'):
+            self.info[attrs['name']] = attrs.get('content') or ''
+        skip = tag in self.SKIPPED or 'watermark' in classes or 'footnote-backref' in classes
+        if tag not in self.VOID_ELEMENTS:
+            self.stack.append((tag, skip, classes))
+            self.skipped += skip
+        if self.skipping() and tag != 'title':
+            return
+
+        if tag in self.BLOCK_TAGS:
+            self.flush(self.style)
+            self.style = 'h2' if 'toc-title' in classes else self.BLOCK_STYLES.get(tag, 'body')
+        if tag in ('ul', 'ol'):
+            self.lists.append([tag, 0])
+        elif tag == 'li' and self.lists:
+            self.lists[-1][1] += 1
+            kind, number = self.lists[-1]
+            in_toc = any('toc' in classes for _, _, classes in self.stack)
+            self.prefix = None if in_toc else f"{number}." if kind == 'ol' else '\u2022'
+        elif tag == 'tr':
+            self.row_cells = 0
+            self.row_header = False
+        elif tag in ('th', 'td'):
+            if self.row_cells:
+                self.text.append(' | ')
+            self.row_cells += 1
+            self.row_header = self.row_header or tag == 'th'
+        elif tag == 'hr':
+            self.blocks.append(('rule', '', self.indent(), None, False))
+        elif tag == 'br':
+            self.text.append('\n')
+        elif tag == 'img' and 'title-logo' not in classes:
+            alt = attrs.get('alt')
+            self.text.append(f"[image: {alt}]" if alt else '[image]')
+        elif tag == 'sup':
+            self.text.append('[')
+
+    def handle_endtag(self, tag):
+        if tag not in [open_tag for open_tag, _, _ in self.stack]:
+            return
+        skipping = self.skipping()
+        if not skipping:
+            # Flush while the element is still open, so it sets the indent and alignment
+            if tag == 'sup':
+                self.text.append(']')
+            elif tag == 'tr':
+                self.flush('strong' if self.row_header else 'body')
+            elif tag in self.BLOCK_TAGS:
+                self.flush(self.style)
+                self.style = 'body'
+        while self.stack:
+            open_tag, skip, classes = self.stack.pop()
+            self.skipped -= skip
+            if open_tag == tag:
+                break
+        if skipping:
+            return
+
+        if tag in ('ul', 'ol') and self.lists:
+            self.lists.pop()
+        # The theme breaks the page after the title page and the TOC
+        if tag == 'div' and ('title-page' in classes or 'toc' in classes):
+            if not any(open_tag == 'div' and 'toc' in open_classes for open_tag, _, open_classes in self.stack):
+                self.blocks.append(('page_break', '', 0, None, False))
+
+    def handle_data(self, data):
+        if self.stack and self.stack[-1][0] == 'title':
+            self.info['title'] = self.info.get('title', '') + data
+        elif not self.skipping():
+            # Source line breaks are spaces, except in code; <br> adds '\n' itself
+            self.text.append(data if self.style == 'code' else data.replace('\n', ' '))
+
+    def close(self):
+        super().close()
+        self.flush(self.style)
+
+
+@functools.lru_cache(maxsize=65536)
+def draft_text_width(text, font, size):
+    """
+    Width of a line of text in one of DRAFT_FONTS, in points.
+
+    Args:
+        text (str): Text to measure
+        font (str): Font name from DRAFT_FONTS
+        size (float): Font size in points
+
+    Returns:
+        float: Width in points
+    """
+    if font == 'Courier':
+        return len(text) * 0.6 * size
+    widths = HELVETICA_BOLD_WIDTHS if font == 'Helvetica-Bold' else HELVETICA_WIDTHS
+    return sum(widths[ord(char) - 32] if 32 <= ord(char) <= 126 else 556 for char in text) * size / 1000
+
+
+def wrap_draft_text(text, font, size, width):
+    """
+    Break text into lines that fit a width, at spaces (at any character in
+    code, and in words longer than a line).
+
+    Args:
+        text (str): Text, with '\\n' for forced line breaks
+        font (str): Font name from DRAFT_FONTS
+        size (float): Font size in points
+        width (float): Available width in points
+
+    Returns:
+        list: Lines of text
+    """
+    lines = []
+    if font == 'Courier':
+        columns = max(1, int(width / (0.6 * size)))
+        for line in text.expandtabs(4).split('\n'):
+            lines.extend(line[start:start + columns] for start in range(0, max(len(line), 1), columns))
+        return lines
+
+    space = draft_text_width(' ', font, size)
+    for paragraph in text.split('\n'):
+        line, line_width = [], 0
+        for word in paragraph.split(' '):
+            word_width = draft_text_width(word, font, size)
+            while word_width > width and len(word) > 1:
+                # Split an overlong word (a URL, say) at the last character that fits
+                if line:
+                    lines.append(' '.join(line))
+                    line, line_width = [], 0
+                cut = len(word) - 1
+                while cut > 1 and draft_text_width(word[:cut], font, size) > width:
+                    cut -= 1
+                lines.append(word[:cut])
+                word = word[cut:]
+                word_width = draft_text_width(word, font, size)
+            if line and line_width + space + word_width > width:
+                lines.append(' '.join(line))
+                line, line_width = [], 0
+            line_width += word_width + (space if line else 0)
+            line.append(word)
+        lines.append(' '.join(line))
+    return lines
+
+
+def layout_draft_pages(blocks):
+    """
+    Lay blocks out on fixed A4 pages, top to bottom, with no CSS.
+
+    Headings are kept with the line that follows them; everything else
+    breaks wherever the page ends.
+
+    Args:
+        blocks (list): (style, text, indent, prefix, centred) tuples from _DraftBlockParser
+
+    Returns:
+        list: Pages, each a list of ('text', font, size, x, y, text) and
+            ('rule', x1, y, x2) drawing operations
+    """
+    page_width, page_height = DRAFT_PAGE_SIZE
+    margin_y, margin_x = DRAFT_MARGINS
+    top, bottom = page_height - margin_y, margin_y
+    pages = [[]]
+    y = top
+
+    def new_page():
+        nonlocal y
+        if pages[-1]:
+            pages.append([])
+        y = top
+
+    for style, text, indent, prefix, centred in blocks:
+        if style == 'page_break':
+            new_page()
+            continue
+        if style == 'rule':
+            if y - 18 < bottom:
+                new_page()
+            pages[-1].append(('rule', margin_x + indent, y - 9, page_width - margin_x))
+            y -= 18
+            continue
+
+        font, size, leading, space_before, space_after = DRAFT_STYLES[style]
+        if centred and not pages[-1] and len(pages) == 1:
+            y = page_height - DRAFT_TITLE_TOP
+        x = margin_x + indent
+        text_x = x + (DRAFT_INDENT if prefix else 0)
+        lines = wrap_draft_text(text, font, size, page_width - margin_x - text_x)
+        if pages[-1] and y != top:
+            y -= space_before
+        keep = leading * (2 if style.startswith('h') else 1)
+        if y - keep < bottom:
+            new_page()
+        for index, line in enumerate(lines):
+            if y - leading < bottom:
+                new_page()
+            baseline = y - size
+            if index == 0 and prefix:
+                pages[-1].append(('text', font, size, x, baseline, prefix))
+            line_x = (page_width - draft_text_width(line, font, size)) / 2 if centred else text_x
+            pages[-1].append(('text', font, size, line_x, baseline, line))
+            y -= leading
+        y -= space_after
+    return pages
+
+
+def _pdf_string(text):
+    """Encode text as a PDF literal string in WinAnsiEncoding."""
+    try:
+        data = text.encode('cp1252')
+    except UnicodeEncodeError:
+        # Drop accents WinAnsi lacks (Phê Sữa -> Phê Sua); anything else becomes '?'
+        data = b''.join(
+            char.encode('cp1252', errors='ignore')
+            or unicodedata.normalize('NFKD', char).encode('cp1252', errors='ignore')[:1]
+            or b'?'
+            for char in text
+        )
+    data = data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)').replace(b'\r', b' ')
+    return b'(' + data + b')'
+
+
+def _pdf_text_string(text):
+    """Encode text as a UTF-16 PDF text string (document info)."""
+    return b'<' + ('\ufeff' + text).encode('utf-16-be').hex().upper().encode('ascii') + b'>'
+
+
+def write_draft_pdf(pages, info=None):
+    """
+    Write laid-out draft pages as a PDF using the standard 14 fonts.
+
+    Args:
+        pages (list): Pages from layout_draft_pages()
+        info (dict): Optional 'title', 'author', 'subject' and 'keywords'
+
+    Returns:
+        bytes: PDF document
+    """
+    page_width, page_height = DRAFT_PAGE_SIZE
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(None)
+    page_tree = add(None)
+    font_refs = b' '.join(
+        f'/{resource} {add(f"<< /Type /Font /Subtype /Type1 /BaseFont /{font} /Encoding /WinAnsiEncoding >>".encode())} 0 R'.encode()
+        for font, resource in DRAFT_FONTS.items()
+    )
+
+    page_refs = []
+    for number, operations in enumerate(pages, 1):
+        content = [b'BT']
+        current_font = None
+        for operation in operations:
+            if operation[0] != 'text':
+                continue
+            _, font, size, x, y, text = operation
+            if (font, size) != current_font:
+                content.append(f'/{DRAFT_FONTS[font]} {size:g} Tf'.encode())
+                current_font = (font, size)
+            content.append(f'1 0 0 1 {x:.2f} {y:.2f} Tm '.encode() + _pdf_string(text) + b' Tj')
+        # Page number, centred in the bottom margin
+        footer = str(number)
+        footer_x = (page_width - draft_text_width(footer, 'Helvetica', 8)) / 2
+        content.append(f'/F1 8 Tf 1 0 0 1 {footer_x:.2f} {DRAFT_MARGINS[0] / 2:.2f} Tm '.encode() + _pdf_string(footer) + b' Tj')
+        content.append(b'ET')
+        for operation in operations:
+            if operation[0] == 'rule':
+                _, x1, y, x2 = operation
+                content.append(f'0.5 w {x1:.2f} {y:.2f} m {x2:.2f} {y:.2f} l S'.encode())
+
+        stream = zlib.compress(b'\n'.join(content))
+        content_ref = add(b'<< /Length %d /Filter /FlateDecode >>\nstream\n' % len(stream) + stream + b'\nendstream')
+        page_refs.append(add(
+            f'<< /Type /Page /Parent {page_tree} 0 R /MediaBox [0 0 {page_width} {page_height}] '
+            f'/Contents {content_ref} 0 R /Resources << /Font << '.encode() + font_refs + b' >> >> >>'
+        ))
+
+    objects[catalog - 1] = f'<< /Type /Catalog /Pages {page_tree} 0 R >>'.encode()
+    kids = ' '.join(f'{ref} 0 R' for ref in page_refs)
+    objects[page_tree - 1] = f'<< /Type /Pages /Kids [{kids}] /Count {len(page_refs)} >>'.encode()
+    entries = [b'/Producer ' + _pdf_text_string('klasiko draft renderer')]
+    for key, value in (info or {}).items():
+        if value and key in ('title', 'author', 'subject', 'keywords'):
+            entries.append(f'/{key.title()} '.encode() + _pdf_text_string(value.strip()))
+    info_ref = add(b'<< ' + b' '.join(entries) + b' >>')
+
+    output = io.BytesIO()
+    output.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(output.tell())
+        output.write(b'%d 0 obj\n' % number + body + b'\nendobj\n')
+    xref_offset = output.tell()
+    output.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+    output.write(b''.join(b'%010d 00000 n \n' % offset for offset in offsets))
+    output.write(b'trailer\n<< /Size %d /Root %d 0 R /Info %d 0 R >>\n' % (len(objects) + 1, catalog, info_ref))
+    output.write(b'startxref\n%d\n%%%%EOF\n' % xref_offset)
+    return output.getvalue()
+
+
+class DraftRenderer(PdfRenderer):
+    """
+    A fast proof renderer: fixed A4 layout in Helvetica and Courier, written
+    straight to PDF without WeasyPrint.
+
+    There is no CSS cascade. Headings, paragraphs, lists, code, tables (one
+    line per row) and rules get fixed styles, images become "[image: alt]"
+    text, and logos, the watermark and any stamp are left out. Thousand-page documents
+    render in seconds; use WeasyPrint for final output.
+    """
+
+    name = 'draft'
+    formats = ('pdf', 'txt')
+
+    def render(self, complete_html, base_url, output_file, pages=None, formats=None, resolution=96, full_fonts=False,
+               theme=None, section_cache=None, stamp_html=None, stylesheets=None):
+        theme = theme or 'unknown'
+        formats = formats or ['pdf']
+        unsupported = [fmt for fmt in formats if fmt not in self.formats]
+        if unsupported:
+            raise ValueError(f"The draft renderer can't write {', '.join(unsupported)}; it writes {', '.join(self.formats)}")
+
+        with METRICS.stage('layout', theme):
+            parser = _DraftBlockParser()
+            parser.feed(complete_html)
+            parser.close()
+            laid_out = layout_draft_pages(parser.blocks)
+        total_pages = len(laid_out)
+
+        if pages:
+            page_indexes = parse_page_ranges(pages, total_pages)
+            if not page_indexes:
+                raise ValueError(f"Page selection '{pages}' is outside the document ({total_pages} pages)")
+            laid_out = [laid_out[i] for i in page_indexes]
+
+        written = []
+        with METRICS.stage('write', theme):
+            if 'pdf' in formats:
+                path = format_output_path(output_file, 'pdf')
+                with open(path, 'wb') as f:
+                    f.write(write_draft_pdf(laid_out, parser.info))
+                written.append(path)
+            if 'txt' in formats:
+                path = format_output_path(output_file, 'txt')
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write('\n\f'.join('\n'.join(operation[5] for operation in page if operation[0] == 'text')
+                                        for page in laid_out) + '\n')
+                written.append(path)
+        METRICS.inc('klasiko_pages_total', len(laid_out), theme=theme)
+        METRICS.inc('klasiko_output_bytes_total', sum(os.path.getsize(path) for path in written), theme=theme)
+        return written, len(laid_out), total_pages
+
+
+PDF_RENDERERS = {renderer.name: renderer for renderer in (WeasyPrintRenderer(), DraftRenderer())}
+DEFAULT_RENDERER = 'weasyprint'
+
+
+def get_pdf_renderer(name=None):
+    """
+    Look up a render backend.
+
+    Args:
+        name (str): Renderer name from PDF_RENDERERS (default: weasyprint)
+
+    Returns:
+        PdfRenderer: The renderer
+
+    Raises:
+        ValueError: If the renderer is unknown
+    """
+    name = name or DEFAULT_RENDERER
+    if name not in PDF_RENDERERS:
+        raise ValueError(f"Unknown renderer '{name}'. Choose from: {', '.join(PDF_RENDERERS)}")
+    return PDF_RENDERERS[name]
+
+
+def render_html_to_outputs(complete_html, base_url, output_file, pages=None, formats=None, resolution=96, full_fonts=False,
+                           theme=None, section_cache=None, renderer=None, stamp_html=None, stylesheets=None):
+    """
+    Lay out a complete HTML document once and write the requested outputs.
+
+    Args:
+        complete_html (str): Document from create_complete_html_document()
+        base_url (str): Base for relative URLs (the Markdown file's folder)
+        output_file (str or Path): Main output path
+        pages (str): Optional page selection (e.g. "1-5,8")
+        formats (list): Any of OUTPUT_FORMATS (default: ['pdf'])
+        resolution (int): DPI for per-page PNG output
+        full_fonts (bool): Embed whole fonts instead of subsets
+        theme (str): Theme name, used to label metrics
+        section_cache (SectionLayoutCache): Lay out section by section, reusing
+            sections unchanged since the cache's last render
+        renderer (str): Renderer from PDF_RENDERERS (default: weasyprint)
+        stamp_html (str): Stamp from create_stamp_html() to underlay on every page
+        stylesheets (list): Compiled weasyprint.CSS from document_stylesheet(),
+            for a document built with linked_css=True
+
+    Returns:
+        tuple: (paths_written, pages_written, total_pages)
+    """
+    return get_pdf_renderer(renderer).render(complete_html, base_url, output_file, pages, formats, resolution,
+                                             full_fonts, theme, section_cache, stamp_html, stylesheets)
+
+
+def convert_md_to_pdf(input_file, output_file, enable_toc=False, custom_css=None, metadata=None, theme='warm', logo_data_uri=None, logo_placements=None, pages=None, draft=False, formats=None, resolution=96, progress=None, incremental=False, section_cache=False, fast_parse=False, parser_backend=None, renderer=None, stamp=False, linearize=False):
+    """
+    Convert a Markdown file to a styled PDF document.
+
+    Args:
+        input_file (str): Path to input Markdown file
+        output_file (str): Path to output PDF file
+        enable_toc (bool): Whether to generate table of contents
+        custom_css (str): Path to custom CSS file or CSS string
+        metadata (dict): PDF metadata (author, subject, keywords)
+        theme (str): Visual theme - 'default', 'warm', 'rustic', or 'clean'
+        logo_data_uri (str): Optional base64-encoded logo data URI
+        logo_placements (list): List of dicts with 'position' and 'size' keys for each logo placement
+        pages (str): Optional page selection (e.g. "1-5,8") - only these pages are written
+        draft (bool): Quick proof - image placeholders, no logos, no font subsetting
+        formats (list): Outputs to write from the one layout pass - any of
+            'pdf', 'png' (every page), 'cover' (first-page thumbnail), 'txt' (default: ['pdf'])
+        resolution (int): DPI for per-page PNG output
+        progress (callable): Optional callback receiving event dicts - 'start',
+            'stage_start'/'stage_end' for each step, 'page' for every laid-out
+            page, and a final 'result'
+        incremental (bool): Only reconvert the Markdown blocks changed since the
+            last conversion of this file in this process (watch mode)
+        section_cache (bool): Lay out the document section by section, reusing
+            sections unchanged since the last conversion of this file in this process
+        fast_parse (bool): Parse with only the Markdown extensions the document
+            uses (ignored with incremental, which reparses only edited blocks)
+        parser_backend (str): Markdown parser from MARKDOWN_BACKENDS (default:
+            python-markdown; incremental always uses python-markdown)
+        renderer (str): Renderer from PDF_RENDERERS - 'weasyprint' (default) or
+            'draft' for a fast fixed-layout proof without the theme CSS
+        stamp (bool): Lay out the page background, header/footer logos and
+            watermark once and underlay them on every page after layout (needs pikepdf)
+        linearize (bool): Rewrite the PDF as a linearized ("fast web view") file,
+            so viewers can show page one before the download ends (needs pikepdf)
+
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    def emit(event, **fields):
+        if progress:
+            progress(dict(event=event, **fields))
+
+    def failed(error):
+        record_conversion(theme, error)
+        emit('result', success=False, error=str(error), error_type=type(error).__name__)
+
+    try:
+        # Start timing
+        start_time = time.time()
+
+        # Validate input file
+        if not os.path.exists(input_file):
+            raise FileNotFoundError(f"Input file not found: {input_file}")
+
+        # Check file size and warn if very large
+        file_size_mb = os.path.getsize(input_file) / (1024 * 1024)
+        if file_size_mb > 10:
+            print(f"Warning: Large file detected ({file_size_mb:.1f}MB). Conversion may take a while...")
+
+        # Generate output filename if not provided
+        if not output_file:
+            output_file = Path(input_file).with_suffix('.pdf')
+
+        print(f"\n{'='*60}")
+        print(f"📄 Converting: {Path(input_file).name}")
+        print(f"{'='*60}")
+        emit('start', input=str(input_file), output=str(output_file), theme=theme)
+        emit('stage_start', stage='read', step=1, steps=5)
+        print(f"[1/5] Reading Markdown file...", end=" ", flush=True)
+
+        # Convert Markdown to HTML
+        step_start = time.time()
+        with METRICS.stage('parse', theme):
+            if incremental:
+                markdown_content = read_markdown_file(input_file)
+                converter = incremental_converter(input_file)
+                html_content, md_instance = converter.convert(markdown_content, enable_toc)
+            else:
+                html_content, markdown_content, md_instance = convert_markdown_to_html(input_file, enable_toc, fast_parse, parser_backend)
+        METRICS.inc('klasiko_input_bytes_total', os.path.getsize(input_file), theme=theme)
+        large_code = downgraded_code_blocks(html_content)
+        print(f"✓ ({time.time() - step_start:.2f}s)")
+        emit('stage_end', stage='read', step=1, seconds=round(time.time() - step_start, 3))
+
+        emit('stage_start', stage='process', step=2, steps=5)
+        print(f"[2/5] Processing content...", end=" ", flush=True)
+        step_start = assemble_start = time.time()
+
+        # Extract title from document H1 or use filename
+        title = extract_title_from_markdown(markdown_content)
+        if not title:
+            title = Path(input_file).stem.replace('_', ' ').replace('-', ' ').title()
+
+        # Extract front matter (h2, h3, metadata) for title page
+        front_matter = extract_front_matter(markdown_content)
+
+        # Get TOC HTML if enabled
+        toc_html = None
+        if enable_toc and hasattr(md_instance, 'toc'):
+            toc_html = md_instance.toc
+
+        print(f"✓ ({time.time() - step_start:.2f}s)")
+        emit('stage_end', stage='process', step=2, seconds=round(time.time() - step_start, 3))
+
+        # Load custom CSS if provided
+        custom_css_content = load_custom_css(custom_css)
+
+        # Draft proofs skip image decoding and logo margin boxes/watermarks
+        if draft:
+            html_content = draft_placeholder_images(html_content)
+            custom_css_content = DRAFT_CSS + (custom_css_content or '')
+            logo_data_uri = None
+
+        emit('stage_start', stage='build', step=3, steps=5)
+        print(f"[3/5] Building HTML ({theme} theme)...", end=" ", flush=True)
+        step_start = time.time()
+
+        # Page decorations drawn once and stamped after layout, instead of on every page
+        stamp_html = None
+        if stamp and logo_data_uri and (renderer or DEFAULT_RENDERER) == DEFAULT_RENDERER and \
+                any(p.get('position') in STAMPED_POSITIONS for p in logo_placements or []):
+            stamp_html = create_stamp_html(theme, logo_data_uri, logo_placements, custom_css_content)
+
+        # Create complete HTML document
+        complete_html = create_complete_html_document(
+            html_content,
+            title,
+            toc_html=toc_html,
+            custom_css=custom_css_content,
+            metadata=metadata,
+            front_matter=front_matter,
+            theme=theme,
+            logo_data_uri=logo_data_uri,
+            logo_placements=logo_placements or [],
+            stamped=stamp_html is not None
+        )
+        METRICS.observe('klasiko_stage_seconds', time.time() - assemble_start, stage='assemble', theme=theme)
+
+        print(f"✓ ({time.time() - step_start:.2f}s)")
+        emit('stage_end', stage='build', step=3, seconds=round(time.time() - step_start, 3))
+
+        formats = formats or ['pdf']
+        estimated_pages = estimate_page_count(html_content, bool(toc_html))
+        emit('stage_start', stage='render', step=4, steps=5, estimated_pages=estimated_pages)
+        if formats == ['pdf']:
+            print(f"[4/5] Generating PDF...", end=" ", flush=True)
+        else:
+            print(f"[4/5] Generating {', '.join(formats)}...", end=" ", flush=True)
+        step_start = time.time()
+
+        # Resolve relative image references against the Markdown file's folder
+        sections = section_layout_cache(input_file) if section_cache else None
+        with layout_progress(progress, estimated_pages):
+            written, written_pages, total_pages = render_html_to_outputs(
+                complete_html,
+                str(Path(input_file).resolve().parent),
+                output_file,
+                pages=pages,
+                formats=formats,
+                resolution=resolution,
+                full_fonts=draft,
+                theme=theme,
+                section_cache=sections,
+                renderer=renderer,
+                stamp_html=stamp_html
+            )
+
+        # Post-process the written PDF for byte-range (page at a time) viewing
+        linearize_seconds = None
+        if linearize and 'pdf' in formats:
+            with METRICS.stage('linearize', theme):
+                linearize_seconds = linearize_pdf(format_output_path(output_file, 'pdf'))
+
+        print(f"✓ ({time.time() - step_start:.2f}s)")
+        emit('stage_end', stage='render', step=4, seconds=round(time.time() - step_start, 3), pages=total_pages)
+
+        # Get file size and total time
+        output_size_mb = sum(os.path.getsize(path) for path in written) / (1024 * 1024)
+        total_time = time.time() - start_time
+
+        emit('stage_start', stage='finalize', step=5, steps=5)
+        print(f"[5/5] Finalizing...", end=" ", flush=True)
+        print(f"✓")
+        emit('stage_end', stage='finalize', step=5, seconds=0.0)
+        print(f"{'='*60}")
+        print(f"✅ SUCCESS!")
+        print(f"{'='*60}")
+        if len(written) == 1:
+            print(f"📄 Output: {written[0].name}")
+        else:
+            print(f"📄 Output: {len(written)} files ({', '.join(formats)}), e.g. {written[0].name}")
+        print(f"📏 Size: {output_size_mb:.2f} MB")
+        if pages:
+            print(f"📑 Pages: {pages} ({written_pages} of {total_pages})")
+        if draft:
+            print(f"📝 Draft: images as placeholders, no logos, full fonts")
+        if renderer and renderer != DEFAULT_RENDERER:
+            print(f"🖨️  Renderer: {renderer} (fixed layout, no theme CSS)")
+        if stamp_html:
+            print(f"🖋️  Stamp: background, logos and watermark drawn once, underlaid on {written_pages} pages")
+        if linearize_seconds is not None:
+            print(f"🌐 Linearized: fast web view, check passed (+{linearize_seconds:.2f}s)")
+        if incremental:
+            print(f"♻️  Blocks: {converter.reused} reused, {converter.converted} converted")
+        if sections:
+            if sections.whole_document:
+                print(f"🧩 Sections: laid out whole (the CSS uses counter(pages) or :nth() pages)")
+            else:
+                print(f"🧩 Sections: {sections.reused} reused, {sections.rendered} laid out")
+        if large_code:
+            blocks = ', '.join(f"{lines} lines {language or 'text'}" for lines, language in large_code)
+            print(f"🧱 Code: {len(large_code)} large block(s) not syntax highlighted ({blocks})")
+        print(f"⏱️  Time: {total_time:.2f}s")
+        if logo_data_uri and logo_placements:
+            placements_str = ", ".join([f"{p['position']} ({p['size']})" for p in logo_placements])
+            print(f"🏷️  Logo: {placements_str}")
+        print(f"🎨 Theme: {theme}")
+        print(f"{'='*60}\n")
+
+        record_conversion(theme)
+        emit('result', success=True, outputs=[str(path) for path in written], pages=written_pages,
+             total_pages=total_pages, bytes=sum(os.path.getsize(path) for path in written),
+             seconds=round(total_time, 3))
+        return True
+
+    except FileNotFoundError as e:
+        failed(e)
+        print(f"✗ File Error: {e}")
+        return False
+    except UnicodeDecodeError as e:
+        failed(e)
+        print(f"✗ Encoding Error: Could not read file. Please ensure it's properly encoded.")
+        print(f"   Details: {e}")
+        return False
+    except ValueError as e:
+        failed(e)
+        print(f"✗ Error: {e}")
+        return False
+    except Exception as e:
+        failed(e)
+        print(f"✗ Error during conversion: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def watch_and_convert(input_file, output_file, interval=0.5, **options):
+    """
+    Convert a Markdown file, then convert it again every time it is saved.
+
+    Each conversion after the first only turns the edited blocks into HTML
+    again. Runs until interrupted with Ctrl+C.
+
+    Args:
+        input_file (str): Path to input Markdown file
+        output_file (str): Path to output PDF file
+        interval (float): Seconds between checks for changes
+        **options: Other arguments for convert_md_to_pdf()
+
+    Returns:
+        int: Exit status
+    """
+    convert_md_to_pdf(input_file, output_file, incremental=True, **options)
+    last_modified = os.stat(input_file).st_mtime_ns
+    print(f"👀 Watching {Path(input_file).name} for changes (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(interval)
+            try:
+                modified = os.stat(input_file).st_mtime_ns
+            except FileNotFoundError:
+                continue  # Editors that save by replacing the file
+            if modified != last_modified:
+                last_modified = modified
+                convert_md_to_pdf(input_file, output_file, incremental=True, **options)
+    except KeyboardInterrupt:
+        print("\n👋 Stopped watching")
+    return 0
+
+
+VARIANT_AXES = ('theme', 'logo', 'toc')
+
+
+def parse_variant_matrix(variant_spec):
+    """
+    Expand a variant matrix such as "theme=warm,rustic x logo=title:large|header:small".
+
+    Axes are separated by "x" (or "×"); each axis is name=value,value... with
+    values separated by "," or "|". Supported axes:
+      theme - theme names
+      logo  - placement sets; join several placements with "+" (title:large+header:small), or "none"
+      toc   - on / off
+
+    Args:
+        variant_spec (str): Variant matrix specification
+
+    Returns:
+        list: One dict per combination with 'theme', 'logo_placements', 'toc'
+              (None when that axis isn't varied) and a filename 'suffix'
+
+    Raises:
+        ValueError: If the specification is malformed
+    """
+    axes = []
+    for axis_spec in re.split(r'\s+[x×]\s+|×', variant_spec.strip()):
+        if '=' not in axis_spec:
+            raise ValueError(f"Invalid variant axis '{axis_spec}'. Use name=value,value")
+        name, values = axis_spec.split('=', 1)
+        name = name.strip().lower()
+        if name not in VARIANT_AXES:
+            raise ValueError(f"Unknown variant axis '{name}'. Use one of: {', '.join(VARIANT_AXES)}")
+        if name in [axis for axis, _ in axes]:
+            raise ValueError(f"Variant axis '{name}' is given twice")
+
+        options = []
+        for value in re.split(r'[,|]', values):
+            value = value.strip()
+            if not value:
+                continue
+            if name == 'theme':
+                if value not in available_themes():
+                    raise ValueError(f"Unknown theme '{value}' in variants")
+                options.append((value, value))
+            elif name == 'logo':
+                if value.lower() == 'none':
+                    options.append(([], 'nologo'))
+                else:
+                    placements = parse_logo_placements(value.split('+'))
+                    slug = '+'.join(f"{p['position']}-{p['size']}" for p in placements)
+                    options.append((placements, slug))
+            else:
+                if value.lower() not in ('on', 'off'):
+                    raise ValueError(f"toc variants must be 'on' or 'off', not '{value}'")
+                options.append((value.lower() == 'on', 'toc' if value.lower() == 'on' else 'notoc'))
+        if not options:
+            raise ValueError(f"Variant axis '{name}' has no values")
+        axes.append((name, options))
+
+    variants = [{'theme': None, 'logo_placements': None, 'toc': None, 'suffix': ''}]
+    for name, options in axes:
+        key = 'logo_placements' if name == 'logo' else name
+        variants = [
+            dict(variant, **{key: value, 'suffix': f"{variant['suffix']}-{slug}"})
+            for variant in variants
+            for value, slug in options
+        ]
+    return variants
+
+
+_VARIANT_CONTEXT = {}
+
+
+def _init_variant_worker(context):
+    """Receive the shared parsed document and logo once per worker process."""
+    _VARIANT_CONTEXT.clear()
+    _VARIANT_CONTEXT.update(context)
+
+
+def _render_variant(variant):
+    """Assemble and render one variant from the shared parsed document."""
+    start_time = time.time()
+    context = _VARIANT_CONTEXT
+    document = context['document']
+    log = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(log):
+            theme = variant['theme'] or context['theme']
+            placements = context['logo_placements'] if variant['logo_placements'] is None else variant['logo_placements']
+            enable_toc = context['enable_toc'] if variant['toc'] is None else variant['toc']
+
+            complete_html = create_complete_html_document(
+                document['html'],
+                document['title'],
+                toc_html=document['toc_html'] if enable_toc else None,
+                custom_css=context['custom_css'],
+                metadata=context['metadata'],
+                front_matter=document['front_matter'],
+                theme=theme,
+                logo_data_uri=context['logo_data_uri'],
+                logo_placements=placements
+            )
+            written, _, _ = render_html_to_outputs(
+                complete_html,
+                context['base_url'],
+                variant['output_file'],
+                pages=context['pages'],
+                formats=context['formats'],
+                resolution=context['resolution'],
+                full_fonts=context['draft'],
+                theme=theme
+            )
+        record_conversion(theme)
+        return {'output': variant['output_file'], 'success': True, 'written': [str(path) for path in written],
+                'seconds': time.time() - start_time, 'log': log.getvalue(), 'metrics': METRICS.drain()}
+    except Exception as e:
+        record_conversion(variant['theme'] or context['theme'], e)
+        return {'output': variant['output_file'], 'success': False, 'written': [],
+                'seconds': time.time() - start_time, 'log': log.getvalue() + f"{type(e).__name__}: {e}\n",
+                'metrics': METRICS.drain()}
+
+
+def convert_md_to_pdf_variants(input_file, output_file, variants, enable_toc=False, custom_css=None, metadata=None,
+                               theme='warm', logo_data_uri=None, logo_placements=None, pages=None, draft=False,
+                               formats=None, resolution=96, jobs=None, worker_limits=None):
+    """
+    Render several theme/branding variants of one Markdown document.
+
+    The Markdown is read and parsed, and the front matter extracted, once; each
+    variant then only assembles its HTML and lays it out, in parallel workers.
+    Outputs are named <stem>-<axis values>.pdf, e.g. report-warm-title-large.pdf.
+
+    Args:
+        input_file (str): Path to input Markdown file
+        output_file (str): Base output path (default: input with .pdf extension)
+        variants (list): Combinations from parse_variant_matrix()
+        jobs (int): Parallel worker processes (default: CPU count)
+        worker_limits (dict): Worker recycling limits from worker_limit_options()
+        Other arguments are as for convert_md_to_pdf() and apply to every
+        variant unless the variant overrides them.
+
+    Returns:
+        bool: True if every variant rendered successfully
+    """
+    start_time = time.time()
+    try:
+        if not os.path.exists(input_file):
+            raise FileNotFoundError(f"Input file not found: {input_file}")
+
+        output_file = Path(output_file or Path(input_file).with_suffix('.pdf'))
+
+        print(f"\n{'='*60}")
+        print(f"📄 Converting: {Path(input_file).name} ({len(variants)} variants)")
+        print(f"{'='*60}")
+        print(f"[1/2] Reading Markdown file...", end=" ", flush=True)
+        step_start = time.time()
+
+        # TOC ids are always generated, so one parse serves TOC and non-TOC variants
+        any_toc = enable_toc or any(variant['toc'] for variant in variants)
+        document = dict(parse_markdown_document(input_file, any_toc))
+        custom_css_content = load_custom_css(custom_css)
+        if draft:
+            document['html'] = draft_placeholder_images(document['html'])
+            custom_css_content = DRAFT_CSS + (custom_css_content or '')
+            logo_data_uri = None
+
+        print(f"✓ ({time.time() - step_start:.2f}s)")
+
+        context = {
+            'document': document,
+            'base_url': str(Path(input_file).resolve().parent),
+            'custom_css': custom_css_content,
+            'metadata': metadata,
+            'theme': theme,
+            'enable_toc': enable_toc,
+            'logo_data_uri': logo_data_uri,
+            'logo_placements': logo_placements or [],
+            'pages': pages,
+            'draft': draft,
+            'formats': formats or ['pdf'],
+            'resolution': resolution,
+        }
+        for variant in variants:
+            variant['output_file'] = str(output_file.with_name(f"{output_file.stem}{variant['suffix']}{output_file.suffix}"))
+
+        jobs = min(jobs or os.cpu_count() or 1, len(variants))
+        print(f"[2/2] Rendering {len(variants)} variants ({jobs} jobs)...")
+
+        results = []
+        if jobs > 1:
+            with RecyclingProcessPool(max_workers=jobs, initializer=_init_variant_worker, initargs=(context,),
+                                      **(worker_limits or {})) as executor:
+                futures = {executor.submit(_render_variant, variant): variant for variant in variants}
+                for future in as_completed(futures):
+                    try:
+                        results.append(future.result())
+                    except Exception as e:
+                        results.append({'output': futures[future]['output_file'], 'success': False, 'written': [],
+                                        'seconds': 0.0, 'log': f"Worker error: {e}\n", 'metrics': None})
+                    _print_variant_result(results[-1])
+        else:
+            _init_variant_worker(context)
+            for variant in variants:
+                results.append(_render_variant(variant))
+                _print_variant_result(results[-1])
+
+        for result in results:
+            METRICS.merge(result.pop('metrics'))
+        failed = [result for result in results if not result['success']]
+        print(f"{'='*60}")
+        if failed:
+            print(f"✗ {len(failed)} of {len(variants)} variants failed")
+        else:
+            print(f"✅ SUCCESS! {len(variants)} variants")
+        print(f"⏱️  Time: {time.time() - start_time:.2f}s")
+        print(f"{'='*60}\n")
+        return not failed
+
+    except FileNotFoundError as e:
+        print(f"✗ File Error: {e}")
+        return False
+    except Exception as e:
+        print(f"✗ Error during conversion: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def _print_variant_result(result):
+    """Print a one-line variant status, with the captured log for failures."""
+    name = Path(result['output']).name
+    if result['success']:
+        print(f"  ✓ {name} ({result['seconds']:.2f}s)")
+    else:
+        print(f"  ✗ {name} ({result['seconds']:.2f}s)")
+        for line in result['log'].strip().splitlines():
+            print(f"      {line}")
+
+
+def assemble_html_document(markdown_content, fallback_title='Document', enable_toc=False, custom_css=None,
+                           metadata=None, theme='warm', logo_data_uri=None, logo_placements=None, draft=False,
+                           markdown_converter=None):
+    """
+    Turn Markdown text into a complete styled HTML document.
+
+    The same steps as convert_md_to_pdf() (title, front matter, TOC, draft
+    placeholders, theme and logo CSS), without console output.
+
+    Args:
+        markdown_content (str): Raw Markdown content
+        fallback_title (str): Title used when the document has no H1
+        markdown_converter (IncrementalMarkdownConverter): Optional converter
+            that reuses the blocks of earlier versions of this document
+        Other arguments are as for convert_md_to_pdf().
+
+    Returns:
+        str: Complete HTML document
+    """
+    with METRICS.stage('parse', theme):
+        if markdown_converter:
+            html_content, md_instance = markdown_converter.convert(markdown_content, enable_toc)
+        else:
+            html_content, md_instance = markdown_to_html(markdown_content, enable_toc)
+    assemble_start = time.time()
+    custom_css_content = load_custom_css(custom_css)
+    if draft:
+        html_content = draft_placeholder_images(html_content)
+        custom_css_content = DRAFT_CSS + (custom_css_content or '')
+        logo_data_uri = None
+
+    complete_html = create_complete_html_document(
+        html_content,
+        extract_title_from_markdown(markdown_content) or fallback_title,
+        toc_html=md_instance.toc if enable_toc and hasattr(md_instance, 'toc') else None,
+        custom_css=custom_css_content,
+        metadata=metadata,
+        front_matter=extract_front_matter(markdown_content),
+        theme=theme,
+        logo_data_uri=logo_data_uri,
+        logo_placements=logo_placements or []
+    )
+    METRICS.observe('klasiko_stage_seconds', time.time() - assemble_start, stage='assemble', theme=theme)
+    return complete_html
+
+
+def render_markdown_to_pdf(markdown_content=None, input_file=None, output_file=None, base_url=None, pages=None,
+                           draft=False, section_cache=None, url_fetcher=None, **style):
+    """
+    Render Markdown text or a Markdown file to PDF without console output.
+
+    Args:
+        markdown_content (str): Raw Markdown content (or give input_file)
+        input_file (str): Path to a Markdown file
+        output_file (str): Write the PDF here; if omitted the PDF bytes are returned
+        base_url (str): Base for relative image URLs (default: the input file's folder)
+        pages (str): Optional page selection (e.g. "1-5,8")
+        draft (bool): Quick proof - image placeholders, no logos, no font subsetting
+        section_cache (SectionLayoutCache): Lay out section by section, reusing
+            sections unchanged since the cache's last render
+        url_fetcher: WeasyPrint URL fetcher for images, stylesheets and attachments,
+            e.g. data_url_fetcher() for untrusted input (not with section_cache)
+        **style: enable_toc, custom_css, metadata, theme, logo_data_uri, logo_placements,
+            markdown_converter (an IncrementalMarkdownConverter kept between calls)
+
+    Returns:
+        bytes or str: PDF bytes, or output_file when one was given
+    """
+    theme = style.get('theme', 'warm')
+    try:
+        fallback_title = 'Document'
+        if input_file:
+            markdown_content = read_markdown_file(input_file)
+            fallback_title = Path(input_file).stem.replace('_', ' ').replace('-', ' ').title()
+            base_url = base_url or str(Path(input_file).resolve().parent)
+        if markdown_content is None:
+            raise ValueError("Either markdown_content or input_file is required")
+        if url_fetcher and section_cache:
+            raise ValueError("url_fetcher can't be combined with section_cache")
+        METRICS.inc('klasiko_input_bytes_total', len(markdown_content.encode('utf-8')), theme=theme)
+
+        complete_html = assemble_html_document(markdown_content, fallback_title, draft=draft, **style)
+        with METRICS.stage('layout', theme):
+            if section_cache:
+                document = section_cache.render(complete_html, base_url)
+            else:
+                document = HTML(string=complete_html, base_url=base_url, url_fetcher=url_fetcher).render(
+                    font_config=get_font_configuration()
+                )
+        if pages:
+            page_indexes = parse_page_ranges(pages, len(document.pages))
+            if not page_indexes:
+                raise ValueError(f"Page selection '{pages}' is outside the document ({len(document.pages)} pages)")
+            document = document.copy([document.pages[i] for i in page_indexes])
+
+        with METRICS.stage('write', theme):
+            pdf_bytes = document.write_pdf(full_fonts=draft)
+            if output_file:
+                with open(output_file, 'wb') as f:
+                    f.write(pdf_bytes)
+    except Exception as e:
+        record_conversion(theme, e)
+        raise
+
+    METRICS.inc('klasiko_pages_total', len(document.pages), theme=theme)
+    METRICS.inc('klasiko_output_bytes_total', len(pdf_bytes), theme=theme)
+    record_conversion(theme)
+    return str(output_file) if output_file else pdf_bytes
+
+
+def data_url_fetcher():
+    """
+    A WeasyPrint URL fetcher that only loads data: URIs.
+
+    For rendering untrusted Markdown and CSS: file:, http(s): and every other
+    scheme are refused, so a document can't pull server files or internal
+    URLs into its PDF. WeasyPrint logs each refused resource and renders
+    without it.
+
+    Returns:
+        callable: URL fetcher for HTML(url_fetcher=...)
+    """
+    try:
+        from weasyprint.urls import URLFetcher
+    except ImportError:
+        # WeasyPrint before 68 takes a function wrapping default_url_fetcher
+        from weasyprint import default_url_fetcher
+
+        def fetch_data_url(url, *args, **kwargs):
+            if not url.lower().startswith('data:'):
+                raise ValueError(f"URI uses disallowed protocol: {url}")
+            return default_url_fetcher(url, *args, **kwargs)
+
+        return fetch_data_url
+    return URLFetcher(allowed_protocols=('data',))
+
+
+class ConverterBusy(RuntimeError):
+    """Raised when a converter's queue is full; callers should retry later."""
+
+
+def current_rss_mb():
+    """
+    Resident memory of the current process in MB.
+
+    Uses /proc on Linux and falls back to the peak RSS from getrusage()
+    elsewhere (a conservative stand-in for recycling decisions).
+
+    Returns:
+        float or None: Resident set size, or None if it can't be measured
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, AttributeError, IndexError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _render_worker_main(connection, warm_theme, initializer=None, initargs=(), memory_limit_mb=None, quiet=True):
+    """
+    Loop of a render worker process: receive (function, args, kwargs), reply with the result.
+
+    Replies are ('ok', result, rss_mb) or ('error', exception, traceback text,
+    rss_mb). The function may be given by its klasiko name. A None job shuts
+    the worker down. Unless quiet, jobs print to the worker's inherited stdout.
+    """
+    if memory_limit_mb and resource is not None:
+        try:
+            limit = int(memory_limit_mb * 1024 * 1024)
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ValueError, OSError):
+            pass  # Not supported here (e.g. macOS); recycling by RSS still applies
+
+    if warm_theme:
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                warm_up(warm_theme)
+        except Exception:
+            pass  # A failed warm-up only costs speed
+    if initializer:
+        initializer(*initargs)
+
+    while True:
+        try:
+            job = connection.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+
+        function, args, kwargs = job
+        if isinstance(function, str):
+            function = globals()[function]
+        try:
+            with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+                result = function(*args, **kwargs)
+            connection.send(('ok', result, current_rss_mb()))
+        except Exception as e:
+            import traceback
+            try:
+                connection.send(('error', e, traceback.format_exc(), current_rss_mb()))
+            except Exception:
+                # The exception itself couldn't be pickled
+                connection.send(('error', RuntimeError(f"{type(e).__name__}: {e}"), traceback.format_exc(), None))
+
+
+class RenderWorker:
+    """
+    A child process that runs render jobs one at a time.
+
+    Keeps WeasyPrint, fonts and theme CSS loaded between jobs; a job in progress
+    is cancelled by terminating the process. Tracks jobs done, resident memory
+    and whether the last job ran out of memory, so owners can recycle it.
+    """
+
+    def __init__(self, warm_theme='warm', initializer=None, initargs=(), memory_limit_mb=None, quiet=True):
+        """
+        Args:
+            warm_theme (str): Theme to preload (None to skip warm-up)
+            initializer (callable): Run once in the worker before its first job
+            initargs (tuple): Arguments for initializer
+            memory_limit_mb (float): Hard address-space limit for the worker (POSIX only)
+            quiet (bool): Discard what jobs print instead of passing it to stdout
+        """
+        context = multiprocessing.get_context('spawn')
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=_render_worker_main,
+            args=(child_connection, warm_theme, initializer, initargs, memory_limit_mb, quiet),
+            daemon=True
+        )
+        self.process.start()
+        child_connection.close()
+        self.jobs_done = 0
+        self.rss_mb = None
+        self.out_of_memory = False
+
+    def run(self, function, *args, **kwargs):
+        """
+        Run a picklable function (or the name of a klasiko function) in the worker.
+
+        Raises:
+            Exception: Whatever the function raised in the worker
+            RuntimeError: If the worker died or was terminated mid-job
+        """
+        try:
+            self.connection.send((function, args, kwargs))
+            reply = self.connection.recv()
+        except (EOFError, OSError) as e:
+            raise RuntimeError("Render worker exited unexpectedly") from e
+        self.jobs_done += 1
+        self.rss_mb = reply[-1]
+        if reply[0] == 'error':
+            self.out_of_memory = isinstance(reply[1], MemoryError)
+            raise reply[1]
+        return reply[1]
+
+    def recycle_reason(self, max_jobs=None, max_rss_mb=None):
+        """
+        Say whether this worker should be replaced before its next job.
+
+        Args:
+            max_jobs (int): Jobs after which the worker is retired
+            max_rss_mb (float): Resident memory above which the worker is retired
+
+        Returns:
+            str or None: 'crashed', 'memory_error', 'rss' or 'jobs', or None to keep it
+        """
+        if not self.alive():
+            return 'crashed'
+        if self.out_of_memory:
+            return 'memory_error'
+        if max_rss_mb and self.rss_mb and self.rss_mb > max_rss_mb:
+            return 'rss'
+        if max_jobs and self.jobs_done >= max_jobs:
+            return 'jobs'
+        return None
+
+    def alive(self):
+        return self.process.is_alive()
+
+    def terminate(self):
+        """Kill the worker immediately (cancels any job in progress)."""
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join(timeout=5)
+        self.connection.close()
+
+    def close(self):
+        """Ask the worker to exit after its current job."""
+        try:
+            self.connection.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.connection.close()
+
+
+def record_worker_recycle(reason):
+    """Count a worker replacement, by reason."""
+    METRICS.inc('klasiko_worker_recycles_total', reason=reason)
+
+
+class RecyclingProcessPool(Executor):
+    """
+    Process pool whose workers are replaced after a number of jobs or when
+    their memory grows too large.
+
+    WeasyPrint and fontconfig keep memory between renders, so long batch runs
+    retire workers to stay within a fixed memory envelope. Works like
+    ProcessPoolExecutor (submit() returns futures); a worker that dies only
+    fails its own job and is replaced.
+    """
+
+    def __init__(self, max_workers=None, initializer=None, initargs=(), warm_theme=None,
+                 max_jobs_per_worker=None, max_rss_mb=None, memory_limit_mb=None):
+        """
+        Args:
+            max_workers (int): Worker processes (default: CPU count)
+            initializer (callable): Run in each new worker before its first job
+            initargs (tuple): Arguments for initializer
+            warm_theme (str): Theme each new worker preloads (None to skip)
+            max_jobs_per_worker (int): Retire a worker after this many jobs
+            max_rss_mb (float): Retire a worker once its resident memory exceeds this
+            memory_limit_mb (float): Hard address-space limit per worker (POSIX only)
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.worker_options = {
+            'warm_theme': warm_theme, 'initializer': initializer, 'initargs': initargs,
+            'memory_limit_mb': memory_limit_mb, 'quiet': False,
+        }
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.max_rss_mb = max_rss_mb
+        self.jobs = queue.Queue()
+        self.recycles = {}
+        self.lock = threading.Lock()
+        self.shutting_down = False
+        self.threads = [
+            threading.Thread(target=self._manage_worker, name=f'klasiko-worker-{number}', daemon=True)
+            for number in range(self.max_workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, fn, /, *args, **kwargs):
+        if self.shutting_down:
+            raise RuntimeError("cannot schedule new jobs after shutdown")
+        future = Future()
+        self.jobs.put((future, fn, args, kwargs))
+        return future
+
+    def _retire(self, worker, reason):
+        with self.lock:
+            self.recycles[reason] = self.recycles.get(reason, 0) + 1
+        record_worker_recycle(reason)
+        if reason == 'crashed':
+            worker.terminate()
+        else:
+            worker.close()
+
+    def _manage_worker(self):
+        """Feed jobs to one worker process, replacing it when it should be recycled."""
+        worker = None
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            future, fn, args, kwargs = job
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                if worker is None:
+                    worker = RenderWorker(**self.worker_options)
+                result = worker.run(fn, *args, **kwargs)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+            reason = worker.recycle_reason(self.max_jobs_per_worker, self.max_rss_mb) if worker else None
+            if reason:
+                self._retire(worker, reason)
+                worker = None
+
+        if worker is not None:
+            worker.close()
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        self.shutting_down = True
+        if cancel_futures:
+            while True:
+                try:
+                    job = self.jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if job is not None:
+                    job[0].cancel()
+        for _ in self.threads:
+            self.jobs.put(None)
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+
+class AsyncConverter:
+    """
+    Asyncio front end to a pool of render worker processes.
+
+    Markdown parsing and rendering run in worker processes, so awaiting a
+    conversion never blocks the event loop. At most max_concurrency jobs run at
+    once and at most max_queue more may wait; beyond that convert() raises
+    ConverterBusy. Cancelling the awaiting task cancels the job, terminating
+    its worker if the render has already started.
+
+    Example:
+        async with AsyncConverter(max_concurrency=4) as converter:
+            pdf_bytes = await converter.convert(markdown="# Hello", theme='clean')
+            await converter.convert(input_file='report.md', output_file='report.pdf', enable_toc=True)
+    """
+
+    def __init__(self, max_concurrency=None, max_queue=16, warm_theme='warm', max_jobs_per_worker=None,
+                 max_rss_mb=None, memory_limit_mb=None):
+        """
+        Args:
+            max_concurrency (int): Worker processes / concurrent renders (default: CPU count)
+            max_queue (int): Conversions allowed to wait for a free worker
+            warm_theme (str): Theme each new worker preloads (None to skip warm-up)
+            max_jobs_per_worker (int): Replace a worker after this many conversions
+            max_rss_mb (float): Replace a worker once its resident memory exceeds this
+            memory_limit_mb (float): Hard address-space limit per worker (POSIX only)
+        """
+        self.max_concurrency = max_concurrency or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.warm_theme = warm_theme
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.max_rss_mb = max_rss_mb
+        self.memory_limit_mb = memory_limit_mb
+        self._idle_workers = []
+        self._threads = None
+        self._semaphore = None
+        self._drained = None
+        self._spawning = set()
+        self._disposals = set()
+        self._waiting = 0
+        self._running = 0
+        self._closed = False
+
+    @property
+    def pending(self):
+        """Number of conversions running or waiting."""
+        return self._running + self._waiting
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _dispose(self, worker, terminate=False):
+        """Close or terminate a worker on the thread pool; its join() would block the event loop."""
+        disposal = asyncio.get_running_loop().run_in_executor(
+            self._threads, worker.terminate if terminate else worker.close
+        )
+        self._disposals.add(disposal)
+        disposal.add_done_callback(self._disposals.discard)
+
+    def _dispose_spawned(self, spawn):
+        """Dispose of a worker whose conversion was cancelled while it started."""
+        if not spawn.cancelled() and spawn.exception() is None:
+            self._dispose(spawn.result())
+
+    def _finished(self):
+        if self.pending == 0:
+            self._drained.set()
+
+    async def convert(self, markdown=None, input_file=None, output_file=None, **options):
+        """
+        Convert Markdown text or a Markdown file to PDF.
+
+        Args:
+            markdown (str): Raw Markdown content (or give input_file)
+            input_file (str): Path to a Markdown file
+            output_file (str): Write the PDF here instead of returning bytes
+            **options: As for render_markdown_to_pdf() - enable_toc, custom_css,
+                metadata, theme, logo_data_uri, logo_placements, pages, draft, base_url
+
+        Returns:
+            bytes or str: PDF bytes, or output_file when one was given
+
+        Raises:
+            ConverterBusy: If max_concurrency jobs are running and max_queue are waiting
+        """
+        if self._closed:
+            raise RuntimeError("AsyncConverter is closed")
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._drained = asyncio.Event()
+            self._threads = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='klasiko-render')
+        if self.pending >= self.max_concurrency + self.max_queue:
+            raise ConverterBusy(f"{self.pending} conversions in progress or queued")
+
+        self._waiting += 1
+        self._drained.clear()
+        try:
+            await self._semaphore.acquire()
+        except BaseException:
+            self._waiting -= 1
+            self._finished()
+            raise
+        self._waiting -= 1
+        self._running += 1
+
+        loop = asyncio.get_running_loop()
+        worker = None
+        try:
+            worker = self._idle_workers.pop() if self._idle_workers else None
+            if worker is not None and not worker.alive():
+                self._dispose(worker, terminate=True)
+                worker = None
+            if worker is None:
+                new_worker = functools.partial(RenderWorker, self.warm_theme, memory_limit_mb=self.memory_limit_mb)
+                spawn = loop.run_in_executor(self._threads, new_worker)
+                self._spawning.add(spawn)
+                spawn.add_done_callback(self._spawning.discard)
+                try:
+                    worker = await asyncio.shield(spawn)
+                except asyncio.CancelledError:
+                    # The process still starts; close it once it has
+                    spawn.add_done_callback(self._dispose_spawned)
+                    raise
+
+            call = functools.partial(
+                worker.run, 'render_markdown_to_pdf',
+                markdown_content=markdown, input_file=input_file, output_file=output_file, **options
+            )
+            try:
+                result = await loop.run_in_executor(self._threads, call)
+            except asyncio.CancelledError:
+                # The render is already running in the worker: kill it
+                self._dispose(worker, terminate=True)
+                worker = None
+                raise
+            except Exception:
+                if not worker.alive():
+                    record_worker_recycle('crashed')
+                    self._dispose(worker, terminate=True)
+                    worker = None
+                raise
+            return result
+        finally:
+            self._running -= 1
+            if worker is not None:
+                reason = worker.recycle_reason(self.max_jobs_per_worker, self.max_rss_mb)
+                if reason:
+                    record_worker_recycle(reason)
+                if self._closed or reason:
+                    self._dispose(worker)
+                else:
+                    self._idle_workers.append(worker)
+            self._semaphore.release()
+            self._finished()
+
+    async def close(self):
+        """
+        Stop accepting conversions, wait for those running or queued to
+        finish, then shut down the workers.
+        """
+        self._closed = True
+        if self._semaphore is None:
+            return
+        await self._drained.wait()
+        if self._spawning:
+            # Workers of cancelled conversions that are still starting
+            await asyncio.wait(set(self._spawning))
+        workers, self._idle_workers = self._idle_workers, []
+        for worker in workers:
+            self._dispose(worker)
+        if self._disposals:
+            await asyncio.wait(set(self._disposals))
+        self._threads.shutdown(wait=False)
+
+
+MERGE_FIELD_PATTERN = re.compile(r'\{\{\s*([A-Za-z_][\w.-]*)\s*\}\}')
+MERGE_SENTINEL_PATTERN = re.compile(r'KLASIKOMERGE(\d+)X|klasikomerge(\d+)x')
+
+
+def read_merge_rows(data_file):
+    """
+    Stream data rows for mail merge from a CSV, JSON Lines or JSON file.
+
+    Args:
+        data_file (str or Path): .csv, .jsonl/.ndjson (one object per line) or .json (array of objects)
+
+    Yields:
+        tuple: (row_number, row_dict), row numbers starting at 1. A JSON Lines
+        line that isn't valid JSON yields a ValueError in place of the row, so
+        the rows after it are still read.
+    """
+    data_file = Path(data_file)
+    suffix = data_file.suffix.lower()
+
+    if suffix in ('.jsonl', '.ndjson'):
+        with open(data_file, 'r', encoding='utf-8') as f:
+            row_number = 0
+            for line in f:
+                if line.strip():
+                    row_number += 1
+                    try:
+                        row = json.loads(line)
+                    except ValueError as e:
+                        row = ValueError(f"invalid JSON: {e}")
+                    yield row_number, row
+    elif suffix == '.json':
+        with open(data_file, 'r', encoding='utf-8') as f:
+            yield from enumerate(json.load(f), 1)
+    else:
+        with open(data_file, 'r', encoding='utf-8-sig', newline='') as f:
+            yield from enumerate(csv.DictReader(f), 1)
+
+
+def compile_merge_template(template_file, output_pattern=None, enable_toc=False, custom_css=None, metadata=None,
+                           theme='warm', logo_data_uri=None, logo_placements=None):
+    """
+    Parse a Markdown mail-merge template once into reusable HTML segments.
+
+    {{ field }} placeholders are swapped for sentinels, the Markdown is converted
+    and the complete HTML document (title page, TOC) is assembled once; it is
+    then split at the sentinels so each row only joins strings. Field values
+    are inserted as escaped text, never as Markdown. The theme, logo and custom
+    CSS stay out of the document; each worker compiles them once.
+
+    Args:
+        template_file (str): Markdown template with {{ field }} placeholders
+        output_pattern (str): Output path with {{ field }} / {{ _row }} placeholders
+                              (default: <template>-{{ _row }}.pdf next to the template)
+        Other arguments are as for convert_md_to_pdf().
+
+    Returns:
+        dict: Compiled template ('segments', 'output_segments', 'fields', 'base_url', 'theme', 'stylesheet')
+    """
+    with open(template_file, 'r', encoding='utf-8') as f:
+        template = f.read()
+
+    fields = []
+
+    def to_sentinel(match):
+        if match.group(1) not in fields:
+            fields.append(match.group(1))
+        return f"KLASIKOMERGE{fields.index(match.group(1))}X"
+
+    sentinel_markdown = MERGE_FIELD_PATTERN.sub(to_sentinel, template)
+    html_content, md_instance = markdown_to_html(sentinel_markdown, enable_toc)
+
+    title = extract_title_from_markdown(sentinel_markdown)
+    if not title:
+        title = Path(template_file).stem.replace('_', ' ').replace('-', ' ').title()
+
+    complete_html = create_complete_html_document(
+        html_content,
+        title,
+        toc_html=md_instance.toc if enable_toc else None,
+        metadata=metadata,
+        front_matter=extract_front_matter(sentinel_markdown),
+        theme=theme,
+        logo_data_uri=logo_data_uri,
+        logo_placements=logo_placements or [],
+        linked_css=True
+    )
+
+    if not output_pattern:
+        output_pattern = str(Path(template_file).with_name(f"{Path(template_file).stem}-{{{{_row}}}}.pdf"))
+    output_segments = MERGE_FIELD_PATTERN.split(output_pattern)
+
+    return {
+        'segments': _split_merge_sentinels(complete_html),
+        'output_segments': output_segments,
+        'fields': fields,
+        'base_url': str(Path(template_file).resolve().parent),
+        'theme': theme,
+        'stylesheet': {'theme': theme, 'logo_data_uri': logo_data_uri, 'logo_placements': logo_placements or [],
+                       'custom_css': load_custom_css(custom_css)},
+    }
+
+
+def _split_merge_sentinels(text):
+    """Split text at merge sentinels into literals and (field_index, is_slug) pairs."""
+    segments = []
+    position = 0
+    for match in MERGE_SENTINEL_PATTERN.finditer(text):
+        segments.append(text[position:match.start()])
+        if match.group(1) is not None:
+            segments.append((int(match.group(1)), False))
+        else:
+            # Lower-cased copies come from heading ids generated by the toc extension
+            segments.append((int(match.group(2)), True))
+        position = match.end()
+    segments.append(text[position:])
+    return segments
+
+
+def fill_merge_template(compiled, row):
+    """
+    Substitute one data row into a compiled merge template.
+
+    Args:
+        compiled (dict): Result of compile_merge_template()
+        row (dict): Field values
+
+    Returns:
+        str: Complete HTML document for the row
+
+    Raises:
+        KeyError: If the row lacks a field used by the template
+    """
+    from markdown.extensions.toc import slugify
+
+    values = []
+    for name in compiled['fields']:
+        if name not in row or row[name] is None:
+            raise KeyError(f"missing field '{name}'")
+        values.append(str(row[name]))
+
+    parts = []
+    for segment in compiled['segments']:
+        if isinstance(segment, str):
+            parts.append(segment)
+        elif segment[1]:
+            parts.append(slugify(values[segment[0]], '-'))
+        else:
+            parts.append(html.escape(values[segment[0]]))
+    return ''.join(parts)
+
+
+def merge_output_path(compiled, row_number, row):
+    """Build a row's output path from the output pattern, with filesystem-safe values."""
+    parts = []
+    for index, segment in enumerate(compiled['output_segments']):
+        if index % 2 == 0:
+            parts.append(segment)
+        else:
+            value = row_number if segment == '_row' else row.get(segment)
+            if value is None:
+                raise KeyError(f"missing field '{segment}' for output name")
+            parts.append(re.sub(r'[^\w.-]+', '_', str(value)).strip('._') or '_')
+    return ''.join(parts)
+
+
+_MERGE_TEMPLATE = {}
+
+
+def _init_merge_worker(compiled):
+    """Receive the compiled template and compile its stylesheet once per worker process."""
+    _MERGE_TEMPLATE.clear()
+    _MERGE_TEMPLATE.update(compiled)
+    _MERGE_TEMPLATE['stylesheets'] = [document_stylesheet(base_url=compiled['base_url'], **compiled['stylesheet'])]
+
+
+def _render_merge_row(row_number, row, output_file):
+    """Render one mail-merge row; errors are returned, not raised."""
+    start_time = time.time()
+    try:
+        complete_html = fill_merge_template(_MERGE_TEMPLATE, row)
+        Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            written, pages, _ = render_html_to_outputs(
+                complete_html, _MERGE_TEMPLATE['base_url'], output_file, theme=_MERGE_TEMPLATE['theme'],
+                stylesheets=_MERGE_TEMPLATE['stylesheets']
+            )
+        record_conversion(_MERGE_TEMPLATE['theme'])
+        return {'row': row_number, 'output': output_file, 'status': 'ok', 'pages': pages,
+                'bytes': os.path.getsize(written[0]), 'seconds': round(time.time() - start_time, 3),
+                'metrics': METRICS.drain()}
+    except Exception as e:
+        record_conversion(_MERGE_TEMPLATE['theme'], e)
+        return {'row': row_number, 'output': output_file, 'status': 'failed',
+                'error': f"{type(e).__name__}: {e}", 'seconds': round(time.time() - start_time, 3),
+                'metrics': METRICS.drain()}
+
+
+def merge_md_to_pdf(template_file, data_file, output_pattern=None, jobs=None, report_file=None, enable_toc=False,
+                    custom_css=None, metadata=None, theme='warm', logo_data_uri=None, logo_placements=None,
+                    worker_limits=None):
+    """
+    Mail merge: render one PDF per data row from a Markdown template.
+
+    The template is parsed and styled once; rows are streamed from the data file
+    and rendered across worker processes that each keep the compiled template,
+    theme CSS, font configuration and logo for every row they handle.
+
+    Args:
+        template_file (str): Markdown template with {{ field }} placeholders
+        data_file (str): CSV, JSON Lines or JSON data file
+        output_pattern (str): Output path pattern, e.g. "out/statement-{{ customer_id }}.pdf"
+        jobs (int): Parallel worker processes (default: CPU count)
+        report_file (str): Optional JSON Lines report with one record per row
+        worker_limits (dict): Worker recycling limits from worker_limit_options()
+        Other arguments are as for convert_md_to_pdf().
+
+    Returns:
+        bool: True if every row rendered successfully
+    """
+    start_time = time.time()
+    try:
+        for path in (template_file, data_file):
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Input file not found: {path}")
+
+        print(f"\n{'='*60}")
+        print(f"📄 Merging: {Path(template_file).name} × {Path(data_file).name}")
+        print(f"{'='*60}")
+
+        compiled = compile_merge_template(
+            template_file, output_pattern, enable_toc=enable_toc, custom_css=custom_css, metadata=metadata,
+            theme=theme, logo_data_uri=logo_data_uri, logo_placements=logo_placements
+        )
+        print(f"✓ Template compiled ({len(compiled['fields'])} fields: {', '.join(compiled['fields']) or 'none'})")
+
+        jobs = jobs or os.cpu_count() or 1
+        report = open(report_file, 'w', encoding='utf-8') if report_file else None
+        counts = {'ok': 0, 'failed': 0}
+        seen_outputs = set()
+
+        def record(result):
+            METRICS.merge(result.pop('metrics', None))
+            counts[result['status']] += 1
+            if report:
+                report.write(json.dumps(result) + '\n')
+            if result['status'] == 'failed':
+                print(f"  ✗ row {result['row']}: {result['error']}")
+            done = counts['ok'] + counts['failed']
+            if done % 100 == 0:
+                print(f"  … {done} rows ({counts['failed']} failed, {time.time() - start_time:.1f}s)")
+
+        def dispatch(submit):
+            for row_number, row in read_merge_rows(data_file):
+                try:
+                    if isinstance(row, ValueError):
+                        raise row
+                    if not isinstance(row, dict):
+                        raise ValueError(f"row is a JSON {type(row).__name__}, not an object")
+                    output_file = merge_output_path(compiled, row_number, row)
+                    if output_file in seen_outputs:
+                        raise KeyError(f"output name {output_file} is already used by an earlier row")
+                    seen_outputs.add(output_file)
+                except (KeyError, ValueError) as e:
+                    record({'row': row_number, 'output': None, 'status': 'failed', 'error': e.args[0], 'seconds': 0.0})
+                    continue
+                submit(row_number, row, output_file)
+
+        try:
+            if jobs > 1:
+                # Keep a bounded number of rows in flight so huge data files stream
+                with RecyclingProcessPool(max_workers=jobs, initializer=_init_merge_worker, initargs=(compiled,),
+                                          **(worker_limits or {})) as executor:
+                    pending = {}
+
+                    def collect(future):
+                        row_number, output_file = pending.pop(future)
+                        try:
+                            record(future.result())
+                        except Exception as e:
+                            # The worker died mid-row (e.g. out of memory); the pool replaces it
+                            record({'row': row_number, 'output': output_file, 'status': 'failed',
+                                    'error': f"Worker error: {e}", 'seconds': 0.0})
+
+                    def submit(row_number, row, output_file):
+                        if len(pending) >= jobs * 4:
+                            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                            for future in done:
+                                collect(future)
+                        pending[executor.submit(_render_merge_row, row_number, row, output_file)] = (row_number, output_file)
+
+                    dispatch(submit)
+                    for future in as_completed(list(pending)):
+                        collect(future)
+            else:
+                _init_merge_worker(compiled)
+                dispatch(lambda row_number, row, output_file: record(_render_merge_row(row_number, row, output_file)))
+        finally:
+            if report:
+                report.close()
+
+        total = counts['ok'] + counts['failed']
+        print(f"{'='*60}")
+        if counts['failed']:
+            print(f"✗ {counts['failed']} of {total} rows failed")
+        else:
+            print(f"✅ SUCCESS! {total} documents")
+        elapsed = time.time() - start_time
+        print(f"⏱️  Time: {elapsed:.2f}s ({elapsed / max(total, 1):.3f}s per row, {jobs} jobs)")
+        if report_file:
+            print(f"📋 Report: {report_file}")
+        print(f"{'='*60}\n")
+        return counts['failed'] == 0
+
+    except FileNotFoundError as e:
+        print(f"✗ File Error: {e}")
+        return False
+    except (ValueError, csv.Error) as e:
+        print(f"✗ Data Error: {e}")
+        return False
+
+
+def merge_main(argv):
+    """Command line entry point for `klasiko merge`."""
+    parser = argparse.ArgumentParser(
+        prog='klasiko merge',
+        description='Render one PDF per data row from a Markdown template with {{ field }} placeholders'
+    )
+    parser.add_argument(
+        'template',
+        help='Markdown template, e.g. statement.md containing "Dear {{ name }},"'
+    )
+    parser.add_argument(
+        'data',
+        help='Data rows: .csv (header row names the fields), .jsonl or .json'
+    )
+    parser.add_argument(
+        '-o', '--output',
+        dest='output_pattern',
+        help='Output path pattern, e.g. "out/statement-{{ customer_id }}.pdf" (default: <template>-{{ _row }}.pdf)'
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        help='Parallel worker processes (default: CPU count)'
+    )
+    parser.add_argument(
+        '--report',
+        help='Write a JSON Lines report with the status, timing and error of every row'
+    )
+    add_worker_limit_arguments(parser)
+    parser.add_argument(
+        '--metrics-file',
+        help='Write Prometheus metrics here at the end of the run (node_exporter textfile collector)'
+    )
+    add_document_style_arguments(parser)
+    args = parser.parse_args(argv)
+
+    success = merge_md_to_pdf(
+        args.template,
+        args.data,
+        output_pattern=args.output_pattern,
+        jobs=args.jobs,
+        report_file=args.report,
+        worker_limits=worker_limit_options(args),
+        **document_style_options(args)
+    )
+    write_metrics_file(args.metrics_file)
+    return 0 if success else 1
+
+
+BUILD_STATE_FILE = '.klasiko-build-state.json'
+BUILD_JOURNAL_FILE = 'klasiko-build-journal.jsonl'
+BUILD_DOCUMENT_KEYS = {
+    'name', 'input', 'output', 'theme', 'toc', 'css', 'logo', 'logo_placements',
+    'author', 'subject', 'keywords',
+}
+
+
+def find_referenced_images(markdown_content, base_dir):
+    """
+    Find local image files referenced from Markdown content.
+
+    Covers inline images (![alt](path)), reference definitions pointing at
+    image files and raw <img src="..."> tags. Remote URLs and data URIs are ignored.
+
+    Args:
+        markdown_content (str): Raw Markdown content
+        base_dir (Path): Directory relative references are resolved against
+
+    Returns:
+        list: Resolved Path objects, in order of first appearance
+    """
+    image_extensions = ('.png', '.jpg', '.jpeg', '.gif', '.svg', '.webp', '.bmp')
+    references = re.findall(r'!\[[^\]]*\]\(\s*<?([^)\s>]+)>?', markdown_content)
+    references += re.findall(r'<img\b[^>]*\bsrc\s*=\s*["\']([^"\']+)["\']', markdown_content, re.IGNORECASE)
+    references += [
+        ref for ref in re.findall(r'^\s{0,3}\[[^\]]+\]:\s*<?(\S+?)>?(?:\s|$)', markdown_content, re.MULTILINE)
+        if ref.split('?')[0].lower().endswith(image_extensions)
+    ]
+
+    images = []
+    for ref in references:
+        if re.match(r'^[a-zA-Z][a-zA-Z0-9+.-]*:', ref) or ref.startswith('#'):
+            continue  # http:, https:, data:, file: ... are not tracked
+        path = (Path(base_dir) / ref.split('#')[0].split('?')[0]).resolve()
+        if path not in images:
+            images.append(path)
+    return images
+
+
+def load_build_manifest(manifest_path):
+    """
+    Load a klasiko.toml build manifest into a list of build targets.
+
+    The manifest has an optional [defaults] table, an optional [build] table
+    (jobs, journal) and one [[document]] table per output. Document keys mirror
+    the command line options: input, output, theme, toc, css, logo,
+    logo_placements, author, subject, keywords. Paths are relative to the manifest.
+
+    Args:
+        manifest_path (str or Path): Path to the manifest file
+
+    Returns:
+        tuple: (targets, build_settings) where targets is a list of dicts
+
+    Raises:
+        FileNotFoundError: If the manifest doesn't exist
+        ValueError: If the manifest is malformed
+        RuntimeError: If no TOML parser is available
+    """
+    if tomllib is None:
+        raise RuntimeError("Reading klasiko.toml requires Python 3.11+ or: pip install tomli")
+
+    manifest_path = Path(manifest_path)
+    if not manifest_path.exists():
+        raise FileNotFoundError(f"Manifest not found: {manifest_path}")
+
+    with open(manifest_path, 'rb') as f:
+        manifest = tomllib.load(f)
+
+    base_dir = manifest_path.resolve().parent
+    defaults = manifest.get('defaults', {})
+    documents = manifest.get('document', [])
+    if not documents:
+        raise ValueError("Manifest declares no [[document]] entries")
+
+    targets = []
+    seen_outputs = {}
+    for index, entry in enumerate(documents, 1):
+        options = dict(defaults)
+        options.update(entry)
+
+        unknown = set(options) - BUILD_DOCUMENT_KEYS
+        if unknown:
+            raise ValueError(f"Document #{index}: unknown option(s): {', '.join(sorted(unknown))}")
+        if 'input' not in options:
+            raise ValueError(f"Document #{index} is missing 'input'")
+
+        theme = options.get('theme', 'warm')
+        if theme not in available_themes():
+            raise ValueError(f"Document #{index}: unknown theme '{theme}'")
+
+        input_path = base_dir / options['input']
+        if options.get('output'):
+            output_path = base_dir / options['output']
+        else:
+            output_path = input_path.with_suffix('.pdf')
+
+        if output_path in seen_outputs:
+            raise ValueError(
+                f"Documents #{seen_outputs[output_path]} and #{index} both write {options.get('output', output_path.name)}"
+            )
+        seen_outputs[output_path] = index
+
+        # CSS follows the --css rule: an existing file path, otherwise inline CSS
+        css = options.get('css')
+        css_file = None
+        if css and (base_dir / css).is_file():
+            css_file = str(base_dir / css)
+            css = css_file
+
+        placements = options.get('logo_placements', [])
+        if isinstance(placements, str):
+            placements = [placements]
+
+        metadata = {key: options[key] for key in ('author', 'subject', 'keywords') if options.get(key)}
+
+        targets.append({
+            'name': options.get('name') or input_path.stem,
+            'input': str(input_path),
+            'output': str(output_path),
+            'theme': theme,
+            'toc': bool(options.get('toc', False)),
+            'css': css,
+            'css_file': css_file,
+            'logo': str(base_dir / options['logo']) if options.get('logo') else None,
+            'logo_placements': parse_logo_placements(placements),
+            'metadata': metadata or None,
+        })
+
+    return targets, manifest.get('build', {})
+
+
+def collect_target_dependencies(target):
+    """
+    List every input file a build target's output depends on.
+
+    Args:
+        target (dict): Build target from load_build_manifest()
+
+    Returns:
+        list: Paths of the Markdown file, theme stylesheet, CSS file, logo and
+            referenced images
+    """
+    dependencies = [Path(target['input']), available_themes()[target['theme']]]
+    if target['css_file']:
+        dependencies.append(Path(target['css_file']))
+    if target['logo']:
+        dependencies.append(Path(target['logo']))
+
+    try:
+        with open(target['input'], 'r', encoding='utf-8', errors='replace') as f:
+            markdown_content = f.read()
+    except OSError:
+        markdown_content = ''
+
+    for image in find_referenced_images(markdown_content, Path(target['input']).parent):
+        if image not in dependencies:
+            dependencies.append(image)
+    return dependencies
+
+
+def fingerprint_file(path, previous=None):
+    """
+    Fingerprint a file by content hash, reusing the previous hash when
+    modification time and size are unchanged.
+
+    Args:
+        path (Path): File to fingerprint
+        previous (dict): Fingerprint recorded by the last build, if any
+
+    Returns:
+        dict or None: {'mtime_ns', 'size', 'sha256'} or None if the file is missing
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    if previous and previous.get('mtime_ns') == stat.st_mtime_ns and previous.get('size') == stat.st_size:
+        return previous
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha256': digest.hexdigest()}
+
+
+def target_options_signature(target):
+    """
+    Hash the rendering options of a build target (everything except file
+    contents), with the klasiko, WeasyPrint, Markdown and Pygments versions
+    so an upgrade rebuilds every output.
+    """
+    options = {key: target[key] for key in ('input', 'theme', 'toc', 'css', 'logo', 'logo_placements', 'metadata')}
+    options['versions'] = [__version__, WEASYPRINT_VERSION, markdown.__version__,
+                           pygments.__version__ if PYGMENTS_AVAILABLE else None]
+    return hashlib.sha256(json.dumps(options, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+# Render cost model: estimated seconds = intercept + sum(weight * feature)
+COST_FEATURES = ('kilobytes', 'table_rows', 'code_lines', 'images', 'image_megapixels', 'footnotes', 'headings')
+DEFAULT_COST_WEIGHTS = {
+    'intercept': 0.4,
+    'kilobytes': 0.004,
+    'table_rows': 0.003,
+    'code_lines': 0.0008,
+    'images': 0.02,
+    'image_megapixels': 0.05,
+    'footnotes': 0.002,
+    'headings': 0.004,
+}
+# Only the most recent runs calibrate the model, so it follows hardware and version changes
+COST_CALIBRATION_SAMPLES = 500
+TABLE_SEPARATOR_PATTERN = re.compile(r'^\s*\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?\s*$')
+
+
+def read_image_dimensions(path):
+    """
+    Read the pixel size of a PNG, GIF or JPEG from its header, without decoding it.
+
+    Args:
+        path (Path): Image file
+
+    Returns:
+        tuple or None: (width, height), or None for other formats and unreadable files
+    """
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(26)
+            if header.startswith(b'\x89PNG\r\n\x1a\n') and header[12:16] == b'IHDR':
+                return struct.unpack('>II', header[16:24])
+            if header[:6] in (b'GIF87a', b'GIF89a'):
+                return struct.unpack('<HH', header[6:10])
+            if not header.startswith(b'\xff\xd8'):
+                return None
+
+            # JPEG: walk the segments up to the first start-of-frame marker
+            f.seek(2)
+            while True:
+                marker = f.read(4)
+                if len(marker) < 4 or marker[0] != 0xFF:
+                    return None
+                code, length = marker[1], struct.unpack('>H', marker[2:4])[0]
+                if 0xC0 <= code <= 0xCF and code not in (0xC4, 0xC8, 0xCC):
+                    frame = f.read(5)
+                    if len(frame) < 5:
+                        return None
+                    height, width = struct.unpack('>HH', frame[1:5])
+                    return width, height
+                f.seek(length - 2, os.SEEK_CUR)
+    except (OSError, struct.error):
+        return None
+
+
+def document_cost_features(markdown_content, base_dir, enable_toc=False):
+    """
+    Measure the parts of a Markdown document that drive its render time.
+
+    Only the Markdown text is scanned (and local image headers read), so this
+    is cheap enough to run on every document before a batch is scheduled.
+
+    Args:
+        markdown_content (str): Raw Markdown content
+        base_dir (Path): Directory relative image references are resolved against
+        enable_toc (bool): Whether headings feed a table of contents
+
+    Returns:
+        dict: One number per name in COST_FEATURES
+    """
+    code_lines = sum(
+        max(match.group(0).count('\n') - 1, 0)
+        for match in FENCED_REGION_PATTERN.finditer(markdown_content)
+    )
+    prose_lines = FENCED_REGION_PATTERN.sub('', markdown_content).splitlines()
+
+    # A table is a header row, a --- separator and the rows up to the next blank line
+    table_rows = 0
+    in_table = False
+    for index, line in enumerate(prose_lines):
+        if in_table and '|' in line and line.strip():
+            table_rows += 1
+        elif index and '|' in prose_lines[index - 1] and TABLE_SEPARATOR_PATTERN.match(line):
+            table_rows += 1
+            in_table = True
+        else:
+            in_table = False
+
+    megapixels = 0.0
+    for image in find_referenced_images(markdown_content, base_dir):
+        dimensions = read_image_dimensions(image)
+        if dimensions:
+            megapixels += dimensions[0] * dimensions[1] / 1e6
+
+    headings = 0
+    if enable_toc:
+        headings = sum(1 for line in prose_lines if re.match(r'^#{1,6}\s', line))
+
+    return {
+        'kilobytes': round(len(markdown_content.encode('utf-8')) / 1024, 1),
+        'table_rows': table_rows,
+        'code_lines': code_lines,
+        'images': len(re.findall(r'!\[[^\]]*\]|<img\b', markdown_content, re.IGNORECASE)),
+        'image_megapixels': round(megapixels, 2),
+        'footnotes': len(re.findall(r'^\[\^[^\]]+\]:', markdown_content, re.MULTILINE)),
+        'headings': headings,
+    }
+
+
+def file_cost_features(input_file, enable_toc=False):
+    """document_cost_features() for a Markdown file; a missing file has no features."""
+    try:
+        with open(input_file, 'r', encoding='utf-8', errors='replace') as f:
+            markdown_content = f.read()
+    except OSError:
+        markdown_content = ''
+    return document_cost_features(markdown_content, Path(input_file).resolve().parent, enable_toc)
+
+
+def estimate_render_cost(features, weights=None):
+    """
+    Estimate a document's render time from its cost features.
+
+    Args:
+        features (dict): From document_cost_features()
+        weights (dict): Model from calibrate_cost_weights() (default: DEFAULT_COST_WEIGHTS)
+
+    Returns:
+        float: Estimated seconds
+    """
+    weights = weights or DEFAULT_COST_WEIGHTS
+    return weights['intercept'] + sum(weights[name] * features.get(name, 0) for name in COST_FEATURES)
+
+
+def calibrate_cost_weights(samples):
+    """
+    Fit the cost model to measured render times.
+
+    A least-squares fit, pulled towards DEFAULT_COST_WEIGHTS so that features
+    that rarely vary in the samples keep sensible weights. Negative weights
+    are clamped to zero (no feature makes a document faster).
+
+    Args:
+        samples (list): (features, seconds) pairs from earlier runs
+
+    Returns:
+        dict: Weights for estimate_render_cost(), or DEFAULT_COST_WEIGHTS
+            when there are too few samples to fit
+    """
+    if len(samples) < 3:
+        return dict(DEFAULT_COST_WEIGHTS)
+
+    names = ('intercept',) + COST_FEATURES
+    rows = [[1.0] + [float(features.get(name, 0)) for name in COST_FEATURES] for features, _ in samples]
+    size = len(names)
+
+    # Normal equations (X'X + R) w = X'y + R w0, with R a small ridge relative to each column
+    matrix = [[sum(row[i] * row[j] for row in rows) for j in range(size)] for i in range(size)]
+    vector = [sum(row[i] * seconds for row, (_, seconds) in zip(rows, samples)) for i in range(size)]
+    for i, name in enumerate(names):
+        ridge = 0.01 * matrix[i][i] + 1e-9
+        matrix[i][i] += ridge
+        vector[i] += ridge * DEFAULT_COST_WEIGHTS[name]
+
+    # Gaussian elimination with partial pivoting
+    for column in range(size):
+        pivot = max(range(column, size), key=lambda row: abs(matrix[row][column]))
+        matrix[column], matrix[pivot] = matrix[pivot], matrix[column]
+        vector[column], vector[pivot] = vector[pivot], vector[column]
+        for row in range(column + 1, size):
+            factor = matrix[row][column] / matrix[column][column]
+            for k in range(column, size):
+                matrix[row][k] -= factor * matrix[column][k]
+            vector[row] -= factor * vector[column]
+    solution = [0.0] * size
+    for row in reversed(range(size)):
+        solution[row] = (vector[row] - sum(matrix[row][k] * solution[k] for k in range(row + 1, size))) / matrix[row][row]
+
+    return {name: max(value, 0.0) for name, value in zip(names, solution)}
+
+
+def journal_cost_samples(journal_path):
+    """
+    Read (features, seconds) samples from successful builds in a build journal.
+
+    Args:
+        journal_path (str or Path): JSONL journal written by run_build()
+
+    Returns:
+        list: The most recent COST_CALIBRATION_SAMPLES samples (empty if there is no journal)
+    """
+    samples = []
+    try:
+        with open(journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get('status') == 'built' and entry.get('features') and entry.get('seconds'):
+                    samples.append((entry['features'], entry['seconds']))
+    except OSError:
+        return []
+    return samples[-COST_CALIBRATION_SAMPLES:]
+
+
+def analyze_main(argv):
+    """Command line entry point for `klasiko analyze`."""
+    parser = argparse.ArgumentParser(
+        prog='klasiko analyze',
+        description='Estimate the render cost of Markdown files without rendering them'
+    )
+    parser.add_argument('input_files', nargs='+', help='Markdown files to analyze')
+    parser.add_argument('--toc', action='store_true', help='Estimate with a table of contents')
+    parser.add_argument(
+        '--journal',
+        default=BUILD_JOURNAL_FILE,
+        help=f'Build journal to calibrate the cost model from (default: {BUILD_JOURNAL_FILE}, if present)'
+    )
+    parser.add_argument('--json', action='store_true', help='Print the estimates as JSON')
+    args = parser.parse_args(argv)
+
+    samples = journal_cost_samples(args.journal)
+    weights = calibrate_cost_weights(samples)
+    estimates = []
+    for input_file in args.input_files:
+        if not os.path.exists(input_file):
+            print(f"✗ File Error: Input file not found: {input_file}")
+            return 1
+        features = file_cost_features(input_file, args.toc)
+        estimates.append({'input': input_file, 'estimate': round(estimate_render_cost(features, weights), 3),
+                          'features': features})
+    estimates.sort(key=lambda item: item['estimate'], reverse=True)
+
+    if args.json:
+        print(json.dumps({'calibration_samples': len(samples), 'weights': weights, 'documents': estimates}, indent=2))
+        return 0
+
+    model = f"calibrated from {len(samples)} builds" if len(samples) >= 3 else "default weights"
+    print(f"\n{'='*60}")
+    print(f"📊 Render cost: {len(estimates)} document(s), {model}")
+    print(f"{'='*60}")
+    for item in estimates:
+        features = item['features']
+        details = [f"{features['kilobytes']:.1f} KB"]
+        for name, label in (('table_rows', 'table rows'), ('code_lines', 'code lines'), ('images', 'images'),
+                            ('footnotes', 'footnotes'), ('headings', 'TOC headings')):
+            if features[name]:
+                details.append(f"{features[name]} {label}")
+        if features['image_megapixels']:
+            details.append(f"{features['image_megapixels']:.1f} MP")
+        print(f"  ~{item['estimate']:>6.2f}s  {item['input']}  ({', '.join(details)})")
+    print(f"{'='*60}")
+    print(f"⏱️  Total: ~{sum(item['estimate'] for item in estimates):.1f}s of rendering")
+    print(f"{'='*60}\n")
+    return 0
+
+
+def build_target(target):
+    """
+    Render a single build target, capturing its console output.
+
+    Runs in a worker process when building in parallel.
+
+    Args:
+        target (dict): Build target from load_build_manifest()
+
+    Returns:
+        dict: {'output', 'success', 'seconds', 'log', 'metrics'}
+    """
+    start_time = time.time()
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        try:
+            logo_data_uri = None
+            if target['logo']:
+                logo_data_uri = encode_logo_to_base64(validate_logo_file(target['logo']))
+
+            Path(target['output']).parent.mkdir(parents=True, exist_ok=True)
+            success = convert_md_to_pdf(
+                target['input'],
+                target['output'],
+                enable_toc=target['toc'],
+                custom_css=target['css'],
+                metadata=target['metadata'],
+                theme=target['theme'],
+                logo_data_uri=logo_data_uri,
+                logo_placements=target['logo_placements']
+            )
+        except Exception as e:
+            print(f"✗ Error: {e}")
+            success = False
+
+    return {
+        'output': target['output'],
+        'success': success,
+        'seconds': round(time.time() - start_time, 3),
+        'log': log.getvalue(),
+        'metrics': METRICS.drain(),
+    }
+
+
+def run_build(manifest_path, jobs=None, force=False, dry_run=False, worker_limits=None):
+    """
+    Build all stale targets declared in a manifest.
+
+    A target is stale when its output is missing, its options changed, or any
+    dependency (Markdown, CSS, logo, referenced images) changed content since
+    the last successful build. Stale targets are independent and are rendered
+    in parallel worker processes, the most expensive first (as estimated by a
+    cost model calibrated from earlier runs) so that a large document started
+    last doesn't hold up the whole build. Each run appends to a JSONL build
+    journal, which records the cost features of every built target.
+
+    Args:
+        manifest_path (str or Path): Path to klasiko.toml
+        jobs (int): Number of parallel workers (default: [build] jobs or CPU count)
+        force (bool): Rebuild every target regardless of staleness
+        dry_run (bool): Only report what would be rebuilt
+        worker_limits (dict): Worker recycling limits from worker_limit_options()
+
+    Returns:
+        bool: True if every target is up to date or built successfully
+    """
+    build_start = time.time()
+    targets, settings = load_build_manifest(manifest_path)
+    base_dir = Path(manifest_path).resolve().parent
+
+    def relative(path):
+        try:
+            return str(Path(path).relative_to(base_dir))
+        except ValueError:
+            return str(path)
+
+    state_path = base_dir / BUILD_STATE_FILE
+    state = {'targets': {}}
+    if state_path.exists():
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            print(f"Warning: Ignoring unreadable build state: {state_path.name}")
+
+    # Work out which targets are stale
+    stale = []
+    records = {}
+    for target in targets:
+        key = relative(target['output'])
+        previous = state['targets'].get(key, {})
+        previous_deps = previous.get('dependencies', {})
+
+        fingerprints = {}
+        for dependency in collect_target_dependencies(target):
+            dep_key = relative(dependency)
+            fingerprints[dep_key] = fingerprint_file(dependency, previous_deps.get(dep_key))
+
+        signature = target_options_signature(target)
+        if force:
+            reason = 'forced'
+        elif not previous:
+            reason = 'new target'
+        elif not os.path.exists(target['output']):
+            reason = 'output missing'
+        elif previous.get('signature') != signature:
+            reason = 'options changed'
+        else:
+            changed = [
+                dep for dep, fp in fingerprints.items()
+                if (fp or {}).get('sha256') != (previous_deps.get(dep) or {}).get('sha256')
+            ]
+            changed += [dep for dep in previous_deps if dep not in fingerprints]
+            reason = f"changed: {', '.join(changed)}" if changed else None
+
+        records[key] = {'target': target, 'signature': signature, 'dependencies': fingerprints, 'reason': reason}
+        if reason:
+            stale.append(key)
+
+    jobs = jobs or settings.get('jobs') or os.cpu_count() or 1
+    journal_path = base_dir / settings.get('journal', BUILD_JOURNAL_FILE)
+
+    # Longest job first: start the expensive targets while there is parallelism left for the rest
+    weights = calibrate_cost_weights(journal_cost_samples(journal_path)) if stale else None
+    for key in stale:
+        records[key]['features'] = file_cost_features(records[key]['target']['input'], records[key]['target']['toc'])
+        records[key]['estimate'] = estimate_render_cost(records[key]['features'], weights)
+    if jobs > 1:
+        stale.sort(key=lambda key: records[key]['estimate'], reverse=True)
+
+    print(f"\n{'='*60}")
+    print(f"🔨 Building: {Path(manifest_path).name} ({len(stale)} of {len(targets)} stale, {jobs} jobs)")
+    print(f"{'='*60}")
+
+    for key, record in records.items():
+        if not record['reason']:
+            print(f"  · {key} (up to date)")
+        elif dry_run:
+            print(f"  → {key} ({record['reason']}, ~{record['estimate']:.1f}s)")
+
+    if dry_run:
+        return True
+
+    # Render stale targets, in parallel when there is more than one
+    results = {}
+    if jobs > 1 and len(stale) > 1:
+        with RecyclingProcessPool(max_workers=min(jobs, len(stale)), **(worker_limits or {})) as executor:
+            futures = {executor.submit(build_target, records[key]['target']): key for key in stale}
+            for future in as_completed(futures):
+                key = futures[future]
+                try:
+                    results[key] = future.result()
+                except Exception as e:
+                    results[key] = {'output': key, 'success': False, 'seconds': 0.0, 'log': f"✗ Worker error: {e}\n"}
+                _print_build_result(key, results[key])
+    else:
+        for key in stale:
+            results[key] = build_target(records[key]['target'])
+            _print_build_result(key, results[key])
+
+    # Record successful builds; drop failed ones so they are retried next time
+    for key, result in results.items():
+        METRICS.merge(result.pop('metrics', None))
+        if result['success']:
+            state['targets'][key] = {
+                'signature': records[key]['signature'],
+                'dependencies': records[key]['dependencies'],
+            }
+        else:
+            state['targets'].pop(key, None)
+
+    temp_path = state_path.with_suffix('.tmp')
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(temp_path, state_path)
+
+    # Append this run to the build journal
+    failed = [key for key, result in results.items() if not result['success']]
+    timestamp = time.strftime('%Y-%m-%dT%H:%M:%S')
+    with open(journal_path, 'a', encoding='utf-8') as f:
+        for key, record in records.items():
+            entry = {'time': timestamp, 'target': key, 'status': 'up-to-date'}
+            if key in results:
+                entry['status'] = 'built' if results[key]['success'] else 'failed'
+                entry['reason'] = record['reason']
+                entry['seconds'] = results[key]['seconds']
+                entry['estimate'] = round(record['estimate'], 3)
+                entry['features'] = record['features']
+            f.write(json.dumps(entry) + '\n')
+        f.write(json.dumps({
+            'time': timestamp,
+            'event': 'build',
+            'manifest': Path(manifest_path).name,
+            'built': len(results) - len(failed),
+            'failed': len(failed),
+            'up_to_date': len(targets) - len(results),
+            'jobs': jobs,
+            'seconds': round(time.time() - build_start, 3),
+        }) + '\n')
+
+    print(f"{'='*60}")
+    status = "✅ BUILD OK" if not failed else f"✗ BUILD FAILED ({len(failed)} target(s))"
+    print(f"{status} - {len(results) - len(failed)} built, {len(targets) - len(results)} up to date, "
+          f"{time.time() - build_start:.2f}s")
+    print(f"{'='*60}\n")
+
+    return not failed
+
+
+def _print_build_result(key, result):
+    """Print a one-line build status, with the captured log for failures."""
+    if result['success']:
+        print(f"  ✓ {key} ({result['seconds']:.2f}s)")
+    else:
+        print(f"  ✗ {key} ({result['seconds']:.2f}s)")
+        for line in result['log'].strip().splitlines():
+            print(f"      {line}")
+
+
+def build_main(argv):
+    """Command line entry point for `klasiko build`."""
+    parser = argparse.ArgumentParser(
+        prog='klasiko build',
+        description='Build the documents declared in a klasiko.toml manifest, rebuilding only stale outputs'
+    )
+    parser.add_argument(
+        'manifest',
+        nargs='?',
+        default='klasiko.toml',
+        help='Path to the build manifest (default: klasiko.toml)'
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        help='Number of documents to render in parallel (default: CPU count)'
+    )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Rebuild every document even if it is up to date'
+    )
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Show which documents are stale without building them'
+    )
+    add_worker_limit_arguments(parser)
+    parser.add_argument(
+        '--metrics-file',
+        help='Write Prometheus metrics here at the end of the run (node_exporter textfile collector)'
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        success = run_build(args.manifest, jobs=args.jobs, force=args.force, dry_run=args.dry_run,
+                            worker_limits=worker_limit_options(args))
+    except (FileNotFoundError, ValueError, RuntimeError) as e:
+        print(f"✗ Build Error: {e}")
+        return 1
+
+    write_metrics_file(args.metrics_file)
+    return 0 if success else 1
+
+
+QUEUE_DB_FILE = 'klasiko-queue.db'
+QUEUE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    input TEXT NOT NULL,
+    output TEXT NOT NULL,
+    options TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    available_at REAL NOT NULL,
+    lease_owner TEXT,
+    lease_expires REAL,
+    enqueued_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    seconds REAL,
+    output_bytes INTEGER,
+    error TEXT,
+    features TEXT,
+    cost REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (state, available_at);
+"""
+QUEUE_STATES = ('queued', 'running', 'done', 'failed')
+# Exceptions convert_md_to_pdf() reports for bad input; retrying them can't help
+QUEUE_PERMANENT_ERRORS = (FileNotFoundError, UnicodeDecodeError, ValueError)
+
+
+def open_queue(db_path):
+    """
+    Open (creating if needed) a job queue database.
+
+    The database uses write-ahead logging so producers, workers and status
+    readers in different processes can use it at the same time.
+
+    Args:
+        db_path (str or Path): Path to the SQLite database
+
+    Returns:
+        sqlite3.Connection: Connection with autocommit (explicit transactions)
+    """
+    connection = sqlite3.connect(str(db_path), timeout=30, isolation_level=None)
+    connection.row_factory = sqlite3.Row
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA busy_timeout=30000')
+    connection.executescript(QUEUE_SCHEMA)
+
+    # Queues created before jobs carried a render cost estimate
+    columns = {row['name'] for row in connection.execute('PRAGMA table_info(jobs)')}
+    for column, column_type in (('features', 'TEXT'), ('cost', 'REAL')):
+        if column not in columns:
+            connection.execute(f'ALTER TABLE jobs ADD COLUMN {column} {column_type}')
+    return connection
+
+
+def queue_cost_weights(connection):
+    """Calibrate the render cost model from the queue's recently completed jobs."""
+    rows = connection.execute(
+        "SELECT features, seconds FROM jobs WHERE state = 'done' AND features IS NOT NULL AND seconds > 0 "
+        "ORDER BY id DESC LIMIT ?",
+        (COST_CALIBRATION_SAMPLES,)
+    ).fetchall()
+    return calibrate_cost_weights([(json.loads(row['features']), row['seconds']) for row in rows])
+
+
+def enqueue_job(connection, input_file, output_file=None, max_attempts=3, cost_weights=None, **options):
+    """
+    Add a conversion job to the queue.
+
+    The job's render cost is estimated now, so workers can claim the most
+    expensive jobs first.
+
+    Args:
+        connection (sqlite3.Connection): Queue from open_queue()
+        input_file (str): Markdown file to convert
+        output_file (str): Output PDF path (default: input with .pdf extension)
+        max_attempts (int): Attempts before the job is marked failed
+        cost_weights (dict): Cost model to estimate with (default: queue_cost_weights())
+        **options: convert_md_to_pdf() keyword arguments (theme, enable_toc, ...)
+
+    Returns:
+        int: The new job's id
+    """
+    input_path = Path(input_file).resolve()
+    output_path = Path(output_file).resolve() if output_file else input_path.with_suffix('.pdf')
+    features = file_cost_features(input_path, options.get('enable_toc', False))
+    cost = estimate_render_cost(features, cost_weights or queue_cost_weights(connection))
+    now = time.time()
+    cursor = connection.execute(
+        'INSERT INTO jobs (input, output, options, max_attempts, available_at, enqueued_at, features, cost) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        (str(input_path), str(output_path), json.dumps(options), max_attempts, now, now, json.dumps(features), cost)
+    )
+    return cursor.lastrowid
+
+
+def claim_job(connection, worker_id, lease_seconds):
+    """
+    Claim the next runnable job for a worker.
+
+    A job is runnable when it is queued and its backoff has passed, or when it
+    is running under a lease that expired (its worker crashed or was killed).
+    The runnable job with the highest estimated render cost is claimed first.
+
+    Args:
+        connection (sqlite3.Connection): Queue from open_queue()
+        worker_id (str): Lease owner recorded on the job
+        lease_seconds (float): How long the claim holds without a heartbeat
+
+    Returns:
+        sqlite3.Row or None: The claimed job, or None if nothing is runnable
+    """
+    now = time.time()
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        # A worker that died on a job's last attempt leaves it running with an expired lease
+        connection.execute(
+            "UPDATE jobs SET state = 'failed', finished_at = ?, lease_owner = NULL, lease_expires = NULL, "
+            "error = COALESCE(error, 'Worker stopped during the last attempt') "
+            "WHERE state = 'running' AND lease_expires < ? AND attempts >= max_attempts",
+            (now, now)
+        )
+        job = connection.execute(
+            "SELECT * FROM jobs WHERE (state = 'queued' AND available_at <= ?) "
+            "OR (state = 'running' AND lease_expires < ?) ORDER BY COALESCE(cost, 0) DESC, id LIMIT 1",
+            (now, now)
+        ).fetchone()
+        if job is None:
+            connection.execute('COMMIT')
+            return None
+        connection.execute(
+            "UPDATE jobs SET state = 'running', attempts = attempts + 1, lease_owner = ?, lease_expires = ?, "
+            "started_at = ? WHERE id = ?",
+            (worker_id, now + lease_seconds, now, job['id'])
+        )
+        connection.execute('COMMIT')
+    except BaseException:
+        connection.execute('ROLLBACK')
+        raise
+    return connection.execute('SELECT * FROM jobs WHERE id = ?', (job['id'],)).fetchone()
+
+
+def queue_retry_delay(attempt, base_delay):
+    """Exponential backoff before retry number `attempt` (1 = first retry)."""
+    return base_delay * (2 ** (attempt - 1))
+
+
+def run_queue_job(job):
+    """
+    Render one queued job with convert_md_to_pdf(), keeping its console output
+    out of the worker log.
+
+    The job fails permanently when the conversion's 'result' event reports
+    one of QUEUE_PERMANENT_ERRORS; any other failure may succeed on a retry.
+
+    Args:
+        job (sqlite3.Row): Claimed job from claim_job()
+
+    Returns:
+        dict: {'success', 'permanent', 'seconds', 'output_bytes', 'log'}
+    """
+    start_time = time.time()
+    results = []
+
+    def progress(event):
+        if event['event'] == 'result':
+            results.append(event)
+
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        try:
+            options = json.loads(job['options'])
+            Path(job['output']).parent.mkdir(parents=True, exist_ok=True)
+            success = convert_md_to_pdf(job['input'], job['output'], progress=progress, **options)
+        except Exception as e:
+            results.append({'event': 'result', 'success': False, 'error': str(e), 'error_type': type(e).__name__})
+            success = False
+
+    error_type = results[-1].get('error_type') if results else None
+    output_bytes = None
+    if success and os.path.exists(job['output']):
+        output_bytes = os.path.getsize(job['output'])
+    return {
+        'success': success,
+        'permanent': not success and error_type in [error.__name__ for error in QUEUE_PERMANENT_ERRORS],
+        'seconds': round(time.time() - start_time, 3),
+        'output_bytes': output_bytes,
+        'log': f"{error_type}: {results[-1]['error']}" if error_type else log.getvalue()[-2000:],
+    }
+
+
+def queue_worker_loop(db_path, worker_number, lease_seconds=120, retry_delay=30, poll_interval=1.0, drain=True,
+                      max_jobs=None, max_rss_mb=None):
+    """
+    Claim and render jobs until the queue is drained (or forever).
+
+    Runs in a worker process. While a job renders, a heartbeat thread keeps
+    extending its lease so only crashed workers lose their jobs. The loop also
+    stops early when its process should be recycled.
+
+    Args:
+        db_path (str): Path to the queue database
+        worker_number (int): Worker index, used in the lease owner name
+        lease_seconds (float): Lease length; expired leases are reclaimed by other workers
+        retry_delay (float): Backoff before the first retry, doubled on every further attempt
+        poll_interval (float): Sleep between polls when nothing is runnable
+        drain (bool): Exit once no job is queued or running instead of waiting for more
+        max_jobs (int): Stop after this many jobs so the process can be replaced
+        max_rss_mb (float): Stop once resident memory exceeds this many MB
+
+    Returns:
+        tuple: (jobs processed, metrics snapshot from this worker, recycle reason or None)
+    """
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{worker_number}"
+    connection = open_queue(db_path)
+    processed = 0
+    recycle_reason = None
+
+    while True:
+        job = claim_job(connection, worker_id, lease_seconds)
+        if job is None:
+            if drain:
+                active = connection.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE state IN ('queued', 'running')"
+                ).fetchone()[0]
+                if not active:
+                    break
+            time.sleep(poll_interval)
+            continue
+
+        done = threading.Event()
+
+        def heartbeat(job_id=job['id']):
+            heartbeat_connection = open_queue(db_path)
+            while not done.wait(lease_seconds / 3):
+                heartbeat_connection.execute(
+                    "UPDATE jobs SET lease_expires = ? WHERE id = ? AND lease_owner = ?",
+                    (time.time() + lease_seconds, job_id, worker_id)
+                )
+            heartbeat_connection.close()
+
+        beater = threading.Thread(target=heartbeat, daemon=True)
+        beater.start()
+        try:
+            result = run_queue_job(job)
+        finally:
+            done.set()
+            beater.join()
+
+        now = time.time()
+        name = Path(job['input']).name
+        attempt = f"attempt {job['attempts']}/{job['max_attempts']}"
+        if result['success']:
+            connection.execute(
+                "UPDATE jobs SET state = 'done', finished_at = ?, seconds = ?, output_bytes = ?, error = NULL, "
+                "lease_owner = NULL, lease_expires = NULL WHERE id = ? AND lease_owner = ?",
+                (now, result['seconds'], result['output_bytes'], job['id'], worker_id)
+            )
+            print(f"  ✓ #{job['id']} {name} ({result['seconds']:.2f}s, {result['output_bytes'] / 1024:.0f} KB)", flush=True)
+        elif result['permanent'] or job['attempts'] >= job['max_attempts']:
+            connection.execute(
+                "UPDATE jobs SET state = 'failed', finished_at = ?, seconds = ?, error = ?, "
+                "lease_owner = NULL, lease_expires = NULL WHERE id = ? AND lease_owner = ?",
+                (now, result['seconds'], result['log'], job['id'], worker_id)
+            )
+            print(f"  ✗ #{job['id']} {name} failed ({attempt}): {result['log'].splitlines()[0] if result['log'] else ''}", flush=True)
+        else:
+            delay = queue_retry_delay(job['attempts'], retry_delay)
+            connection.execute(
+                "UPDATE jobs SET state = 'queued', available_at = ?, seconds = ?, error = ?, "
+                "lease_owner = NULL, lease_expires = NULL WHERE id = ? AND lease_owner = ?",
+                (now + delay, result['seconds'], result['log'], job['id'], worker_id)
+            )
+            print(f"  ↻ #{job['id']} {name} failed ({attempt}), retrying in {delay:.0f}s", flush=True)
+        processed += 1
+
+        rss_mb = current_rss_mb()
+        if max_rss_mb and rss_mb and rss_mb > max_rss_mb:
+            recycle_reason = 'rss'
+            break
+        if max_jobs and processed >= max_jobs:
+            recycle_reason = 'jobs'
+            break
+
+    connection.close()
+    return processed, METRICS.drain(), recycle_reason
+
+
+def queue_status(connection):
+    """
+    Summarize a job queue.
+
+    Returns:
+        dict: Job counts per state, timing and size totals of finished jobs,
+            the age of the oldest queued job and the most recent failures
+    """
+    counts = dict.fromkeys(QUEUE_STATES, 0)
+    for row in connection.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state'):
+        counts[row[0]] = row[1]
+
+    totals = connection.execute(
+        "SELECT COUNT(*), SUM(seconds), MAX(seconds), SUM(output_bytes) FROM jobs WHERE state = 'done'"
+    ).fetchone()
+    oldest = connection.execute("SELECT MIN(enqueued_at) FROM jobs WHERE state = 'queued'").fetchone()[0]
+    failures = [
+        {'id': row['id'], 'input': row['input'], 'attempts': row['attempts'], 'error': row['error']}
+        for row in connection.execute("SELECT * FROM jobs WHERE state = 'failed' ORDER BY finished_at DESC LIMIT 10")
+    ]
+    return {
+        'counts': counts,
+        'render_seconds': round(totals[1] or 0.0, 3),
+        'average_seconds': round((totals[1] or 0.0) / totals[0], 3) if totals[0] else None,
+        'slowest_seconds': totals[2],
+        'output_bytes': totals[3] or 0,
+        'oldest_queued_seconds': round(time.time() - oldest, 1) if oldest else None,
+        'recent_failures': failures,
+    }
+
+
+def run_queue_workers(db_path, jobs=None, lease_seconds=120, retry_delay=30, drain=True, worker_limits=None):
+    """
+    Run a pool of queue workers against a queue database.
+
+    Each worker slot runs queue_worker_loop() in a child process and starts a
+    fresh process whenever the loop stops for recycling or the process dies.
+
+    Args:
+        db_path (str): Path to the queue database
+        jobs (int): Worker processes (default: CPU count)
+        lease_seconds, retry_delay: As for queue_worker_loop()
+        drain (bool): Stop once the queue is empty instead of waiting for new jobs
+        worker_limits (dict): Worker recycling limits from worker_limit_options()
+
+    Returns:
+        bool: True if no job in the queue has failed
+    """
+    start_time = time.time()
+    jobs = jobs or os.cpu_count() or 1
+    connection = open_queue(db_path)
+    counts = queue_status(connection)['counts']
+
+    print(f"\n{'='*60}")
+    print(f"📥 Queue: {Path(db_path).name} ({counts['queued']} queued, {counts['running']} running, {jobs} workers)")
+    print(f"{'='*60}")
+
+    limits = worker_limits or {}
+    worker_kwargs = {
+        'lease_seconds': lease_seconds, 'retry_delay': retry_delay, 'drain': drain,
+        'max_jobs': limits.get('max_jobs_per_worker'), 'max_rss_mb': limits.get('max_rss_mb'),
+    }
+    processed = [0]
+    stopping = threading.Event()
+
+    def run_slot(worker_number):
+        failures = 0
+        while not stopping.is_set():
+            worker = RenderWorker(warm_theme=None, memory_limit_mb=limits.get('memory_limit_mb'), quiet=False)
+            try:
+                count, worker_metrics, reason = worker.run(queue_worker_loop, str(db_path), worker_number, **worker_kwargs)
+            except Exception as e:
+                # Its job's lease expires and the job is retried; give up after repeated failures
+                worker.terminate()
+                if stopping.is_set():
+                    return
+                record_worker_recycle('crashed')
+                failures += 1
+                print(f"  ✗ Worker {worker_number} stopped: {e}", flush=True)
+                if failures >= 3:
+                    return
+                continue
+            worker.close()
+            failures = 0
+            processed[0] += count
+            METRICS.merge(worker_metrics)
+            if reason is None:
+                return
+            record_worker_recycle(reason)
+
+    if jobs > 1 or any(limits.values()):
+        threads = [threading.Thread(target=run_slot, args=(number,), daemon=True) for number in range(jobs)]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            stopping.set()
+            raise
+    else:
+        processed[0], worker_metrics, _ = queue_worker_loop(str(db_path), 0, **worker_kwargs)
+        METRICS.merge(worker_metrics)
+    processed = processed[0]
+
+    counts = queue_status(connection)['counts']
+    connection.close()
+    print(f"{'='*60}")
+    status = "✅ QUEUE DRAINED" if not counts['failed'] else f"✗ {counts['failed']} job(s) failed"
+    print(f"{status} - {processed} processed, {counts['done']} done in total, {time.time() - start_time:.2f}s")
+    print(f"{'='*60}\n")
+    return counts['failed'] == 0
+
+
+def queue_main(argv):
+    """Command line entry point for `klasiko queue`."""
+    parser = argparse.ArgumentParser(
+        prog='klasiko queue',
+        description='Durable local job queue: enqueue conversions, then drain them with a pool of workers'
+    )
+    parser.add_argument(
+        '--db',
+        default=QUEUE_DB_FILE,
+        help=f'Queue database (default: {QUEUE_DB_FILE})'
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add_parser = commands.add_parser('add', help='Enqueue Markdown files for conversion')
+    add_parser.add_argument('input_files', nargs='+', help='Markdown files to convert')
+    add_parser.add_argument(
+        '-o', '--output',
+        dest='output_file',
+        help='Output PDF path (only with a single input; default: input with .pdf extension)'
+    )
+    add_parser.add_argument(
+        '--max-attempts',
+        type=int,
+        default=3,
+        help='Attempts before a job is marked failed (default: 3)'
+    )
+    add_document_style_arguments(add_parser)
+
+    for name, help_text in (('drain', 'Process queued jobs until the queue is empty'),
+                            ('work', 'Process jobs and keep waiting for new ones (Ctrl+C to stop)')):
+        worker_parser = commands.add_parser(name, help=help_text)
+        worker_parser.add_argument(
+            '-j', '--jobs',
+            type=int,
+            help='Worker processes (default: CPU count)'
+        )
+        worker_parser.add_argument(
+            '--lease',
+            type=float,
+            default=120,
+            help='Seconds before a crashed worker\'s job is reclaimed (default: 120)'
+        )
+        worker_parser.add_argument(
+            '--retry-delay',
+            type=float,
+            default=30,
+            help='Backoff before the first retry, doubled on each further attempt (default: 30)'
+        )
+        worker_parser.add_argument(
+            '--metrics-file',
+            help='Write Prometheus metrics here when the workers stop (node_exporter textfile collector)'
+        )
+        add_worker_limit_arguments(worker_parser)
+
+    status_parser = commands.add_parser('status', help='Show job counts, timings and recent failures')
+    status_parser.add_argument('--json', action='store_true', help='Print the status as JSON')
+
+    commands.add_parser('retry', help='Requeue failed jobs with a fresh set of attempts')
+    args = parser.parse_args(argv)
+
+    if args.command == 'add':
+        if args.output_file and len(args.input_files) > 1:
+            parser.error("-o/--output can only be used with a single input file")
+        options = document_style_options(args)
+        connection = open_queue(args.db)
+        cost_weights = queue_cost_weights(connection)
+        for input_file in args.input_files:
+            if not os.path.exists(input_file):
+                print(f"Warning: {input_file} does not exist yet; the job will fail unless it appears")
+            job_id = enqueue_job(connection, input_file, args.output_file, max_attempts=args.max_attempts,
+                                 cost_weights=cost_weights, **options)
+            print(f"✓ Queued #{job_id}: {input_file}")
+        connection.close()
+        return 0
+
+    if args.command in ('drain', 'work'):
+        try:
+            success = run_queue_workers(
+                args.db, jobs=args.jobs, lease_seconds=args.lease, retry_delay=args.retry_delay,
+                drain=args.command == 'drain', worker_limits=worker_limit_options(args)
+            )
+        except KeyboardInterrupt:
+            print("\n⏹  Stopped; unfinished jobs are picked up again when their leases expire")
+            return 130
+        write_metrics_file(args.metrics_file)
+        return 0 if success else 1
+
+    connection = open_queue(args.db)
+    if args.command == 'retry':
+        cursor = connection.execute(
+            "UPDATE jobs SET state = 'queued', attempts = 0, available_at = ?, error = NULL WHERE state = 'failed'",
+            (time.time(),)
+        )
+        print(f"✓ Requeued {cursor.rowcount} failed job(s)")
+        connection.close()
+        return 0
+
+    status = queue_status(connection)
+    connection.close()
+    if args.json:
+        print(json.dumps(status, indent=2))
+        return 0
+
+    counts = status['counts']
+    print(f"📥 {args.db}: " + ', '.join(f"{counts[state]} {state}" for state in QUEUE_STATES))
+    if status['average_seconds'] is not None:
+        print(f"⏱️  Rendering: {status['render_seconds']:.1f}s total, {status['average_seconds']:.2f}s average, "
+              f"{status['slowest_seconds']:.2f}s slowest")
+        print(f"📏 Output: {status['output_bytes'] / (1024 * 1024):.2f} MB")
+    if status['oldest_queued_seconds'] is not None:
+        print(f"⏳ Oldest queued job: {status['oldest_queued_seconds']:.0f}s ago")
+    for failure in status['recent_failures']:
+        error = (failure['error'] or '').splitlines()[0] if failure['error'] else ''
+        print(f"  ✗ #{failure['id']} {Path(failure['input']).name} ({failure['attempts']} attempts): {error}")
+    return 0
+
+
+HTTP_MAX_BODY = 20 * 1024 * 1024
+HTTP_CHUNK_SIZE = 64 * 1024
+HTTP_LOGO_POSITIONS = ('header', 'footer', 'both', 'watermark', 'title', 'all')
+HTTP_LOGO_SIZES = ('small', 'medium', 'large')
+HTTP_TRUE_VALUES = ('1', 'true', 'yes', 'on')
+HTTP_FALSE_VALUES = ('0', 'false', 'no', 'off', '')
+HTTP_LOGO_PATTERN = re.compile(r'^data:image/(png|jpeg|svg\+xml);base64,[A-Za-z0-9+/=\s]+$')
+
+
+def http_render_options(payload):
+    """
+    Validate an HTTP render request and turn it into render_markdown_to_pdf() arguments.
+
+    Keys mirror the command line options: markdown, theme, toc, css (inline CSS
+    only), author, subject, keywords, logo (a base64 image data URI),
+    logo_placement ("position:size", one string or a list), pages and draft.
+    toc and draft take true/false, 1/0, yes/no or on/off; anything else, or a
+    value of the wrong JSON type, is refused.
+
+    Args:
+        payload (dict): Decoded JSON body, or query parameters for a raw Markdown body
+
+    Returns:
+        dict: Keyword arguments for render_markdown_to_pdf()
+
+    Raises:
+        ValueError: If the request is malformed
+    """
+    def flag(key):
+        value = payload.get(key, False)
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, int) and value in (0, 1):
+            return bool(value)
+        if isinstance(value, str) and value.strip().lower() in HTTP_TRUE_VALUES + HTTP_FALSE_VALUES:
+            return value.strip().lower() in HTTP_TRUE_VALUES
+        raise ValueError(f"'{key}' must be true or false")
+
+    def text(key):
+        value = payload.get(key) or None
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f"'{key}' must be a string")
+        return value
+
+    unknown = set(payload) - {
+        'markdown', 'theme', 'toc', 'css', 'author', 'subject', 'keywords', 'logo', 'logo_placement', 'pages', 'draft',
+    }
+    if unknown:
+        raise ValueError(f"Unknown option(s): {', '.join(sorted(unknown))}")
+
+    markdown_content = payload.get('markdown')
+    if not isinstance(markdown_content, str):
+        raise ValueError("'markdown' (string) is required")
+
+    theme = text('theme') or 'warm'
+    if theme not in available_themes():
+        raise ValueError(f"Unknown theme '{theme}'. Choose from: {', '.join(sorted(available_themes()))}")
+
+    # Never treat request CSS as a path: that would read files from the server
+    # (URLs inside the document are limited by data_url_fetcher())
+    css = text('css')
+    if css is not None and '{' not in css:
+        raise ValueError("'css' must be inline CSS text")
+
+    logo = text('logo')
+    if logo is not None and not HTTP_LOGO_PATTERN.match(logo):
+        raise ValueError("'logo' must be a data:image/png, image/jpeg or image/svg+xml base64 URI")
+
+    placements = payload.get('logo_placement') or []
+    if isinstance(placements, str):
+        placements = [placements]
+    if not isinstance(placements, list) or not all(isinstance(p, str) and ':' in p for p in placements):
+        raise ValueError("Logo placements must be 'position:size' strings")
+    logo_placements = parse_logo_placements(placements)
+    for placement in logo_placements:
+        if placement['position'] not in HTTP_LOGO_POSITIONS or placement['size'] not in HTTP_LOGO_SIZES:
+            raise ValueError(f"Invalid logo placement '{placement['position']}:{placement['size']}'")
+    if logo and not logo_placements:
+        logo_placements = [{'position': 'header', 'size': 'medium'}]
+
+    pages = payload.get('pages') or None
+    if pages is not None:
+        if isinstance(pages, bool) or not isinstance(pages, (str, int)):
+            raise ValueError("'pages' must be a page range string such as \"1-5,8\"")
+        pages = str(pages)
+        parse_page_ranges(pages)
+
+    metadata = {key: text(key) for key in ('author', 'subject', 'keywords') if text(key)}
+    return {
+        'markdown_content': markdown_content,
+        'enable_toc': flag('toc'),
+        'custom_css': css,
+        'metadata': metadata or None,
+        'theme': theme,
+        'logo_data_uri': logo,
+        'logo_placements': logo_placements,
+        'pages': pages,
+        'draft': flag('draft'),
+    }
+
+
+def _render_for_service(options):
+    """
+    Render in a service worker, returning (pdf_bytes, error, metrics) so metrics survive failures.
+
+    Requests are untrusted, so only data: URIs are fetched.
+    """
+    try:
+        pdf_bytes, error = render_markdown_to_pdf(url_fetcher=data_url_fetcher(), **options), None
+    except Exception as e:
+        pdf_bytes, error = None, e
+    return pdf_bytes, error, METRICS.drain()
+
+
+class RenderService:
+    """
+    Render pool shared by all HTTP request threads.
+
+    Identical concurrent requests share one render. At most jobs renders run
+    at once and max_queue more may wait; submit() refuses anything beyond that.
+    """
+
+    def __init__(self, jobs=None, max_queue=8, warm_theme='warm', worker_limits=None):
+        self.jobs = jobs or os.cpu_count() or 1
+        self.max_queue = max_queue
+        # Workers that die or grow too large are replaced by the pool
+        self.executor = RecyclingProcessPool(max_workers=self.jobs, warm_theme=warm_theme, **(worker_limits or {}))
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.started = time.time()
+        self.stats = {'rendered': 0, 'coalesced': 0, 'rejected': 0, 'failed': 0}
+
+    def submit(self, options):
+        """
+        Start a render, or join an identical one already in flight.
+
+        Args:
+            options (dict): Arguments from http_render_options()
+
+        Returns:
+            Future or None: The render's future, or None if the service is saturated
+        """
+        key = hashlib.sha256(json.dumps(options, sort_keys=True).encode('utf-8')).hexdigest()
+        with self.lock:
+            future = self.in_flight.get(key)
+            if future is not None:
+                self.stats['coalesced'] += 1
+                return future
+            if len(self.in_flight) >= self.jobs + self.max_queue:
+                self.stats['rejected'] += 1
+                return None
+            future = self.executor.submit(_render_for_service, options)
+            self.in_flight[key] = future
+        future.add_done_callback(lambda done: self._finished(key, done))
+        return future
+
+    def _finished(self, key, future):
+        failed = future.cancelled() or future.exception() is not None
+        if not failed:
+            _, error, metrics = future.result()
+            METRICS.merge(metrics)
+            failed = error is not None
+        with self.lock:
+            self.in_flight.pop(key, None)
+            self.stats['failed' if failed else 'rendered'] += 1
+
+    def health(self):
+        """Return a JSON-ready snapshot of the service state."""
+        with self.lock:
+            return {
+                'status': 'ok',
+                'workers': self.jobs,
+                'in_flight': len(self.in_flight),
+                'capacity': self.jobs + self.max_queue,
+                'uptime_seconds': round(time.time() - self.started, 1),
+                'worker_recycles': dict(self.executor.recycles),
+                **self.stats,
+            }
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class KlasikoHTTPHandler(BaseHTTPRequestHandler):
+    """
+    HTTP front end: POST /render returns a PDF, GET /health reports pool state
+    and GET /metrics exports Prometheus metrics.
+
+    /render accepts either a JSON object (see http_render_options()) or a raw
+    Markdown body (Content-Type text/markdown or text/plain) with the options
+    as query parameters, e.g. /render?theme=clean&toc=1.
+    """
+
+    server_version = 'klasiko'
+    service = None  # RenderService, set by serve_http()
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == '/health':
+            self._send_json(200, self.service.health())
+        elif path == '/metrics':
+            self.send_response(200)
+            self._send_body('text/plain; version=0.0.4; charset=utf-8', METRICS.render().encode('utf-8'))
+        else:
+            self._send_json(404, {'error': 'Not found. Use POST /render, GET /health or GET /metrics'})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/render':
+            self._send_json(404, {'error': 'Not found. Use POST /render or GET /health'})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        if length <= 0:
+            self._send_json(411, {'error': 'A request body with Content-Length is required'})
+            return
+        if length > HTTP_MAX_BODY:
+            self._send_json(413, {'error': f"Request body exceeds {HTTP_MAX_BODY // (1024 * 1024)} MB"})
+            return
+        body = self.rfile.read(length)
+
+        try:
+            content_type = self.headers.get('Content-Type', 'application/json').split(';')[0].strip().lower()
+            if content_type == 'application/json':
+                payload = json.loads(body.decode('utf-8'))
+                if not isinstance(payload, dict):
+                    raise ValueError("JSON body must be an object")
+            else:
+                payload = {
+                    key: values if key == 'logo_placement' else values[-1]
+                    for key, values in parse_qs(url.query).items()
+                }
+                payload['markdown'] = body.decode('utf-8')
+            options = http_render_options(payload)
+        except (ValueError, UnicodeDecodeError) as e:
+            self._send_json(400, {'error': str(e)})
+            return
+
+        future = self.service.submit(options)
+        if future is None:
+            self.send_response(429)
+            self.send_header('Retry-After', '1')
+            self._send_body('application/json', json.dumps({'error': 'Render queue is full, retry later'}).encode())
+            return
+
+        try:
+            pdf_bytes, error, _ = future.result()
+        except Exception as e:
+            pdf_bytes, error = None, e
+        if isinstance(error, ValueError):
+            self._send_json(400, {'error': str(error)})
+            return
+        if error is not None:
+            self._send_json(500, {'error': f"Render failed: {error}"})
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Disposition', 'inline; filename="document.pdf"')
+        self._send_body('application/pdf', pdf_bytes)
+
+    def _send_json(self, status, data):
+        self.send_response(status)
+        self._send_body('application/json', json.dumps(data).encode('utf-8'))
+
+    def _send_body(self, content_type, body):
+        """Finish the headers and stream the body in chunks."""
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        view = memoryview(body)
+        try:
+            for offset in range(0, len(body), HTTP_CHUNK_SIZE):
+                self.wfile.write(view[offset:offset + HTTP_CHUNK_SIZE])
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client went away; the render is still shared with others
+
+    def log_message(self, format, *args):
+        print(f"  {self.address_string()} {format % args}", flush=True)
+
+
+def serve_http(host='127.0.0.1', port=8000, jobs=None, max_queue=8, warm_theme='warm', worker_limits=None):
+    """
+    Run the HTTP rendering service until interrupted.
+
+    Args:
+        host (str): Interface to bind (default: localhost only)
+        port (int): Port to listen on
+        jobs (int): Render worker processes (default: CPU count)
+        max_queue (int): Distinct renders allowed to wait before answering 429
+        warm_theme (str): Theme workers preload
+        worker_limits (dict): Recycling limits from worker_limit_options()
+    """
+    service = RenderService(jobs=jobs, max_queue=max_queue, warm_theme=warm_theme, worker_limits=worker_limits)
+    handler = type('Handler', (KlasikoHTTPHandler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+
+    print(f"\n{'='*60}")
+    print(f"🌐 Serving on http://{host}:{server.server_address[1]} ({service.jobs} workers, queue {max_queue})")
+    print(f"   POST /render  (JSON or text/markdown)   GET /health   GET /metrics")
+    print(f"{'='*60}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n⏹  Stopped")
+    finally:
+        server.server_close()
+        service.close()
+
+
+def http_main(argv):
+    """Command line entry point for `klasiko http`."""
+    parser = argparse.ArgumentParser(
+        prog='klasiko http',
+        description='Serve PDF rendering over HTTP: POST Markdown to /render, get a PDF back'
+    )
+    parser.add_argument(
+        '--host',
+        default='127.0.0.1',
+        help='Interface to bind (default: 127.0.0.1)'
+    )
+    parser.add_argument(
+        '--port',
+        type=int,
+        default=8000,
+        help='Port to listen on (default: 8000)'
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        help='Render worker processes (default: CPU count)'
+    )
+    parser.add_argument(
+        '--max-queue',
+        type=int,
+        default=8,
+        help='Renders allowed to wait for a worker before requests get 429 (default: 8)'
+    )
+    parser.add_argument(
+        '--warm-theme',
+        choices=sorted(available_themes()),
+        default='warm',
+        help='Theme workers preload at startup (default: warm)'
+    )
+    add_worker_limit_arguments(parser)
+    args = parser.parse_args(argv)
+
+    try:
+        serve_http(args.host, args.port, jobs=args.jobs, max_queue=args.max_queue, warm_theme=args.warm_theme,
+                   worker_limits=worker_limit_options(args))
+    except OSError as e:
+        print(f"✗ Server Error: {e}")
+        return 1
+    return 0
+
+
+def add_worker_limit_arguments(parser):
+    """
+    Add the options that recycle worker processes in batch and service modes.
+
+    Args:
+        parser (argparse.ArgumentParser): Parser to extend
+    """
+    parser.add_argument(
+        '--max-jobs-per-worker',
+        type=int,
+        help='Replace each worker process after this many documents'
+    )
+    parser.add_argument(
+        '--max-worker-rss',
+        dest='max_rss_mb',
+        type=float,
+        help='Replace a worker once its resident memory exceeds this many MB'
+    )
+    parser.add_argument(
+        '--worker-memory-limit',
+        dest='memory_limit_mb',
+        type=float,
+        help='Hard address-space limit per worker in MB; a render that exceeds it fails and the worker is replaced (POSIX only)'
+    )
+
+
+def worker_limit_options(args):
+    """Collect add_worker_limit_arguments() values as RecyclingProcessPool keyword arguments."""
+    return {
+        'max_jobs_per_worker': args.max_jobs_per_worker,
+        'max_rss_mb': args.max_rss_mb,
+        'memory_limit_mb': args.memory_limit_mb,
+    }
+
+
+def add_document_style_arguments(parser):
+    """
+    Add the options that control a document's look (theme, TOC, CSS, logo, metadata).
+
+    Shared by the main command and subcommands that render documents.
+
+    Args:
+        parser (argparse.ArgumentParser): Parser to extend
+    """
+    parser.add_argument(
+        '--toc',
+        action='store_true',
+        help='Generate table of contents'
+    )
+
+    parser.add_argument(
+        '--css',
+        dest='custom_css',
+        help='Path to custom CSS file or inline CSS string'
+    )
+
+    parser.add_argument(
+        '--theme',
+        choices=sorted(available_themes()),
+        default='warm',
+        help='Visual theme for PDF output (default: warm). Add themes as <name>.css in ~/.klasiko/themes'
+    )
+
+    parser.add_argument(
+        '--author',
+        help='PDF author metadata'
+    )
+
+    parser.add_argument(
+        '--subject',
+        help='PDF subject metadata'
+    )
+
+    parser.add_argument(
+        '--keywords',
+        help='PDF keywords metadata (comma-separated)'
+    )
+
+    parser.add_argument(
+        '--logo',
+        dest='logo_path',
+        help='Path to company logo file (PNG, SVG, JPG/JPEG) for branding'
+    )
+
+    parser.add_argument(
+        '--logo-placement',
+        dest='logo_placements',
+        action='append',
+        help='Logo placement in format "position:size" (e.g., "header:small"). Can be used multiple times for different placements.'
+    )
+
+    # Keep old arguments for backward compatibility
+    parser.add_argument(
+        '--logo-position',
+        dest='logo_position',
         choices=['header', 'footer', 'both', 'watermark', 'title', 'all'],
         help='(Deprecated) Use --logo-placement instead. Logo placement (default: header)'
     )
@@ -2201,8 +6786,20 @@ Features:
         help='(Deprecated) Use --logo-placement instead. Logo size (default: medium)'
     )
 
-    args = parser.parse_args()
 
+def document_style_options(args):
+    """
+    Turn parsed style arguments into convert_md_to_pdf() keyword arguments.
+
+    Loads the logo (exiting on an invalid logo file) and resolves the
+    deprecated --logo-position/--logo-size pair.
+
+    Args:
+        args (argparse.Namespace): Arguments from add_document_style_arguments()
+
+    Returns:
+        dict: enable_toc, custom_css, metadata, theme, logo_data_uri, logo_placements
+    """
     # Build metadata dictionary
     metadata = {}
     if args.author:
@@ -2219,15 +6816,7 @@ Features:
     logo_placements = []
     if args.logo_placements:
         # New format: --logo-placement "header:small" --logo-placement "footer:medium"
-        for placement_str in args.logo_placements:
-            try:
-                if ':' in placement_str:
-                    position, size = placement_str.split(':', 1)
-                    logo_placements.append({'position': position.strip(), 'size': size.strip()})
-                else:
-                    print(f"Warning: Invalid logo placement format: {placement_str}. Use 'position:size'")
-            except ValueError:
-                print(f"Warning: Invalid logo placement format: {placement_str}. Use 'position:size'")
+        logo_placements = parse_logo_placements(args.logo_placements)
     elif args.logo_position:
         # Backward compatibility: old --logo-position --logo-size format
         logo_placements.append({
@@ -2235,21 +6824,363 @@ Features:
             'size': args.logo_size or 'medium'
         })
 
+    return {
+        'enable_toc': args.toc,
+        'custom_css': args.custom_css,
+        'metadata': metadata if metadata else None,
+        'theme': args.theme,
+        'logo_data_uri': logo_data_uri,
+        'logo_placements': logo_placements,
+    }
+
+
+def main():
+    """Main function to handle command line arguments and execute conversion."""
+    # Subcommands take over before the single-document parser
+    subcommands = {
+        'build': build_main,
+        'themes': themes_main,
+        'merge': merge_main,
+        'queue': queue_main,
+        'http': http_main,
+        'analyze': analyze_main,
+    }
+    if len(sys.argv) > 1 and sys.argv[1] in subcommands:
+        sys.exit(subcommands[sys.argv[1]](sys.argv[2:]))
+
+    parser = argparse.ArgumentParser(
+        description='Convert Markdown files to styled PDF documents with professional formatting',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  %(prog)s document.md
+  %(prog)s input.md -o output.pdf
+  %(prog)s document.md --toc --author "John Doe"
+  %(prog)s document.md --theme rustic --toc
+
+Logo Branding [NEW v2.1]:
+  # Single position (old format - still works)
+  %(prog)s doc.md --logo logo.png --logo-position header --logo-size medium
+
+  # Multi-position with different sizes
+  %(prog)s doc.md --logo logo.png --logo-placement "title:large" --logo-placement "header:small"
+
+  # Professional report: Large cover logo + small header
+  %(prog)s report.md --logo brand.svg --logo-placement "title:large" --logo-placement "header:small" --theme warm
+
+  # Maximum branding: Title + header/footer + watermark
+  %(prog)s proposal.md --logo company.png --logo-placement "title:medium" --logo-placement "both:small" --logo-placement "watermark:medium"
+
+Proofing:
+  # Write only the title page and first chapter
+  %(prog)s manual.md --pages 1-5
+
+  # Quick draft: image placeholders, no logos, no font subsetting
+  %(prog)s manual.md --draft -o manual-draft.pdf
+
+Watch Mode:
+  # Rebuild on every save; unchanged Markdown blocks are not reparsed
+  %(prog)s manual.md --watch
+
+  # Also reuse the layout of unchanged sections (near-instant rebuilds of long manuals)
+  %(prog)s manual.md --watch --section-cache
+
+Variants:
+  # 2 themes x 2 logo treatments = 4 PDFs from one parse (proposal-warm-title-large.pdf, ...)
+  %(prog)s proposal.md --logo brand.png --variants "theme=warm,rustic x logo=title:large|title:large+header:small"
+
+Output Formats:
+  # PDF, per-page PNGs at 150 DPI, a cover thumbnail and a text extract in one pass
+  %(prog)s report.md --formats pdf,png,cover,txt --resolution 150
+
+Mail Merge:
+  # One PDF per CSV row; the template uses {{ name }}, {{ balance }}, ...
+  %(prog)s merge statement.md customers.csv -o "out/statement-{{ customer_id }}.pdf" --jobs 8
+
+Job Queue:
+  # Enqueue overnight conversions, then drain them with 4 crash-safe workers
+  %(prog)s queue add reports/*.md --theme clean --toc
+  %(prog)s queue drain --jobs 4
+  %(prog)s queue status
+
+HTTP Service:
+  # Render on demand: POST Markdown (or JSON with options) to /render
+  %(prog)s http --port 8000 --jobs 4
+  curl --data-binary @doc.md -H "Content-Type: text/markdown" "localhost:8000/render?theme=clean&toc=1" -o doc.pdf
+
+Performance:
+  # Parse with only the extensions the document uses (identical HTML)
+  %(prog)s document.md --fast-parse
+
+  # Parse with markdown-it-py, a faster CommonMark parser
+  %(prog)s document.md --parser markdown-it
+
+  # Proof copy of a very long document in seconds (fixed layout, no theme CSS)
+  %(prog)s manual.md --renderer draft
+
+  # Draw logos and watermark once and stamp them under every page
+  %(prog)s manual.md --logo logo.png --logo-placement header:small --logo-placement watermark:large --stamp
+
+  # Linearized PDF for a web portal: page one shows before the download ends
+  %(prog)s manual.md --linearize
+
+Build Manifest:
+  # Rebuild only the stale documents declared in klasiko.toml, 4 at a time
+  %(prog)s build klasiko.toml --jobs 4
+
+  # Estimate render cost per document (builds and queues start the largest first)
+  %(prog)s analyze docs/*.md --toc
+
+Themes:
+  default - Clean white paper with neutral colors (original style)
+  warm    - Warm neutral tones with vintage typography (new default)
+  rustic  - Aged paper with coffee browns and ornamental elements
+
+Features:
+  - Three visual themes for different aesthetics
+  - Multi-position logo branding with individual sizes [NEW v2.1]
+  - Footnote support with [^1] syntax
+  - Table of contents generation
+  - Unicode support for international characters
+  - Custom CSS styling
+  - PDF metadata (author, subject, keywords)
+  - Professional document formatting
+        """
+    )
+
+    parser.add_argument(
+        'input_file',
+        help='Path to the input Markdown file (.md)'
+    )
+
+    parser.add_argument(
+        '-o', '--output',
+        dest='output_file',
+        help='Path to the output PDF file (default: same as input with .pdf extension)'
+    )
+
+    add_document_style_arguments(parser)
+
+    parser.add_argument(
+        '--pages',
+        help='Only write these pages, e.g. "1-5" or "1,3,10-" (layout still covers the whole document)'
+    )
+
+    parser.add_argument(
+        '--draft',
+        action='store_true',
+        help='Fast proof output: image placeholders, no logos or watermark, no font subsetting'
+    )
+
+    parser.add_argument(
+        '--renderer',
+        choices=list(PDF_RENDERERS),
+        default=DEFAULT_RENDERER,
+        help='PDF renderer (default: weasyprint). draft skips WeasyPrint for a fixed-layout proof in Helvetica '
+             'without the theme CSS, images or logos: seconds for thousand-page documents (pdf and txt only)'
+    )
+
+    parser.add_argument(
+        '--stamp',
+        action='store_true',
+        help='Draw the page background, header/footer logos and watermark once and stamp them under every page '
+             'after layout, instead of laying them out on each page (needs pikepdf)'
+    )
+
+    parser.add_argument(
+        '--linearize',
+        action='store_true',
+        help='Write a linearized ("fast web view") PDF that browsers can show before the whole file has '
+             'downloaded, checked after writing (needs pikepdf)'
+    )
+
+    parser.add_argument(
+        '--formats',
+        default='pdf',
+        help='Comma-separated outputs from one layout pass: pdf, png (every page), cover (thumbnail), txt (default: pdf)'
+    )
+
+    parser.add_argument(
+        '--resolution',
+        type=int,
+        default=96,
+        help='Resolution in DPI for png output (default: 96)'
+    )
+
+    parser.add_argument(
+        '--watch',
+        action='store_true',
+        help='Keep running and convert again whenever the input file is saved (only edited blocks are reparsed)'
+    )
+
+    parser.add_argument(
+        '--fast-parse',
+        action='store_true',
+        help='Load only the Markdown extensions the document uses (same HTML, less parsing work)'
+    )
+
+    parser.add_argument(
+        '--parser',
+        choices=list(MARKDOWN_BACKENDS),
+        default=DEFAULT_MARKDOWN_BACKEND,
+        help='Markdown parser (default: python-markdown). markdown-it is a faster CommonMark parser '
+             'without abbreviations, attribute lists or Markdown inside HTML (pip install markdown-it-py mdit-py-plugins)'
+    )
+
+    parser.add_argument(
+        '--section-cache',
+        action='store_true',
+        help='With --watch: lay out each section separately and reuse the sections that did not change. '
+             'A section is reused only if its first page number is unchanged, so an edit that changes an early '
+             'section\'s page count lays out every later section again. CSS using counter(pages) or :nth() pages '
+             'turns it off (the document is laid out whole)'
+    )
+
+    parser.add_argument(
+        '--variants',
+        help='Render a matrix of variants from one parse, e.g. "theme=warm,rustic x logo=title:large|header:small"'
+    )
+
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        help='Parallel worker processes for --variants (default: CPU count)'
+    )
+
+    add_worker_limit_arguments(parser)
+
+    parser.add_argument(
+        '--metrics-file',
+        help='Write Prometheus metrics here at the end of the run (node_exporter textfile collector)'
+    )
+
+    parser.add_argument(
+        '--progress',
+        choices=['text', 'jsonl'],
+        default='text',
+        help='Progress output: human-readable text, or one JSON event per line on stdout (text then goes to stderr)'
+    )
+
+    args = parser.parse_args()
+
+    if args.pages:
+        try:
+            parse_page_ranges(args.pages)
+        except ValueError as e:
+            parser.error(str(e))
+
+    formats = [fmt.strip().lower() for fmt in args.formats.split(',') if fmt.strip()]
+    unknown_formats = [fmt for fmt in formats if fmt not in OUTPUT_FORMATS]
+    if unknown_formats or not formats:
+        parser.error(f"--formats must list any of: {', '.join(OUTPUT_FORMATS)}")
+    # The draft renderer writes its own text; WeasyPrint's is read back from the PDF
+    needs_pdfium = 'png' in formats or 'cover' in formats or ('txt' in formats and args.renderer == DEFAULT_RENDERER)
+    if needs_pdfium and not PDFIUM_AVAILABLE:
+        parser.error("png, cover and txt output require pypdfium2. Install with: pip install pypdfium2")
+    if args.watch and args.variants:
+        parser.error("--watch converts a single document and can't be combined with --variants")
+    if args.fast_parse and (args.watch or args.variants):
+        parser.error("--fast-parse applies to single conversions; --watch and --variants reparse only edited blocks")
+    if args.parser != DEFAULT_MARKDOWN_BACKEND:
+        if args.watch or args.variants:
+            parser.error("--parser applies to single conversions; --watch and --variants use python-markdown")
+        try:
+            get_markdown_backend(args.parser)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.stamp:
+        if not PIKEPDF_AVAILABLE:
+            parser.error("--stamp requires pikepdf. Install with: pip install pikepdf")
+        if args.variants or args.renderer != DEFAULT_RENDERER:
+            parser.error("--stamp applies to WeasyPrint conversions and can't be combined with --variants or --renderer draft")
+    if args.linearize:
+        if not PIKEPDF_AVAILABLE:
+            parser.error("--linearize requires pikepdf. Install with: pip install pikepdf")
+        if args.variants:
+            parser.error("--linearize post-processes a single PDF output and can't be combined with --variants")
+        if 'pdf' not in formats:
+            parser.error("--linearize needs pdf in --formats")
+    if args.renderer != DEFAULT_RENDERER:
+        if args.variants or args.section_cache:
+            parser.error("--renderer draft can't be combined with --variants or --section-cache, which lay out with WeasyPrint")
+        unsupported = [fmt for fmt in formats if fmt not in PDF_RENDERERS[args.renderer].formats]
+        if unsupported:
+            parser.error(f"the {args.renderer} renderer writes only: {', '.join(PDF_RENDERERS[args.renderer].formats)}")
+    if args.section_cache and not args.watch:
+        parser.error("--section-cache keeps laid-out sections in memory between rebuilds and needs --watch")
+    if args.progress == 'jsonl' and args.variants:
+        parser.error("--progress jsonl reports a single conversion and can't be combined with --variants")
+
+    # JSON events own stdout; the human-readable banners move to stderr
+    progress = None
+    if args.progress == 'jsonl':
+        progress = JsonlProgress(sys.stdout)
+        sys.stdout = sys.stderr
+
+    style = document_style_options(args)
+
+    if args.variants:
+        try:
+            variants = parse_variant_matrix(args.variants)
+        except ValueError as e:
+            parser.error(str(e))
+
+        success = convert_md_to_pdf_variants(
+            args.input_file,
+            args.output_file,
+            variants,
+            pages=args.pages,
+            draft=args.draft,
+            formats=formats,
+            resolution=args.resolution,
+            jobs=args.jobs,
+            worker_limits=worker_limit_options(args),
+            **style
+        )
+        write_metrics_file(args.metrics_file)
+        sys.exit(0 if success else 1)
+
+    if args.watch:
+        status = watch_and_convert(
+            args.input_file,
+            args.output_file,
+            pages=args.pages,
+            draft=args.draft,
+            formats=formats,
+            resolution=args.resolution,
+            progress=progress,
+            section_cache=args.section_cache,
+            renderer=args.renderer,
+            stamp=args.stamp,
+            linearize=args.linearize,
+            **style
+        )
+        write_metrics_file(args.metrics_file)
+        sys.exit(status)
+
     # Convert the files
     success = convert_md_to_pdf(
         args.input_file,
         args.output_file,
-        enable_toc=args.toc,
-        custom_css=args.custom_css,
-        metadata=metadata if metadata else None,
-        theme=args.theme,
-        logo_data_uri=logo_data_uri,
-        logo_placements=logo_placements
+        pages=args.pages,
+        draft=args.draft,
+        formats=formats,
+        resolution=args.resolution,
+        progress=progress,
+        fast_parse=args.fast_parse,
+        parser_backend=args.parser,
+        renderer=args.renderer,
+        stamp=args.stamp,
+        linearize=args.linearize,
+        **style
     )
+    write_metrics_file(args.metrics_file)
 
     # Exit with appropriate code
     sys.exit(0 if success else 1)
 
 
 if __name__ == "__main__":
+    # Needed for parallel builds in frozen (PyInstaller) executables
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
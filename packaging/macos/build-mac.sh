@@ -70,6 +70,14 @@ echo -e "${YELLOW}[4/5]${NC} Building Klasiko.app with PyInstaller..."
 echo "  → This may take several minutes..."
 echo ""
 
+# Validate and minify the theme stylesheets bundled into the app
+if ! python klasiko.py themes --compile; then
+    echo -e "${RED}  ✗ Theme compilation failed${NC}"
+    deactivate
+    exit 1
+fi
+echo ""
+
 if pyinstaller klasiko-macos.spec; then
     echo ""
     echo -e "${GREEN}  ✓ Build completed successfully${NC}"
@@ -104,6 +104,13 @@ Write-Step 4 5 "Building klasiko.exe with PyInstaller..."
 Write-Info "This may take several minutes..."
 Write-Host ""
 
+# Validate and minify the theme stylesheets bundled into the executable
+& $VenvPython klasiko.py themes --compile | Out-Host
+if ($LASTEXITCODE -ne 0) {
+    Write-Error-Custom "Theme compilation failed"
+    exit 1
+}
+
 # Change to packaging/windows directory to use relative paths in spec file
 Set-Location "packaging\windows"
 
@@ -33,6 +33,11 @@ all_datas += pyphen_datas
 all_datas += tinycss2_datas
 all_datas += cairocffi_datas
 
+# Theme stylesheets (precompiled by `python klasiko.py themes --compile`)
+all_datas += [
+    ('../../themes/*.css', 'themes'),
+]
+
 a = Analysis(
     ['../../klasiko.py'],  # Relative path from packaging/windows/
     pathex=[],
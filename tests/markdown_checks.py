@@ -0,0 +1,245 @@
+"""
+Markdown corpora and checks comparing klasiko's faster conversion paths
+(incremental, --fast-parse, other parser backends, lexer lookup) with a full
+Python-Markdown conversion.
+
+Used by the tests and by tools/bench.py.
+"""
+
+from html.parser import HTMLParser
+
+import markdown
+
+from klasiko import (
+    CODE_LANGUAGE_GUESS, DEFAULT_MARKDOWN_BACKEND, MARKDOWN_EXTENSIONS, IncrementalMarkdownConverter,
+    build_markdown_parser, document_code_options, downgraded_code_blocks, markdown_parser_key, markdown_to_html,
+)
+
+
+SAMPLE_MARKDOWN = """# Sample Report
+
+## Overview
+
+Some *emphasis*, a [reference link][docs] and a footnote.[^1]
+
+| Column | Value |
+|--------|-------|
+| alpha  | 1     |
+| beta   | 2     |
+
+```python
+def greet(name):
+    return f"Hello, {name}"
+```
+
+[docs]: https://example.com/docs
+[^1]: The footnote text.
+"""
+
+
+def code_corpus(blocks=24, lines=60):
+    """
+    Build a code-heavy sample document: fences with a known language,
+    with an unknown one and with none, as generated docs tend to mix them.
+
+    Args:
+        blocks (int): Number of code blocks
+        lines (int): Lines per code block
+
+    Returns:
+        str: Markdown content
+    """
+    samples = {
+        'python': "result = compute(values[{n}], scale={n}) if values else None",
+        'sql': "SELECT id, total FROM orders WHERE customer_id = {n} ORDER BY total DESC;",
+        'pseudo': "for each row {n} in table: emit row",
+        None: "2024-01-01 12:00:{n:02d} INFO worker-{n} processed job {n} in 0.{n}s",
+    }
+    parts = ["# Code Listings\n"]
+    for index in range(blocks):
+        language = list(samples)[index % len(samples)]
+        code = '\n'.join(samples[language].format(n=n % 60) for n in range(lines))
+        parts.append(f"## Listing {index + 1}\n\n```{language or ''}\n{code}\n```\n")
+    return '\n'.join(parts)
+
+
+# Snippets exercising each Markdown construct klasiko supports, named by the
+# construct they cover. The tests check --fast-parse's detect_markdown_extensions()
+# against them (near misses included, which must not change the HTML when an
+# extension is left out) and diff the parser backends on them.
+# 'python_markdown_syntax' marks Python-Markdown readings CommonMark doesn't share.
+MARKDOWN_CORPUS = (
+    ('heading', "# Heading"), ('heading', "Setext heading\n=============="), ('heading', "Setext subheading\n---"),
+    ('rule', "Rule above\n\n---"), ('python_markdown_syntax', "#hashtag in text"),
+    ('inline', "Plain *emphasis*, **strong** and `code`."), ('inline', "Escaped \\| pipe and \\{ brace"),
+    ('inline', "`code | with pipe`"),
+    ('table', "| a | b |\n|---|---|\n| 1 | 2 |"), ('table', "a | b\n--|--\n1 | 2"), ('table', "Just a | pipe in prose"),
+    ('def_list', "Term\n: Definition"), ('python_markdown_syntax', "Term\n\n: Loose definition"),
+    ('def_list', "> Term\n> : Quoted definition"), ('def_list', "Ratio 3: 1 and key: value"),
+    ('abbr', "*[HTML]: Hyper Text Markup Language\n\nHTML abbreviation"),
+    ('footnotes', "Text with a note[^1].\n\n[^1]: The note."),
+    ('fenced_code', "```\nfenced\n```"), ('fenced_code', "~~~python\nx = 1\n~~~"), ('fenced_code', "```{ .sql }\nSELECT 1;\n```"),
+    ('indented_code', "    indented code"), ('indented_code', "\tTab-indented code"),
+    ('indented_code', "> Quote\n>\n>     code in a blockquote"), ('indented_code', "- > Quoted item\n  >\n  >     code"),
+    ('python_markdown_syntax', "* item\n\n        code in a list"),
+    ('html', "<div>raw block</div>"), ('md_in_html', "<div markdown=\"1\">*markdown* inside</div>"),
+    ('html', "Inline <b>html</b> and &amp; entity"), ('html', "<!-- comment -->"),
+    ('attr_list', "Paragraph\n{: .class }"), ('attr_list', "## Heading {#custom-id}"), ('inline', "{not an attribute list}"),
+    ('toc_marker', "[TOC]\n\n## Listed"), ('html', "<h2>Raw heading</h2>"),
+    ('link', "[ref]: https://example.com\n\nA [link][ref]."), ('python_markdown_syntax', "1. one\n2. two\n\n- a\n- b"),
+    ('list', "1. one\n2. two\n\nText\n\n- a\n- b\n    - nested"),
+    ('heading', "## Same\n\n## Same\n\n### Title & `code`"),
+    ('footnotes', "One[^a], two[^b] and one again[^a].\n\n[^a]: First.\n[^b]: Second."),
+    ('table', "| Left | Right |\n|:-----|------:|\n| *x* | `y` |"),
+)
+
+
+def first_difference(html_content, expected_html):
+    """Describe where two HTML strings first differ."""
+    offset = next((i for i, (a, b) in enumerate(zip(html_content, expected_html)) if a != b),
+                  min(len(html_content), len(expected_html)))
+    return (f"HTML differs at offset {offset}: "
+            f"{html_content[offset:offset + 60]!r} != {expected_html[offset:offset + 60]!r}")
+
+
+def check_incremental_conversion(markdown_content, enable_toc=False, converter=None):
+    """
+    Check that IncrementalMarkdownConverter matches a full conversion.
+
+    Args:
+        markdown_content (str): Raw Markdown content
+        enable_toc (bool): Whether to generate table of contents
+        converter (IncrementalMarkdownConverter): Converter to check, with its
+            cache from earlier versions of the document (default: a new one)
+
+    Returns:
+        list: Descriptions of the differences (empty when they match)
+    """
+    converter = converter or IncrementalMarkdownConverter()
+    html_content, md_instance = converter.convert(markdown_content, enable_toc)
+    expected_html, expected = markdown_to_html(markdown_content, enable_toc)
+
+    differences = []
+    if html_content != expected_html:
+        differences.append(first_difference(html_content, expected_html))
+    if md_instance.toc != expected.toc:
+        differences.append("Table of contents differs")
+    if md_instance.toc_tokens != expected.toc_tokens:
+        differences.append("TOC tokens differ")
+    return differences
+
+
+def check_fast_parse(markdown_content, enable_toc=False):
+    """
+    Compare a fast parse with a full one.
+
+    Args:
+        markdown_content (str): Raw Markdown content
+        enable_toc (bool): Whether to generate table of contents
+
+    Returns:
+        list: Descriptions of the differences (empty when they match)
+    """
+    expected_html, expected = markdown_to_html(markdown_content, enable_toc)
+    html_content, md_instance = markdown_to_html(markdown_content, enable_toc, fast_parse=True)
+    differences = []
+    if html_content != expected_html:
+        differences.append(first_difference(html_content, expected_html))
+    if enable_toc and md_instance.toc != expected.toc:
+        differences.append("table of contents differs")
+    return differences
+
+
+class _HtmlOutline(HTMLParser):
+    """Reduce HTML to what the theme CSS sees: tags with their id, class and link attributes, and text."""
+
+    ATTRIBUTES = ('class', 'href', 'id', 'src', 'title')
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.items = []
+
+    def handle_starttag(self, tag, attrs):
+        kept = ''.join(f' {name}="{value}"' for name, value in sorted(attrs) if name in self.ATTRIBUTES)
+        self.items.append(f'<{tag}{kept}>')
+
+    handle_startendtag = handle_starttag
+
+    def handle_endtag(self, tag):
+        self.items.append(f'</{tag}>')
+
+    def handle_data(self, data):
+        text = ' '.join(data.split())
+        if text:
+            self.items.append(text)
+
+
+def html_outline(html_content):
+    """
+    Normalise HTML for comparing backends, ignoring whitespace between tags,
+    attribute order and attributes the themes don't select on.
+
+    Args:
+        html_content (str): HTML fragment
+
+    Returns:
+        list: Start tags, end tags and whitespace-collapsed text, in document order
+    """
+    outline = _HtmlOutline()
+    outline.feed(html_content)
+    outline.close()
+    return outline.items
+
+
+def check_markdown_backend(markdown_content, parser_backend, enable_toc=False):
+    """
+    Compare a backend's conversion with Python-Markdown's.
+
+    Args:
+        markdown_content (str): Raw Markdown content
+        parser_backend (str): Backend name from MARKDOWN_BACKENDS
+        enable_toc (bool): Whether to generate table of contents
+
+    Returns:
+        list: Descriptions of the differences (empty when they match)
+    """
+    expected_html, expected = markdown_to_html(markdown_content, enable_toc, parser_backend=DEFAULT_MARKDOWN_BACKEND)
+    html_content, md_instance = markdown_to_html(markdown_content, enable_toc, parser_backend=parser_backend)
+    differences = []
+    outline, expected_outline = html_outline(html_content), html_outline(expected_html)
+    if outline != expected_outline:
+        index = next((i for i, (a, b) in enumerate(zip(outline, expected_outline)) if a != b),
+                     min(len(outline), len(expected_outline)))
+        found = outline[index] if index < len(outline) else 'end of document'
+        wanted = expected_outline[index] if index < len(expected_outline) else 'end of document'
+        differences.append(f"HTML differs at item {index}: {found!r} != {wanted!r}")
+    if html_outline(md_instance.toc) != html_outline(expected.toc):
+        differences.append("table of contents differs")
+    return differences
+
+
+def check_code_highlighting(markdown_content):
+    """
+    Check that klasiko's lexer lookup gives the same HTML as codehilite with
+    the same language guessing setting.
+
+    Args:
+        markdown_content (str): Raw Markdown content
+
+    Returns:
+        list: Descriptions of the differences (empty when they match)
+    """
+    code_options = document_code_options(markdown_content)
+    klasiko_html = build_markdown_parser(markdown_parser_key(code_options=code_options)).convert(markdown_content)
+
+    # With a default language, or blocks over the size limits, klasiko's HTML
+    # differs from codehilite's by design
+    if code_options[0] not in (None, CODE_LANGUAGE_GUESS) or downgraded_code_blocks(klasiko_html):
+        return []
+
+    codehilite = markdown.Markdown(
+        extensions=list(MARKDOWN_EXTENSIONS) + ['codehilite'],
+        extension_configs={'codehilite': {'guess_lang': code_options[0] == CODE_LANGUAGE_GUESS}}
+    )
+    expected_html = codehilite.convert(markdown_content)
+    return [] if klasiko_html == expected_html else [first_difference(klasiko_html, expected_html)]
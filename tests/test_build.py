@@ -0,0 +1,34 @@
+"""`klasiko build` must notice every change that affects an output."""
+
+import pytest
+
+import klasiko
+
+
+@pytest.fixture
+def target(tmp_path, monkeypatch):
+    user_themes = tmp_path / 'user-themes'
+    user_themes.mkdir()
+    (user_themes / 'house.css').write_text('body { color: #111; }', encoding='utf-8')
+    monkeypatch.setattr(klasiko, 'get_user_theme_dir', lambda: user_themes)
+    (tmp_path / 'doc.md').write_text('# Doc\n\nBody', encoding='utf-8')
+    (tmp_path / 'klasiko.toml').write_text('[[document]]\ninput = "doc.md"\ntheme = "house"\n', encoding='utf-8')
+    targets, _ = klasiko.load_build_manifest(tmp_path / 'klasiko.toml')
+    return targets[0]
+
+
+def test_theme_stylesheet_is_a_dependency(target, tmp_path):
+    theme_file = tmp_path / 'user-themes' / 'house.css'
+    assert theme_file in klasiko.collect_target_dependencies(target)
+
+    before = klasiko.fingerprint_file(theme_file)
+    theme_file.write_text('body { color: #222; }', encoding='utf-8')
+    assert klasiko.fingerprint_file(theme_file, before)['sha256'] != before['sha256']
+
+
+@pytest.mark.parametrize('version', ['__version__', 'WEASYPRINT_VERSION'])
+def test_upgrade_changes_the_signature(target, monkeypatch, version):
+    signature = klasiko.target_options_signature(target)
+    assert klasiko.target_options_signature(target) == signature
+    monkeypatch.setattr(klasiko, version, '999.0')
+    assert klasiko.target_options_signature(target) != signature
@@ -0,0 +1,224 @@
+"""The HTTP render service: option checks, shared renders, back-pressure, /health and URL fetching."""
+
+import base64
+import io
+import json
+import struct
+import threading
+import time
+import urllib.error
+import urllib.request
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import klasiko
+
+
+def tiny_png():
+    """A 1x1 PNG, written by hand so the test needs no imaging library."""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', 1, 1, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(b'\x00\xff\x00\x00')) + chunk(b'IEND', b''))
+
+
+@pytest.fixture
+def service():
+    service = klasiko.RenderService(jobs=1, max_queue=2, warm_theme=None)
+    yield service
+    service.close()
+
+
+@pytest.fixture
+def service_url(service):
+    handler = type('Handler', (klasiko.KlasikoHTTPHandler,), {'service': service})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def render_request(service_url, markdown):
+    return urllib.request.Request(
+        f"{service_url}/render", data=json.dumps({'markdown': markdown}).encode('utf-8'),
+        headers={'Content-Type': 'application/json'}
+    )
+
+
+def render_over_http(service_url, markdown):
+    with urllib.request.urlopen(render_request(service_url, markdown), timeout=120) as response:
+        assert response.headers['Content-Type'] == 'application/pdf'
+        return response.read()
+
+
+def image_count(pdf_bytes):
+    pypdf = pytest.importorskip('pypdf')
+    return sum(len(page.images) for page in pypdf.PdfReader(io.BytesIO(pdf_bytes)).pages)
+
+
+def test_file_attachment_is_refused(service_url, tmp_path):
+    pypdf = pytest.importorskip('pypdf')
+    secret = tmp_path / 'secret.txt'
+    secret.write_text('server secret')
+    markdown = f'# Report\n\n<link rel="attachment" href="{secret.as_uri()}">\n\nBody text.\n'
+
+    # A trusted local render embeds the file, so the service is what refuses it
+    trusted = klasiko.render_markdown_to_pdf(markdown)
+    assert pypdf.PdfReader(io.BytesIO(trusted)).attachments
+
+    served = render_over_http(service_url, markdown)
+    assert not pypdf.PdfReader(io.BytesIO(served)).attachments
+    assert b'server secret' not in served
+
+
+def test_file_image_is_refused(service_url, tmp_path):
+    image = tmp_path / 'private.png'
+    image.write_bytes(tiny_png())
+    markdown = f'# Report\n\n![private]({image.as_uri()})\n'
+
+    assert image_count(klasiko.render_markdown_to_pdf(markdown)) == 1
+    assert image_count(render_over_http(service_url, markdown)) == 0
+
+
+def test_data_uri_image_is_allowed(service_url):
+    data_uri = 'data:image/png;base64,' + base64.b64encode(tiny_png()).decode('ascii')
+    assert image_count(render_over_http(service_url, f'# Report\n\n![inline]({data_uri})\n')) == 1
+
+
+def test_data_url_fetcher_refuses_other_schemes():
+    fetcher = klasiko.data_url_fetcher()
+    for url in ('file:///etc/passwd', 'http://10.0.0.1/internal.css', 'https://example.com/logo.png'):
+        with pytest.raises(ValueError):
+            fetcher(url)
+
+
+@pytest.mark.parametrize('payload', [
+    {'markdown': 'x', 'theme': ['warm']},
+    {'markdown': 'x', 'theme': 'no-such-theme'},
+    {'markdown': 'x', 'css': 5},
+    {'markdown': 'x', 'logo_placement': [1]},
+    {'markdown': 'x', 'logo_placement': {'header': 'small'}},
+    {'markdown': 'x', 'logo_placement': 'header'},
+    {'markdown': 'x', 'pages': ['1-2']},
+    {'markdown': 'x', 'author': {'name': 'A'}},
+    {'markdown': 'x', 'toc': 'maybe'},
+    {'markdown': 'x', 'draft': 2},
+], ids=lambda payload: ','.join(key for key in payload if key != 'markdown'))
+def test_malformed_options_get_400(service_url, payload):
+    request = urllib.request.Request(
+        f"{service_url}/render", data=json.dumps(payload).encode('utf-8'), headers={'Content-Type': 'application/json'}
+    )
+    with pytest.raises(urllib.error.HTTPError) as raised:
+        urllib.request.urlopen(request, timeout=10)
+    assert raised.value.code == 400
+    assert json.loads(raised.value.read())['error']
+
+
+def test_flags_accept_true_and_false_spellings():
+    options = klasiko.http_render_options({'markdown': 'x', 'toc': 'Yes', 'draft': 0, 'pages': 3})
+    assert options['enable_toc'] is True
+    assert options['draft'] is False
+    assert options['pages'] == '3'
+
+
+class HeldRenders(ThreadPoolExecutor):
+    """Stands in for the worker pool, holding every render until released."""
+
+    recycles = {}
+
+    def __init__(self):
+        super().__init__(max_workers=8)
+        self.release = threading.Event()
+
+    def submit(self, function, options):
+        def held():
+            self.release.wait(30)
+            return b'%PDF-held ' + options['markdown_content'].encode('utf-8'), None, {}
+        return super().submit(held)
+
+
+@pytest.fixture
+def held_service(service):
+    service.executor.shutdown(wait=False)
+    service.executor = HeldRenders()
+    yield service
+    service.executor.release.set()
+
+
+def post_async(service_url, markdown, results):
+    def post():
+        try:
+            with urllib.request.urlopen(render_request(service_url, markdown), timeout=30) as response:
+                results.append((response.status, response.read()))
+        except urllib.error.HTTPError as e:
+            results.append((e.code, e.read()))
+
+    thread = threading.Thread(target=post)
+    thread.start()
+    return thread
+
+
+def wait_for(condition):
+    deadline = time.time() + 10
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_identical_requests_share_one_render(held_service, service_url):
+    results = []
+    threads = [post_async(service_url, 'same document', results) for _ in range(3)]
+    wait_for(lambda: held_service.stats['coalesced'] == 2)
+    assert held_service.health()['in_flight'] == 1
+
+    held_service.executor.release.set()
+    for thread in threads:
+        thread.join(30)
+    assert results == [(200, b'%PDF-held same document')] * 3
+    wait_for(lambda: held_service.stats['rendered'] == 1)
+
+
+def test_saturated_service_answers_429(held_service, service_url):
+    results = []
+    capacity = held_service.jobs + held_service.max_queue
+    threads = [post_async(service_url, f'document {n}', results) for n in range(capacity)]
+    wait_for(lambda: held_service.health()['in_flight'] == capacity)
+
+    with pytest.raises(urllib.error.HTTPError) as raised:
+        urllib.request.urlopen(render_request(service_url, 'one too many'), timeout=10)
+    assert raised.value.code == 429
+    assert raised.value.headers['Retry-After'] == '1'
+    assert held_service.stats['rejected'] == 1
+
+    held_service.executor.release.set()
+    for thread in threads:
+        thread.join(30)
+    assert sorted(status for status, _ in results) == [200] * capacity
+
+
+def test_health_reports_pool_state(held_service, service_url):
+    results = []
+    thread = post_async(service_url, 'in flight', results)
+    wait_for(lambda: held_service.health()['in_flight'] == 1)
+
+    with urllib.request.urlopen(f"{service_url}/health", timeout=10) as response:
+        health = json.loads(response.read())
+    assert health['status'] == 'ok'
+    assert health['workers'] == 1
+    assert health['capacity'] == 3
+    assert health['in_flight'] == 1
+    assert health['rendered'] == 0
+
+    held_service.executor.release.set()
+    thread.join(30)
+    wait_for(lambda: held_service.health()['in_flight'] == 0)
+    with urllib.request.urlopen(f"{service_url}/health", timeout=10) as response:
+        health = json.loads(response.read())
+    assert health['in_flight'] == 0
+    assert health['rendered'] == 1
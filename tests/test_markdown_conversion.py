@@ -0,0 +1,72 @@
+"""Faster conversion paths must give the same HTML as a full Python-Markdown conversion."""
+
+from pathlib import Path
+
+import pytest
+
+import klasiko
+from markdown_checks import (
+    MARKDOWN_CORPUS, SAMPLE_MARKDOWN, check_code_highlighting, check_fast_parse, check_incremental_conversion,
+    check_markdown_backend, code_corpus,
+)
+
+ROOT = Path(__file__).resolve().parent.parent
+DOCUMENTS = {
+    'sample': SAMPLE_MARKDOWN,
+    'corpus': '\n\n'.join(snippet for _, snippet in MARKDOWN_CORPUS),
+    'readme': (ROOT / 'README.md').read_text(encoding='utf-8'),
+    'prd': (ROOT / 'kopi-saigon-prd-comprehensive.md').read_text(encoding='utf-8'),
+}
+SNIPPETS = [pytest.param(snippet, id=f'{construct}-{index}') for index, (construct, snippet) in enumerate(MARKDOWN_CORPUS)]
+
+
+@pytest.mark.parametrize('toc', [False, True], ids=['no-toc', 'toc'])
+@pytest.mark.parametrize('snippet', SNIPPETS)
+def test_fast_parse_matches_full_parse_on_corpus(snippet, toc):
+    assert check_fast_parse(snippet, toc) == []
+
+
+@pytest.mark.parametrize('toc', [False, True], ids=['no-toc', 'toc'])
+@pytest.mark.parametrize('name', DOCUMENTS)
+def test_fast_parse_matches_full_parse_on_documents(name, toc):
+    assert check_fast_parse(DOCUMENTS[name], toc) == []
+
+
+@pytest.mark.parametrize('toc', [False, True], ids=['no-toc', 'toc'])
+@pytest.mark.parametrize('name', DOCUMENTS)
+def test_incremental_conversion_matches_after_edits(name, toc):
+    blocks = klasiko.split_markdown_blocks(DOCUMENTS[name])
+    converter = klasiko.IncrementalMarkdownConverter()
+    assert check_incremental_conversion(DOCUMENTS[name], toc, converter) == []
+    for iteration in range(8):
+        edited = list(blocks)
+        edited[(iteration * 7919) % len(edited)] += f" Edit {iteration}."
+        assert check_incremental_conversion('\n\n'.join(edited), toc, converter) == []
+
+
+def test_incremental_conversion_keeps_last_case_insensitive_reference():
+    # After an edit above it, the [a] definition must not replace the later [A] one
+    document = "See [x][a].\n\n[a]: https://one.example\n\nText\n\n[A]: https://two.example\n"
+    converter = klasiko.IncrementalMarkdownConverter()
+    assert check_incremental_conversion(document, converter=converter) == []
+    assert check_incremental_conversion(document.replace('[x][a]', '[x][A]'), converter=converter) == []
+
+
+@pytest.mark.skipif(not klasiko.MARKDOWN_BACKENDS['markdown-it'].available(), reason='markdown-it-py not installed')
+@pytest.mark.parametrize('toc', [False, True], ids=['no-toc', 'toc'])
+@pytest.mark.parametrize('construct, snippet',
+                         [pytest.param(*entry, id=f'{entry[0]}-{index}') for index, entry in enumerate(MARKDOWN_CORPUS)])
+def test_markdown_it_backend_matches_python_markdown(construct, snippet, toc):
+    if construct in klasiko.MARKDOWN_BACKENDS['markdown-it'].unsupported:
+        pytest.skip(f'markdown-it does not support {construct}')
+    assert check_markdown_backend(snippet, 'markdown-it', toc) == []
+
+
+@pytest.mark.skipif(not klasiko.PYGMENTS_AVAILABLE, reason='Pygments not installed')
+@pytest.mark.parametrize('options', ['', '<!-- klasiko: code-language=auto -->\n\n'], ids=['no-guessing', 'guessing'])
+def test_lexer_lookup_matches_codehilite(options):
+    assert check_code_highlighting(options + code_corpus(blocks=8, lines=10)) == []
+
+
+def test_code_options_in_fenced_examples_are_ignored():
+    assert klasiko.document_code_options(DOCUMENTS['readme']) == klasiko.DEFAULT_CODE_OPTIONS
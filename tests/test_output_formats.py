@@ -0,0 +1,50 @@
+"""Text output is read back from the written PDF, one form-feed-separated block per page."""
+
+import io
+
+import pytest
+
+import klasiko
+
+pikepdf = pytest.importorskip('pikepdf')
+pytest.importorskip('pypdfium2')
+
+
+def text_pdf(*pages):
+    """A PDF with one line of Helvetica text per page."""
+    pdf = pikepdf.new()
+    font = pdf.make_indirect(pikepdf.Dictionary(Type=pikepdf.Name.Font, Subtype=pikepdf.Name.Type1,
+                                                BaseFont=pikepdf.Name.Helvetica))
+    for text in pages:
+        page = pdf.add_blank_page(page_size=(612, 792))
+        page.Resources = pikepdf.Dictionary(Font=pikepdf.Dictionary(F1=font))
+        page.Contents = pdf.make_stream(f"BT /F1 12 Tf 72 700 Td ({text}) Tj ET".encode('latin-1'))
+    buffer = io.BytesIO()
+    pdf.save(buffer)
+    return buffer.getvalue()
+
+
+class WrittenDocument:
+    """Stands in for a laid-out weasyprint.Document."""
+
+    def __init__(self, pdf_bytes):
+        self.pdf_bytes = pdf_bytes
+
+    def write_pdf(self, full_fonts=False):
+        return self.pdf_bytes
+
+
+def test_extract_pdf_text_reads_each_page():
+    pdf_bytes = text_pdf('Hello', 'Page 2 of 2')
+
+    assert klasiko.extract_pdf_text(pdf_bytes) == ['Hello', 'Page 2 of 2']
+    assert klasiko.extract_pdf_text(pdf_bytes, page_indexes=[1]) == ['Page 2 of 2']
+
+
+def test_txt_output_separates_pages_with_form_feeds(tmp_path):
+    output_file = tmp_path / 'report.pdf'
+    written = klasiko.write_output_formats(WrittenDocument(text_pdf('Hello', 'World')), output_file, ['txt'])
+
+    assert written == [tmp_path / 'report.txt']
+    assert (tmp_path / 'report.txt').read_text(encoding='utf-8') == 'Hello\n\fWorld\n'
+    assert not output_file.exists()
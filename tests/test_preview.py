@@ -0,0 +1,33 @@
+"""A superseded preview stops at its next step instead of running to the end."""
+
+import pytest
+
+import klasiko
+
+pytest.importorskip('pypdfium2')
+
+
+def test_cancelled_preview_stops_before_layout(tmp_path, monkeypatch):
+    markdown_file = tmp_path / 'doc.md'
+    markdown_file.write_text('# Title\n\nBody', encoding='utf-8')
+
+    def layout(*args, **kwargs):
+        raise AssertionError("a cancelled preview must not be laid out")
+
+    monkeypatch.setattr(klasiko, 'HTML', layout)
+    with pytest.raises(klasiko.PreviewCancelled):
+        klasiko.render_preview(str(markdown_file), cancelled=lambda: True)
+
+
+def test_preview_stops_when_cancelled_during_layout(tmp_path):
+    markdown_file = tmp_path / 'doc.md'
+    markdown_file.write_text('# Title\n\n' + 'Body text. ' * 400, encoding='utf-8')
+    checks = []
+
+    def cancelled():
+        checks.append(len(checks))
+        return len(checks) > 1  # cancelled while the first layout ran
+
+    with pytest.raises(klasiko.PreviewCancelled):
+        klasiko.render_preview(str(markdown_file), cancelled=cancelled)
+    assert len(checks) == 2
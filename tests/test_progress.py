@@ -0,0 +1,33 @@
+"""Layout progress events follow WeasyPrint's log without repeating or going back."""
+
+import logging
+
+import klasiko
+
+
+def test_repagination_does_not_repeat_pages():
+    events = []
+    logger = logging.getLogger('weasyprint.progress')
+    with klasiko.layout_progress(events.append, estimated_pages=3):
+        # WeasyPrint 70: a first pass, then a repagination that redoes page 1,
+        # keeps page 2 and adds page 4
+        for page in (1, 2, 3):
+            logger.info('Step 5 - Creating layout - Page %d', page)
+        logger.info('Step 5 - Creating layout - Repagination #%d', 1)
+        logger.info('Step 5 - Creating layout - Page %d', 1)
+        logger.info('Step 5 - Creating layout - Page %d (up-to-date)', 2)
+        logger.info('Step 5 - Creating layout - Page %d', 3)
+        logger.info('Step 5 - Creating layout - Page %d', 4)
+
+    assert [(event['event'], event.get('page'), event['pass']) for event in events] == [
+        ('page', 1, 0), ('page', 2, 0), ('page', 3, 0), ('repaginate', None, 1), ('page', 4, 1),
+    ]
+    assert events[3]['pages'] == 3
+
+
+def test_handler_is_removed_after_layout():
+    events = []
+    with klasiko.layout_progress(events.append):
+        pass
+    logging.getLogger('weasyprint.progress').info('Step 5 - Creating layout - Page %d', 1)
+    assert events == []
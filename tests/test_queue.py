@@ -0,0 +1,37 @@
+"""Queue jobs fail permanently on bad input and are retried on anything else."""
+
+import json
+
+import pytest
+
+import klasiko
+
+
+def queue_job(tmp_path, input_name='doc.md'):
+    return {'input': str(tmp_path / input_name), 'output': str(tmp_path / 'out' / 'doc.pdf'), 'options': json.dumps({})}
+
+
+def test_missing_input_is_permanent(tmp_path):
+    result = klasiko.run_queue_job(queue_job(tmp_path, 'missing.md'))
+    assert not result['success']
+    assert result['permanent']
+    assert result['log'].startswith('FileNotFoundError: ')
+
+
+@pytest.mark.parametrize('error, permanent', [
+    (ValueError('bad page range'), True),
+    (UnicodeDecodeError('utf-8', b'\xff', 0, 1, 'invalid start byte'), True),
+    (RuntimeError('renderer crashed'), False),
+    (MemoryError(), False),
+])
+def test_failure_is_classified_by_exception_type(tmp_path, monkeypatch, error, permanent):
+    (tmp_path / 'doc.md').write_text('# Title\n\nBody', encoding='utf-8')
+
+    def render(*args, **kwargs):
+        raise error
+
+    monkeypatch.setattr(klasiko, 'render_html_to_outputs', render)
+    result = klasiko.run_queue_job(queue_job(tmp_path))
+    assert not result['success']
+    assert result['permanent'] is permanent
+    assert result['log'].startswith(type(error).__name__)
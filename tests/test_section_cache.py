@@ -0,0 +1,61 @@
+"""--section-cache lays out sections apart, except when the CSS needs the whole document."""
+
+import pytest
+
+import klasiko
+
+
+class RecordingHTML:
+    """Stands in for weasyprint.HTML, recording what is laid out (one page per 'page' div)."""
+
+    layouts = []
+
+    def __init__(self, string, base_url=None):
+        self.string = string
+
+    def render(self, font_config=None):
+        RecordingHTML.layouts.append(self.string)
+        return RecordedDocument(['page'] * max(1, self.string.count('break-after: page') + 1))
+
+
+class RecordedDocument:
+    def __init__(self, pages):
+        self.pages = pages
+
+    def copy(self, pages):
+        return RecordedDocument(pages)
+
+
+@pytest.fixture
+def layouts(monkeypatch):
+    RecordingHTML.layouts = []
+    monkeypatch.setattr(klasiko, 'HTML', RecordingHTML)
+    return RecordingHTML.layouts
+
+
+def complete_html(custom_css=None):
+    html_content = '<p>Intro</p>\n<h2>One</h2>\n<p>First</p>\n<h2>Two</h2>\n<p>Second</p>\n'
+    return klasiko.create_complete_html_document(html_content, 'Report', custom_css=custom_css)
+
+
+def test_sections_are_laid_out_apart_and_reused(layouts):
+    cache = klasiko.SectionLayoutCache()
+    cache.render(complete_html())
+    assert cache.rendered == len(layouts) == 4
+    assert not cache.whole_document
+
+    cache.render(complete_html())
+    assert (cache.reused, cache.rendered) == (4, 0)
+
+
+@pytest.mark.parametrize('css', [
+    '@page { @bottom-center { content: counter(page) " of " counter(pages); } }',
+    '@page :nth(2) { margin-top: 4cm; }',
+])
+def test_whole_document_css_disables_sections(layouts, css):
+    cache = klasiko.SectionLayoutCache()
+    html = complete_html(custom_css=css)
+    cache.render(html)
+    assert cache.whole_document
+    assert layouts == [html]
+    assert (cache.reused, cache.rendered, cache.fragments) == (0, 1, {})
@@ -0,0 +1,87 @@
+"""A stamped render (--stamp) must look the same as laying the decorations out on every page."""
+
+import base64
+import io
+import struct
+import zlib
+
+import pytest
+
+import klasiko
+
+pytest.importorskip('pikepdf')
+pytest.importorskip('pypdfium2')
+ImageChops = pytest.importorskip('PIL.ImageChops')
+Image = pytest.importorskip('PIL.Image')
+
+PLACEMENTS = [
+    {'position': 'header', 'size': 'small'},
+    {'position': 'footer', 'size': 'small'},
+    {'position': 'watermark', 'size': 'large'},
+]
+# Long enough for a first page and several later ones, which use the other stamp page
+DOCUMENT = "# Stamped Report\n\n" + "\n\n".join(
+    f"## Section {n}\n\n" + "A paragraph of body text that runs across the page. " * 12 for n in range(1, 7)
+)
+
+
+def logo_png():
+    """A 16x16 two-colour PNG logo."""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    rows = b''.join(b'\x00' + (b'\xc0\x30\x30' * 8 + b'\x30\x30\xc0' * 8) for _ in range(16))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', 16, 16, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+
+def render_pages(tmp_path, theme, stamp):
+    markdown_file = tmp_path / 'report.md'
+    markdown_file.write_text(DOCUMENT, encoding='utf-8')
+    output_file = tmp_path / f"report-{theme}-{'stamped' if stamp else 'inline'}.pdf"
+    logo_data_uri = 'data:image/png;base64,' + base64.b64encode(logo_png()).decode('ascii')
+    assert klasiko.convert_md_to_pdf(str(markdown_file), str(output_file), theme=theme, logo_data_uri=logo_data_uri,
+                                     logo_placements=PLACEMENTS, stamp=stamp)
+    return [Image.open(io.BytesIO(png)).convert('RGB')
+            for png in klasiko.rasterize_pdf_pages(output_file.read_bytes(), resolution=72)]
+
+
+@pytest.mark.parametrize('theme', ['warm', 'clean'])
+def test_stamped_pages_match_inline_render(tmp_path, theme):
+    inline = render_pages(tmp_path, theme, stamp=False)
+    stamped = render_pages(tmp_path, theme, stamp=True)
+
+    assert len(inline) > 2
+    assert len(stamped) == len(inline)
+    for number, (expected, image) in enumerate(zip(inline, stamped), start=1):
+        assert image.size == expected.size
+        # Anti-aliased edges may round differently when drawn from a form
+        difference = ImageChops.difference(image, expected).convert('L').point(lambda value: 255 if value > 8 else 0)
+        changed = sum(difference.histogram()[255:])
+        assert changed <= image.width * image.height // 1000, f"page {number}: {changed} pixels differ"
+
+
+def test_stamp_cache_is_keyed_by_base_url(tmp_path, monkeypatch):
+    laid_out = []
+
+    class RecordingHTML:
+        def __init__(self, string, base_url=None):
+            self.base_url = base_url
+
+        def render(self, font_config=None):
+            laid_out.append(self.base_url)
+            return self
+
+        def write_pdf(self):
+            return f'stamp for {self.base_url}'.encode('utf-8')
+
+    monkeypatch.setattr(klasiko, 'HTML', RecordingHTML)
+    monkeypatch.setattr(klasiko, '_STAMP_CACHE', {})
+    stamp_html = klasiko.create_stamp_html('warm', 'data:image/png;base64,' + base64.b64encode(logo_png()).decode(),
+                                           PLACEMENTS, 'body { background: url(paper.png); }')
+    first, second = str(tmp_path / 'a'), str(tmp_path / 'b')
+
+    assert klasiko.render_stamp_pdf(stamp_html, first) == f'stamp for {first}'.encode('utf-8')
+    assert klasiko.render_stamp_pdf(stamp_html, second) == f'stamp for {second}'.encode('utf-8')
+    assert klasiko.render_stamp_pdf(stamp_html, first) == f'stamp for {first}'.encode('utf-8')
+    assert laid_out == [first, second]
@@ -0,0 +1,23 @@
+"""Themes are looked up by name; a missing one is an error, not a silent fallback."""
+
+import pytest
+
+import klasiko
+
+
+def test_unknown_theme_is_refused():
+    with pytest.raises(ValueError, match="Unknown theme 'no-such-theme'. Choose from: .*warm"):
+        klasiko.get_theme_css('no-such-theme')
+
+
+def test_missing_theme_directory_is_reported(tmp_path, monkeypatch):
+    monkeypatch.setattr(klasiko, 'BUILTIN_THEME_DIR', tmp_path / 'themes')
+    monkeypatch.setattr(klasiko, 'get_user_theme_dir', lambda: tmp_path / 'user-themes')
+    with pytest.raises(ValueError, match='theme directory .*themes is missing or empty'):
+        klasiko.get_theme_css('warm')
+
+
+def test_user_theme_overrides_builtin(tmp_path, monkeypatch):
+    (tmp_path / 'warm.css').write_text('body { color: #123456; }', encoding='utf-8')
+    monkeypatch.setattr(klasiko, 'get_user_theme_dir', lambda: tmp_path)
+    assert '#123456' in klasiko.get_theme_css('warm')
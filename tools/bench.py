@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for klasiko's conversion paths (development tool, not part of
+the installed app).
+
+Usage:
+    python tools/bench.py [document.md] [--toc] [--iterations N]
+        [--incremental | --lexers | --fast-parse | --parsers | --stamp LOGO]
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import markdown
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT), str(ROOT / 'tests')]
+
+from klasiko import (  # noqa: E402
+    _STAMP_CACHE, DEFAULT_MARKDOWN_BACKEND, FENCED_REGION_PATTERN, HTML, MARKDOWN_BACKENDS, MARKDOWN_EXTENSIONS,
+    PIKEPDF_AVAILABLE, PYGMENTS_AVAILABLE, IncrementalMarkdownConverter, MarkdownParserPool, build_markdown_parser,
+    create_complete_html_document, create_stamp_html, detect_markdown_extensions, document_code_options,
+    extract_title_from_markdown, get_font_configuration, markdown_parser_key, markdown_to_html,
+    process_logo_argument, read_markdown_file, render_stamp_pdf, split_markdown_blocks, stamp_pdf_pages,
+)
+from markdown_checks import (  # noqa: E402
+    MARKDOWN_CORPUS, SAMPLE_MARKDOWN, check_code_highlighting, check_fast_parse, check_incremental_conversion,
+    check_markdown_backend, code_corpus,
+)
+
+def bench_parser_setup(markdown_content, iterations=200, enable_toc=False):
+    """
+    Time per-document Markdown parsing with a fresh parser versus a pooled one.
+
+    Args:
+        markdown_content (str): Document parsed on every iteration
+        iterations (int): Documents parsed per measurement
+        enable_toc (bool): Whether the parser generates a table of contents
+
+    Returns:
+        dict: Milliseconds per document for 'fresh_setup', 'pooled_setup',
+            'fresh_parse' and 'pooled_parse'
+    """
+    key = markdown_parser_key(enable_toc)
+    pool = MarkdownParserPool()
+    build_markdown_parser(key)  # import the extension modules once up front
+
+    def per_document(function):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            function()
+        return (time.perf_counter() - started) * 1000 / iterations
+
+    def pooled_setup():
+        with pool.parser(enable_toc):
+            pass
+
+    def fresh_parse():
+        build_markdown_parser(key).convert(markdown_content)
+
+    def pooled_parse():
+        with pool.parser(enable_toc) as md:
+            md.convert(markdown_content)
+
+    return {
+        'fresh_setup': per_document(lambda: build_markdown_parser(key)),
+        'pooled_setup': per_document(pooled_setup),
+        'fresh_parse': per_document(fresh_parse),
+        'pooled_parse': per_document(pooled_parse),
+    }
+
+
+def bench_incremental_conversion(markdown_content, iterations=20, enable_toc=False):
+    """
+    Time reconverting a document after a one-paragraph edit, full versus incremental.
+
+    Each iteration appends a sentence to a different block. After every edit
+    the incremental result is checked against a full conversion.
+
+    Args:
+        markdown_content (str): Document to edit and convert
+        iterations (int): Edits measured
+        enable_toc (bool): Whether to generate table of contents
+
+    Returns:
+        dict: Milliseconds per edit for 'full' and 'incremental', blocks
+            'reused' and 'converted' on the last edit, and 'differences' from
+            check_incremental_conversion() on any edit that didn't match
+    """
+    blocks = split_markdown_blocks(markdown_content)
+    converter = IncrementalMarkdownConverter()
+    converter.convert(markdown_content, enable_toc)
+
+    full = incremental = 0.0
+    differences = []
+    for iteration in range(iterations):
+        edited = list(blocks)
+        index = (iteration * 7919) % len(edited)
+        edited[index] += f" Edit {iteration}."
+        edited_content = '\n\n'.join(edited)
+
+        started = time.perf_counter()
+        markdown_to_html(edited_content, enable_toc)
+        full += time.perf_counter() - started
+
+        started = time.perf_counter()
+        converter.convert(edited_content, enable_toc)
+        incremental += time.perf_counter() - started
+        reused, converted = converter.reused, converter.converted
+
+        differences.extend(check_incremental_conversion(edited_content, enable_toc, converter))
+
+    return {
+        'full': full * 1000 / iterations,
+        'incremental': incremental * 1000 / iterations,
+        'reused': reused,
+        'converted': converted,
+        'differences': differences,
+    }
+
+
+def bench_lexer_resolution(markdown_content, iterations=5):
+    """
+    Time code highlighting with codehilite's defaults (language guessing on),
+    with guessing off, and with klasiko's CodeHighlightExtension.
+
+    Args:
+        markdown_content (str): Document converted on every iteration
+        iterations (int): Documents converted per measurement
+
+    Returns:
+        dict: Milliseconds per document for 'guessing', 'no_guessing' and
+            'klasiko', plus 'matches' (klasiko's HTML equals codehilite's with
+            the same guessing setting)
+    """
+    code_options = document_code_options(markdown_content)
+    parsers = {
+        'guessing': markdown.Markdown(extensions=list(MARKDOWN_EXTENSIONS) + ['codehilite']),
+        'no_guessing': markdown.Markdown(
+            extensions=list(MARKDOWN_EXTENSIONS) + ['codehilite'],
+            extension_configs={'codehilite': {'guess_lang': False}}
+        ),
+        'klasiko': build_markdown_parser(markdown_parser_key(code_options=code_options)),
+    }
+
+    timings = {}
+    for name, md in parsers.items():
+        md.convert(markdown_content)  # warm up lexer imports
+        md.reset()
+        started = time.perf_counter()
+        for _ in range(iterations):
+            md.convert(markdown_content)
+            md.reset()
+        timings[name] = (time.perf_counter() - started) * 1000 / iterations
+
+    timings['matches'] = not check_code_highlighting(markdown_content)
+    return timings
+
+
+def bench_fast_parse(markdown_content, iterations=20, enable_toc=False):
+    """
+    Time a full parse against a fast parse and check the fast one against
+    MARKDOWN_CORPUS plus the document, with and without a TOC.
+
+    Args:
+        markdown_content (str): Document parsed on every iteration
+        iterations (int): Documents parsed per measurement
+        enable_toc (bool): Whether to generate table of contents
+
+    Returns:
+        dict: Milliseconds per document for 'full' and 'fast', the detected
+            'extensions', the number of 'checked' documents and the 'differences'
+    """
+    def per_document(fast_parse):
+        markdown_to_html(markdown_content, enable_toc, fast_parse=fast_parse)  # build the pooled parser
+        started = time.perf_counter()
+        for _ in range(iterations):
+            markdown_to_html(markdown_content, enable_toc, fast_parse=fast_parse)
+        return (time.perf_counter() - started) * 1000 / iterations
+
+    snippets = [snippet for _, snippet in MARKDOWN_CORPUS]
+    documents = snippets + ['\n\n'.join(snippets), markdown_content]
+    differences = []
+    for document in documents:
+        for toc in (False, True):
+            differences += [f"{document[:30]!r} (toc {'on' if toc else 'off'}): {difference}"
+                            for difference in check_fast_parse(document, toc)]
+    return {
+        'full': per_document(False),
+        'fast': per_document(True),
+        'extensions': detect_markdown_extensions(markdown_content, enable_toc),
+        'checked': len(documents) * 2,
+        'differences': differences,
+    }
+
+
+def bench_markdown_backends(markdown_content, iterations=20, enable_toc=False):
+    """
+    Time every installed backend and diff each against Python-Markdown on
+    MARKDOWN_CORPUS plus the document, with and without a TOC.
+
+    Differences in constructs a backend lists as unsupported are expected;
+    any other difference is a conformance failure.
+
+    Args:
+        markdown_content (str): Document parsed on every iteration
+        iterations (int): Documents parsed per measurement
+        enable_toc (bool): Whether to generate table of contents
+
+    Returns:
+        dict: Milliseconds per document by backend ('timings'), the number of
+            'checked' documents, and 'expected' and 'unexpected' differences
+            as (backend, construct, description) tuples
+    """
+    backends = [name for name, backend in MARKDOWN_BACKENDS.items() if backend.available()]
+    timings = {}
+    for name in backends:
+        markdown_to_html(markdown_content, enable_toc, parser_backend=name)  # build the parser
+        started = time.perf_counter()
+        for _ in range(iterations):
+            markdown_to_html(markdown_content, enable_toc, parser_backend=name)
+        timings[name] = (time.perf_counter() - started) * 1000 / iterations
+
+    documents = list(MARKDOWN_CORPUS) + [('document', markdown_content)]
+    expected, unexpected = [], []
+    for name in backends:
+        if name == DEFAULT_MARKDOWN_BACKEND:
+            continue
+        for construct, document in documents:
+            for toc in (False, True):
+                for difference in check_markdown_backend(document, name, toc):
+                    entry = (name, construct, f"{document[:30]!r} (toc {'on' if toc else 'off'}): {difference}")
+                    if construct in MARKDOWN_BACKENDS[name].unsupported:
+                        expected.append(entry)
+                    else:
+                        unexpected.append(entry)
+    return {
+        'timings': timings,
+        'checked': len(documents) * 2 * (len(backends) - 1),
+        'expected': expected,
+        'unexpected': unexpected,
+    }
+
+
+BENCH_STAMP_PLACEMENTS = [
+    {'position': 'header', 'size': 'small'},
+    {'position': 'footer', 'size': 'small'},
+    {'position': 'watermark', 'size': 'large'},
+]
+
+
+def bench_stamping(markdown_content, logo_data_uri, iterations=3, theme='warm'):
+    """
+    Time rendering a document with header, footer and watermark logos laid
+    out on every page against laying them out once and stamping them.
+
+    Args:
+        markdown_content (str): Document rendered on every iteration
+        logo_data_uri (str): Base64 data URI of the logo
+        iterations (int): Renders per measurement
+        theme (str): Visual theme
+
+    Returns:
+        dict: Milliseconds per render for 'inline' and 'stamped' (including
+            one stamp layout), and the number of 'pages'
+    """
+    html_content, _ = markdown_to_html(markdown_content)
+    title = extract_title_from_markdown(markdown_content) or 'Document'
+    stamp_html = create_stamp_html(theme, logo_data_uri, BENCH_STAMP_PLACEMENTS)
+
+    def per_render(stamped):
+        complete_html = create_complete_html_document(html_content, title, theme=theme, logo_data_uri=logo_data_uri,
+                                                      logo_placements=BENCH_STAMP_PLACEMENTS, stamped=stamped)
+        _STAMP_CACHE.clear()
+        started = time.perf_counter()
+        for _ in range(iterations):
+            document = HTML(string=complete_html).render(font_config=get_font_configuration())
+            pdf_bytes = document.write_pdf()
+            if stamped:
+                stamp_indexes = [min(index, 1) for index in range(len(document.pages))]
+                stamp_pdf_pages(pdf_bytes, render_stamp_pdf(stamp_html), stamp_indexes)
+        return (time.perf_counter() - started) * 1000 / iterations, len(document.pages)
+
+    get_font_configuration()
+    inline, pages = per_render(False)
+    stamped, _ = per_render(True)
+    return {'inline': inline, 'stamped': stamped, 'pages': pages}
+
+
+def main(argv):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(
+        prog='tools/bench.py',
+        description='Microbenchmark Markdown parsing: parser setup (fresh versus pooled), '
+                    'reconverting after an edit (full versus incremental), code highlighting, '
+                    'parsing with only the extensions a document uses, the parser backends, '
+                    'or stamped page decorations'
+    )
+    parser.add_argument('input', nargs='?', help='Markdown file to parse (default: a built-in sample)')
+    parser.add_argument(
+        '--iterations',
+        type=int,
+        help='Documents parsed per measurement (default: 200, or 5 with --lexers)'
+    )
+    parser.add_argument('--toc', action='store_true', help='Benchmark the table-of-contents parser configuration')
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='Edit one block per iteration and compare full with incremental conversion, checking they match'
+    )
+    parser.add_argument(
+        '--lexers',
+        action='store_true',
+        help='Compare code highlighting with language guessing, without it, and with klasiko\'s lexer lookup '
+             '(default document: a built-in code-heavy sample)'
+    )
+    parser.add_argument(
+        '--fast-parse',
+        action='store_true',
+        help='Compare a full parse with --fast-parse, checking the HTML matches on a built-in corpus and the document'
+    )
+    parser.add_argument(
+        '--parsers',
+        action='store_true',
+        help='Time each installed --parser backend and diff its HTML against Python-Markdown on a built-in corpus '
+             'and the document'
+    )
+    parser.add_argument(
+        '--stamp',
+        metavar='LOGO',
+        help='Render the document with this logo as header, footer and watermark, laid out on every page '
+             'versus stamped after layout (default iterations: 3)'
+    )
+    args = parser.parse_args(argv)
+
+    if args.iterations is None:
+        args.iterations = 3 if args.stamp else 5 if args.lexers else 200
+    if args.iterations < 1:
+        parser.error("--iterations must be at least 1")
+    if args.lexers + args.incremental + args.fast_parse + args.parsers + bool(args.stamp) > 1:
+        parser.error("--lexers, --incremental, --fast-parse, --parsers and --stamp are separate benchmarks")
+    if args.input:
+        markdown_content = read_markdown_file(args.input)
+    else:
+        markdown_content = code_corpus() if args.lexers else SAMPLE_MARKDOWN
+
+    if args.stamp:
+        if not PIKEPDF_AVAILABLE:
+            parser.error("--stamp requires pikepdf. Install with: pip install pikepdf")
+        logo_data_uri = process_logo_argument(args.stamp)
+        result = bench_stamping(markdown_content, logo_data_uri, args.iterations)
+        print(f"\n{'='*60}")
+        print(f"⏱️  Page decorations, {args.iterations} renders ({result['pages']} pages)")
+        print(f"{'='*60}")
+        speedup = result['inline'] / result['stamped'] if result['stamped'] else float('inf')
+        for name, timing in (('inline', result['inline']), ('stamped', result['stamped'])):
+            print(f"  {name:<8} {timing:>10.1f}ms  {timing / result['pages']:>7.2f}ms/page")
+        print(f"  speedup  {speedup:>9.2f}x")
+        print(f"{'='*60}\n")
+        return 0
+
+    if args.parsers:
+        result = bench_markdown_backends(markdown_content, args.iterations, args.toc)
+        print(f"\n{'='*60}")
+        print(f"⏱️  Markdown parsers, {args.iterations} documents ({len(markdown_content)} chars)")
+        print(f"{'='*60}")
+        reference = result['timings'][DEFAULT_MARKDOWN_BACKEND]
+        for name, timing in result['timings'].items():
+            speedup = reference / timing if timing else float('inf')
+            print(f"  {name:<16} {timing:>8.3f}ms  ({speedup:.1f}x)")
+        for name, backend in MARKDOWN_BACKENDS.items():
+            if name not in result['timings']:
+                print(f"  {name:<16} not installed ({backend.requirement})")
+        if len(result['timings']) > 1:
+            constructs = sorted({construct for _, construct, _ in result['expected']})
+            if constructs:
+                print(f"  expected differences (unsupported): {', '.join(constructs)}")
+            if result['unexpected']:
+                print(f"✗ Backends differ from Python-Markdown:")
+                for name, construct, difference in result['unexpected'][:5]:
+                    print(f"    {name} [{construct}] {difference}")
+            else:
+                print(f"✓ Same HTML structure as Python-Markdown on {result['checked']} documents")
+        print(f"{'='*60}\n")
+        return 1 if result['unexpected'] else 0
+
+    if args.fast_parse:
+        result = bench_fast_parse(markdown_content, args.iterations, args.toc)
+        print(f"\n{'='*60}")
+        print(f"⏱️  Fast parse, {args.iterations} documents ({len(markdown_content)} chars)")
+        print(f"{'='*60}")
+        speedup = result['full'] / result['fast'] if result['fast'] else float('inf')
+        print(f"  full        {result['full']:>8.3f}ms")
+        print(f"  fast        {result['fast']:>8.3f}ms  ({speedup:.1f}x)")
+        print(f"  extensions  {', '.join(result['extensions']) or 'none'}")
+        if result['differences']:
+            print(f"✗ Fast parse differs from a full parse:")
+            for difference in result['differences'][:5]:
+                print(f"    {difference}")
+        else:
+            print(f"✓ Same HTML as a full parse on {result['checked']} documents")
+        print(f"{'='*60}\n")
+        return 1 if result['differences'] else 0
+
+    if args.lexers:
+        if not PYGMENTS_AVAILABLE:
+            parser.error("code highlighting needs Pygments: pip install Pygments")
+        timings = bench_lexer_resolution(markdown_content, args.iterations)
+        fences = len(FENCED_REGION_PATTERN.findall(markdown_content))
+        print(f"\n{'='*60}")
+        print(f"⏱️  Code highlighting, {args.iterations} documents ({fences} fenced blocks, {len(markdown_content)} chars)")
+        print(f"{'='*60}")
+        for name, label in (('guessing', 'guessing'), ('no_guessing', 'no guessing'), ('klasiko', 'klasiko')):
+            speedup = timings['guessing'] / timings[name] if timings[name] else float('inf')
+            print(f"  {label:<12} {timings[name]:>9.2f}ms  ({speedup:.1f}x)")
+        if timings['matches']:
+            print(f"✓ klasiko's HTML matches codehilite with the same guessing setting")
+        else:
+            print(f"✗ klasiko's HTML differs from codehilite with the same guessing setting")
+        print(f"{'='*60}\n")
+        return 0 if timings['matches'] else 1
+
+    if args.incremental:
+        if not markdown_content.strip():
+            parser.error("the document is empty")
+        result = bench_incremental_conversion(markdown_content, args.iterations, args.toc)
+        print(f"\n{'='*60}")
+        print(f"⏱️  Reconverting after an edit, {args.iterations} edits ({len(markdown_content)} chars)")
+        print(f"{'='*60}")
+        speedup = result['full'] / result['incremental'] if result['incremental'] else float('inf')
+        print(f"  full        {result['full']:>8.3f}ms")
+        print(f"  incremental {result['incremental']:>8.3f}ms  ({speedup:.1f}x)")
+        print(f"  blocks      {result['reused']} reused, {result['converted']} converted")
+        if result['differences']:
+            print(f"✗ Incremental output differs from a full conversion:")
+            for difference in result['differences'][:5]:
+                print(f"    {difference}")
+        else:
+            print(f"✓ Output matches a full conversion after every edit")
+        print(f"{'='*60}\n")
+        return 1 if result['differences'] else 0
+
+    timings = bench_parser_setup(markdown_content, args.iterations, args.toc)
+    print(f"\n{'='*60}")
+    print(f"⏱️  Markdown parser, {args.iterations} documents ({len(markdown_content)} chars each)")
+    print(f"{'='*60}")
+    print(f"  {'':<8} {'fresh':>10} {'pooled':>10} {'speedup':>9}")
+    for stage in ('setup', 'parse'):
+        fresh, pooled = timings[f'fresh_{stage}'], timings[f'pooled_{stage}']
+        speedup = fresh / pooled if pooled else float('inf')
+        print(f"  {stage:<8} {fresh:>8.3f}ms {pooled:>8.3f}ms {speedup:>8.1f}x")
+    print(f"{'='*60}\n")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))